@@ -0,0 +1,70 @@
+import os
+import sys
+import json
+import logging
+import argparse
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from src.services.grounding_benchmark import (
+    BOX_FORMATS, COORD_SCALES, PipelinePredictor, StubPredictor, compare_reports, load_dataset, run_benchmark, save_report,
+    select_samples
+)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Grounding accuracy and latency benchmark over a local dataset")
+    parser.add_argument("--dataset", type=str, required=True, help="Directory with raw_annotations.json and images/")
+    parser.add_argument("--model", type=str, default="qwen", help="qwen, mai or a full HF model path")
+    parser.add_argument("--box-format", choices=BOX_FORMATS, default=None,
+                        help="Ground truth box convention (default: dataset schema.json, else inferred once for the dataset)")
+    parser.add_argument("--coord-scale", choices=COORD_SCALES, default=None,
+                        help="Ground truth coordinates in pixels or 0-1 fractions (default: schema.json, else inferred)")
+    parser.add_argument("--limit", type=int, default=None, help="Number of samples to run")
+    parser.add_argument("--seed", type=int, default=None, help="Shuffle samples with this seed before --limit")
+    parser.add_argument("--parallelism", type=int, default=1, help="Concurrent requests")
+    parser.add_argument("--coarse-to-fine", action="store_true", help="Two-stage grounding (low-res pass, then full-res crop)")
+    parser.add_argument("--tiled", action="store_true", help="Split large images into overlapping native-resolution tiles")
+    parser.add_argument("--stub", action="store_true", help="Use the stub engine (no model load)")
+    parser.add_argument("--stub-latency", type=float, default=0.05, help="Simulated seconds per request (stub)")
+    parser.add_argument("--stub-jitter", type=float, default=0.01, help="Box noise as a fraction of the image (stub)")
+    parser.add_argument("--output", type=str, default="runs/benchmarks/report.json")
+    parser.add_argument("--compare", type=str, default=None, help="Previous report to diff against")
+    args = parser.parse_args()
+
+    samples, schema = load_dataset(args.dataset, args.box_format, args.coord_scale)
+    samples = select_samples(samples, args.limit, args.seed)
+    if not samples:
+        logger.error(f"No usable samples in {args.dataset}")
+        sys.exit(1)
+
+    if args.stub:
+        predictor = StubPredictor(latency=args.stub_latency, jitter=args.stub_jitter, seed=args.seed or 0)
+    else:
+        predictor = PipelinePredictor(model=args.model, coarse_to_fine=args.coarse_to_fine, tiled=args.tiled)
+
+    logger.info(f"Running {len(samples)} samples with parallelism {args.parallelism}...")
+    report = run_benchmark(samples, predictor, parallelism=args.parallelism, metadata={
+        "dataset": os.path.abspath(args.dataset),
+        "model": "stub" if args.stub else args.model,
+        "coarse_to_fine": args.coarse_to_fine,
+        "tiled": args.tiled,
+        "schema": schema,
+        "limit": args.limit,
+        "seed": args.seed,
+    })
+    save_report(report, args.output)
+    logger.info(f"Report saved to {args.output}")
+
+    summary = {"metrics": report["metrics"], "latency": report["latency"], "throughput": report["throughput"]}
+    if args.compare:
+        with open(args.compare, "r") as f:
+            summary["diff"] = compare_reports(json.load(f), report)
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,135 +1,119 @@
 import os
+import sys
 import argparse
 import logging
-from datasets import load_dataset
-from PIL import Image
+from datasets import DatasetDict, Image, load_dataset, load_from_disk
 from tqdm import tqdm
 
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from src.services.dataset_materializer import DatasetMaterializer
+
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def download_fiftyone_gui(output_dir: str):
+def open_dataset(source: str, split: str = "train"):
     """
-    Downloads the FiftyOne-GUI-Grounding-Train dataset.
-    This dataset typically contains 'image' (PIL) and 'ground_truth' (objects).
+    Opens a Hugging Face dataset in streaming mode, or a local one:
+    a directory written by `save_to_disk`, or an imagefolder (images + metadata.jsonl).
+    Images are left undecoded so the worker processes do the decoding.
     """
-    logger.info("Downloading FiftyOne-GUI-Grounding-Train dataset...")
-    
-    # Create target directory
-    dataset_path = os.path.join(output_dir, "fiftyone_gui")
-    os.makedirs(dataset_path, exist_ok=True)
-    
-    # Load from Hugging Face
+    if os.path.isdir(source):
+        if os.path.exists(os.path.join(source, "dataset_dict.json")) or os.path.exists(os.path.join(source, "state.json")):
+            ds = load_from_disk(source)
+            if isinstance(ds, DatasetDict):
+                ds = ds[split]
+        else:
+            ds = load_dataset("imagefolder", data_dir=source, split=split)
+    else:
+        ds = load_dataset(source, split=split, streaming=True)
+
+    features = getattr(ds, "features", None) or {}
+    if "image" in features:
+        ds = ds.cast_column("image", Image(decode=False))
+    return ds
+
+def dataset_size(ds, split: str = "train"):
+    if hasattr(ds, "__len__"):
+        return len(ds)
     try:
-        ds = load_dataset("harpreetsahota/FiftyOne-GUI-Grounding-Train", split="train")
+        return ds.info.splits[split].num_examples
+    except (AttributeError, KeyError, TypeError):
+        return None
+
+def materialize(source: str, dataset_path: str, prefix: str, args):
+    """
+    Streams `source` into dataset_path (images/ + annotations/ shards + raw_annotations.json).
+    Re-running resumes after the last completed shard.
+    """
+    try:
+        ds = open_dataset(source)
     except Exception as e:
         logger.error(f"Failed to load dataset: {e}")
         return
 
-    # Save images and metadata
-    # Format: 
+    total = dataset_size(ds)
+    if args.limit:
+        ds = ds.take(args.limit) if hasattr(ds, "take") else ds.select(range(min(args.limit, len(ds))))
+        total = min(total, args.limit) if total else args.limit
+
+    materializer = DatasetMaterializer(
+        dataset_path, prefix, shard_size=args.shard_size, workers=args.workers,
+        source=os.path.abspath(source) if os.path.isdir(source) else source
+    )
+    logger.info(f"Processing {total if total is not None else 'unknown number of'} samples...")
+    try:
+        with tqdm(total=total) as bar:
+            stats = materializer.run(ds, progress=bar.update)
+    except ValueError as e:
+        logger.error(f"Cannot resume: {e}")
+        return
+    logger.info(f"Materialized {stats['written']} samples ({stats['skipped']} skipped, resumed from {stats['resumed_from']})")
+
+def download_fiftyone_gui(output_dir: str, args):
+    """
+    Downloads the FiftyOne-GUI-Grounding-Train dataset.
+    This dataset typically contains 'image' (PIL) and 'ground_truth' (objects).
+    """
+    logger.info("Downloading FiftyOne-GUI-Grounding-Train dataset...")
+
+    # Format:
     #   fiftyone_gui/
     #     images/
-    #     annotations.json (COCO style or custom JSON to be parsed later)
-    
-    images_dir = os.path.join(dataset_path, "images")
-    os.makedirs(images_dir, exist_ok=True)
-    
-    annotations = []
-    
-    logger.info(f"Processing {len(ds)} samples...")
-    for i, item in tqdm(enumerate(ds), total=len(ds)):
-        # 1. Save Image
-        image = item.get('image')
-        if not image:
-            continue
-            
-        file_name = f"fiftyone_{i:05d}.jpg"
-        image_path = os.path.join(images_dir, file_name)
-        
-        if image.mode != "RGB":
-            image = image.convert("RGB")
-        image.save(image_path)
-        
-        # 2. Extract Annotations
-        # The structure of 'ground_truth' depends on the dataset. 
-        # Inspecting typical HF dataset structure: objects usually have 'bbox' and 'label'.
-        # Note: Bboxes in HF are often [x, y, w, h] or [x_min, y_min, x_max, y_max].
-        
-        # NOTE: This is a placeholder logic. You might need to inspect `item` keys 
-        # if the dataset schema differs.
-        # Assuming typical 'objects' key or similar.
-        # If 'ground_truth' is a string/json, parse it.
-        
-        # For this specific dataset, we might need to explore structure first.
-        # But let's assume we dump the raw item (excluding image object) to JSON
-        # so unify_datasets.py can parse it.
-        
-        meta = {k: v for k, v in item.items() if k != 'image'}
-        meta['file_name'] = file_name
-        meta['width'] = image.width
-        meta['height'] = image.height
-        annotations.append(meta)
-
-    # Save all metadata to a single JSON
-    with open(os.path.join(dataset_path, "raw_annotations.json"), "w") as f:
-        json.dump(annotations, f, indent=2)
-        
+    #     annotations/shard-*.ndjson (written as we go, used to resume)
+    #     raw_annotations.json (every sample's raw fields minus the image, parsed later by unify_datasets.py)
+    dataset_path = os.path.join(output_dir, "fiftyone_gui")
+    materialize(args.source or "harpreetsahota/FiftyOne-GUI-Grounding-Train", dataset_path, "fiftyone", args)
+
     logger.info(f"FiftyOne GUI dataset saved to {dataset_path}")
 
-def download_showui_web(output_dir: str):
+def download_showui_web(output_dir: str, args):
     """
     Downloads ShowUI_Web dataset.
     """
     logger.info("Downloading ShowUI_Web dataset...")
     dataset_path = os.path.join(output_dir, "showui_web")
-    os.makedirs(dataset_path, exist_ok=True)
-    
-    try:
-        ds = load_dataset("showlab/ShowUI_Web", split="train")
-    except Exception as e:
-        logger.error(f"Failed to load dataset: {e}")
-        return
+    materialize(args.source or "showlab/ShowUI_Web", dataset_path, "showui", args)
 
-    images_dir = os.path.join(dataset_path, "images")
-    os.makedirs(images_dir, exist_ok=True)
-    
-    annotations = []
-    
-    logger.info(f"Processing {len(ds)} samples...")
-    for i, item in tqdm(enumerate(ds), total=len(ds)):
-        image = item.get('image')
-        if not image: continue
-        
-        file_name = f"showui_{i:05d}.jpg"
-        image_path = os.path.join(images_dir, file_name)
-        
-        if image.mode != "RGB":
-            image = image.convert("RGB")
-        image.save(image_path)
-        
-        meta = {k: v for k, v in item.items() if k != 'image'}
-        meta['file_name'] = file_name
-        meta['width'] = image.width
-        meta['height'] = image.height
-        annotations.append(meta)
-        
-    with open(os.path.join(dataset_path, "raw_annotations.json"), "w") as f:
-        json.dump(annotations, f, indent=2)
-        
     logger.info(f"ShowUI dataset saved to {dataset_path}")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--output_dir", type=str, default="datasets/raw", help="Root directory for downloads")
     parser.add_argument("--dataset", type=str, choices=["all", "fiftyone", "showui"], default="all")
+    parser.add_argument("--source", type=str, default=None,
+                        help="Override the HF dataset id, or a local dataset directory (save_to_disk or imagefolder)")
+    parser.add_argument("--workers", type=int, default=None, help="Image encoding processes (default: CPU count)")
+    parser.add_argument("--shard_size", type=int, default=1000, help="Samples per annotation shard (resume granularity)")
+    parser.add_argument("--limit", type=int, default=None, help="Only materialize the first N samples")
     args = parser.parse_args()
-    
-    import json # ensure imported
-    
+
+    if args.source and args.dataset == "all":
+        parser.error("--source needs a single --dataset")
+
     if args.dataset in ["all", "fiftyone"]:
-        download_fiftyone_gui(args.output_dir)
-        
+        download_fiftyone_gui(args.output_dir, args)
+
     if args.dataset in ["all", "showui"]:
-        download_showui_web(args.output_dir)
+        download_showui_web(args.output_dir, args)
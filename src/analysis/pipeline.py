@@ -1,13 +1,18 @@
 import os
 import math
-import json
+import shutil
+import tempfile
 import logging
 import torch
 from src.model.engine import VisionEngine
-from src.utils.video_processing import create_focus_crop, get_video_duration
+from src.utils.video_processing import create_focus_crop
+from src.utils.video_index import get_video_index
+from src.utils.json_recovery import recover_json, is_action_payload
+from src.utils.cancellation import OperationCancelled, raise_if_cancelled
 from src.config import Config
 from src.prompts import DEFAULT_SYSTEM_PROMPT, DEFAULT_USER_PROMPT
-from src.analysis.processing import map_detail_to_params, merge_results
+from src.analysis.processing import map_detail_to_params, TimelineMerger, append_ndjson
+from src.model.token_budget import plan_video_analysis
 
 logger = logging.getLogger(__name__)
 
@@ -23,16 +28,45 @@ class VideoAnalyzer:
         """
         self.engine.load_model(model_name)
 
-    def analyze_video(self, video_path, detail="medium", roi=None, system_prompt=None, user_prompt=None, progress_callback=None):
+    def plan(self, video_path, detail="medium", roi=None, system_prompt=None, user_prompt=None):
+        """
+        Dry run: estimates visual/text tokens per segment, total prefill and memory
+        without calling the model. `params` in the result are the sampling parameters
+        analyze_video will actually use (reduced if over Config.PREFILL_TOKEN_BUDGET).
+        """
+        index = get_video_index(video_path)
+        meta = {"duration": index.duration, "fps": index.fps, "width": index.width, "height": index.height}
+        prompt_text = (system_prompt or DEFAULT_SYSTEM_PROMPT) + (user_prompt or DEFAULT_USER_PROMPT)
+        return plan_video_analysis(
+            meta, map_detail_to_params(detail), roi=roi,
+            model_name=self.engine.current_model_name or self.config.MODEL_NAME,
+            prompt_text=prompt_text
+        )
+
+    def analyze_video(self, video_path, detail="medium", roi=None, system_prompt=None, user_prompt=None, progress_callback=None, output_dir=None, cancel_token=None):
         """
         Main entry point for analyzing a video.
+        Returns (report, segment_results).
+        cancel_token: CancellationToken checked between segments and during generation;
+        raises OperationCancelled once it is cancelled.
+        With output_dir (streaming mode) nothing grows with the video length in memory:
+        segment results are appended to output_dir/segments.ndjson, timeline events
+        to output_dir/events.ndjson and the report is streamed to output_dir/report.json.
+        In that case returns (report_path, segments_path).
         """
         if not os.path.exists(video_path):
             logger.error(f"Video path does not exist: {video_path}")
             return None
 
-        params = map_detail_to_params(detail)
-        duration = get_video_duration(video_path)
+        try:
+            plan = self.plan(video_path, detail, roi, system_prompt, user_prompt)
+            params = plan["params"]
+            if plan["adjusted"]:
+                logger.info(f"Reduced sampling to fit the token budget: fps={params['fps']}, max_pixels={params['max_pixels']}")
+        except ValueError as e:
+            logger.warning(f"Could not plan token budget, using detail preset: {e}")
+            params = map_detail_to_params(detail)
+        duration = get_video_index(video_path).duration
         
         segment_duration = params["segment_duration"]
         num_segments = math.ceil(duration / segment_duration)
@@ -43,44 +77,83 @@ class VideoAnalyzer:
             progress_callback({"type": "info", "message": msg, "total_segments": num_segments})
         
         segment_results = []
+        segments_path = None
+        events_path = None
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+            segments_path = os.path.join(output_dir, "segments.ndjson")
+            events_path = os.path.join(output_dir, "events.ndjson")
+            open(segments_path, "w").close()
+        merger = TimelineMerger(duration, params, spill_path=events_path)
         
         # Use provided prompts or defaults
         sys_prompt_tmpl = system_prompt or DEFAULT_SYSTEM_PROMPT
         usr_prompt_tmpl = user_prompt or DEFAULT_USER_PROMPT
 
-        for i in range(num_segments):
-            start = i * segment_duration
-            end = min((i + 1) * segment_duration, duration)
+        # ROI crops go to a directory of this analysis only (jobs and API analyses run concurrently)
+        crop_dir = tempfile.mkdtemp(prefix="pixelsense_crops_") if roi else None
+        try:
+            for i in range(num_segments):
+                raise_if_cancelled(cancel_token)
+                start = i * segment_duration
+                end = min((i + 1) * segment_duration, duration)
             
-            if progress_callback:
-                progress_callback({
-                    "type": "segment_start", 
-                    "segment_index": i, 
-                    "total_segments": num_segments,
-                    "start": start,
-                    "end": end
-                })
+                if progress_callback:
+                    progress_callback({
+                        "type": "segment_start", 
+                        "segment_index": i, 
+                        "total_segments": num_segments,
+                        "start": start,
+                        "end": end
+                    })
 
-            seg_result = self._analyze_segment(
-                video_path, start, end, params, i, num_segments, roi,
-                sys_prompt_tmpl, usr_prompt_tmpl
-            )
-            segment_results.append(seg_result)
+                seg_result = self._analyze_segment(
+                    video_path, start, end, params, i, num_segments, roi,
+                    sys_prompt_tmpl, usr_prompt_tmpl, cancel_token, crop_dir
+                )
+                if segments_path:
+                    append_ndjson(segments_path, [seg_result])
+                else:
+                    segment_results.append(seg_result)
             
-            if progress_callback:
-                progress_callback({
-                    "type": "segment_complete",
-                    "segment_index": i,
-                    "result": seg_result
-                })
+                delta = merger.add_segment(seg_result)
+            
+                if progress_callback:
+                    progress_callback({
+                        "type": "segment_complete",
+                        "segment_index": i,
+                        "result": seg_result
+                    })
+                    progress_callback({
+                        "type": "timeline_delta",
+                        "segment_index": i,
+                        "events": delta,
+                        "total_events": merger.total_events
+                    })
 
-            if torch.cuda.is_available():
-                torch.cuda.empty_cache()
-                
-        final_json = merge_results(segment_results, duration, params)
-        return final_json, segment_results
+                if torch.cuda.is_available():
+                    torch.cuda.empty_cache()
+        finally:
+            if crop_dir:
+                shutil.rmtree(crop_dir, ignore_errors=True)
+
+        # Emitir el último evento retenido por la deduplicación
+        tail = merger.flush()
+        if progress_callback and tail:
+            progress_callback({
+                "type": "timeline_delta",
+                "segment_index": num_segments - 1,
+                "events": tail,
+                "total_events": merger.total_events
+            })
+        if output_dir:
+            report_path = merger.write_report(os.path.join(output_dir, "report.json"))
+            return report_path, segments_path
+
+        report = merger.finalize()
+        return report, segment_results
 
-    def _analyze_segment(self, video_path, start_time, end_time, params, segment_index, total_segments, roi, system_prompt_tmpl, user_prompt_tmpl):
+    def _analyze_segment(self, video_path, start_time, end_time, params, segment_index, total_segments, roi, system_prompt_tmpl, user_prompt_tmpl, cancel_token=None, crop_dir=None):
         """
         Analyzes a single segment.
         """
@@ -107,7 +180,7 @@ class VideoAnalyzer:
         })
         
         focus_prompt_part = ""
-        crop_path = f"temp_crop_seg_{segment_index}.mp4"
+        crop_path = os.path.join(crop_dir or tempfile.gettempdir(), f"crop_seg_{segment_index}.mp4")
         
         if roi:
             try:
@@ -174,43 +247,56 @@ class VideoAnalyzer:
         print(f"   Analyzing Segment {segment_index+1}/{total_segments} ({start_time:.1f}s - {end_time:.1f}s)...")
         
         try:
-            response = self.engine.analyze(messages, max_tokens=params["max_tokens"])
+            # Messages are formatted for Config.MODEL_NAME: load it and infer under one engine hold
+            with self.engine.using(current_model):
+                response = self.engine.analyze(
+                    messages,
+                    max_tokens=params["max_tokens"],
+                    max_continuations=self.config.MAX_CONTINUATIONS,
+                    cancel_token=cancel_token
+                )
             log_entry["raw_response"] = response
             
             # Cleanup crop
             if roi and os.path.exists(crop_path):
                 os.remove(crop_path)
             
-            # Basic cleanup
-            response = response.replace("```json", "").replace("```", "").strip()
+            # Parser tolerante: ignora prosa/fences y rescata eventos completos si la salida se cortó
+            parsed, complete = recover_json(response, accept=is_action_payload)
             
-            parsed = json.loads(response)
+            if parsed is None:
+                logger.warning(f"Failed to parse JSON for segment {segment_index}")
+                log_entry["status"] = "json_error"
+                log_entry["error"] = "JSONDecodeError"
+                log_entry["events"] = []
+                return log_entry
             
             if isinstance(parsed, list):
-                log_entry["parsed_events"] = parsed
-                log_entry["status"] = "success"
-                log_entry["events"] = parsed
-                return log_entry
-            elif isinstance(parsed, dict) and "events" in parsed:
-                log_entry["parsed_events"] = parsed["events"]
-                log_entry["status"] = "success"
-                log_entry["events"] = parsed["events"]
-                return log_entry
+                events = parsed
+            elif isinstance(parsed, dict) and isinstance(parsed.get("events"), list):
+                events = parsed["events"]
             else:
                 logger.warning(f"Unexpected JSON structure in segment {segment_index}: {parsed.keys()}")
                 log_entry["status"] = "structure_error"
                 log_entry["error"] = f"Unexpected keys: {parsed.keys()}"
                 log_entry["events"] = []
                 return log_entry
+            
+            events = [e for e in events if isinstance(e, dict)]
+            log_entry["parsed_events"] = events
+            log_entry["events"] = events
+            if complete:
+                log_entry["status"] = "success"
+            else:
+                logger.warning(f"Truncated JSON in segment {segment_index}, recovered {len(events)} events")
+                log_entry["status"] = "partial"
+                log_entry["error"] = f"Truncated output, recovered {len(events)} events"
+            return log_entry
                 
-        except json.JSONDecodeError:
-            logger.warning(f"Failed to parse JSON for segment {segment_index}")
-            log_entry["status"] = "json_error"
-            log_entry["error"] = "JSONDecodeError"
-            log_entry["events"] = []
+        except OperationCancelled:
             if roi and os.path.exists(crop_path):
                 os.remove(crop_path)
-            return log_entry
+            raise
         except Exception as e:
             logger.error(f"Error analyzing segment {segment_index}: {e}")
             log_entry["status"] = "execution_error"
@@ -1,5 +1,5 @@
-import json
 import re
+import json
 
 def map_detail_to_params(detail: str):
     """
@@ -20,131 +20,241 @@ def map_detail_to_params(detail: str):
         return {"fps": 2.0, "max_tokens": 1024, "max_pixels": 720 * 720, "segment_duration": 2}
     return {"fps": 1.0, "max_tokens": 1024, "max_pixels": 480 * 480, "segment_duration": 5}
 
-def clean_events(events):
-    """
-    Limpia la lista de eventos:
-    1. Elimina duplicados inteligentes (misma key/acción en un intervalo de 1s).
-       - Prioriza eventos con descripción más detallada.
-    2. Filtra eventos "None" o vacíos a menos que tengan descripción relevante.
-    3. Sanitiza nombres y elimina placeholders genéricos.
-    """
-    cleaned = []
+def parse_timestamp(ts_str):
+    """Convierte "MM:SS" (o "MM:SS.s") a segundos."""
+    try:
+        parts = ts_str.split(':')
+        return float(parts[0]) * 60 + float(parts[1])
+    except:
+        return 0.0
+
+def _sanitize_text(text):
+    if not text: return "Unknown"
+    # Eliminar placeholders comunes del prompt
+    placeholders = ["Skill Name (if known)", "Skillshot/Point-Click/Self-Buff/Dash"]
+    for p in placeholders:
+        if p.lower() in text.lower():
+            return "Unknown"
+    return re.sub(r'[^\x00-\x7F]+', '', text).strip()
     
-    last_event_time = -1.0
-    last_key = None
-    last_event_data = None
+def _is_better_event(new_event, old_event):
+    # Criterios para decidir si el nuevo evento es mejor que el anterior (si son duplicados)
+    new_desc = new_event.get("action", "")
+    old_desc = old_event.get("action", "")
     
-    def parse_time(ts_str):
-        try:
-            parts = ts_str.split(':')
-            return float(parts[0]) * 60 + float(parts[1])
-        except:
-            return 0.0
-
-    def sanitize_text(text):
-        if not text: return "Unknown"
-        # Eliminar placeholders comunes del prompt
-        placeholders = ["Skill Name (if known)", "Skillshot/Point-Click/Self-Buff/Dash"]
-        for p in placeholders:
-            if p.lower() in text.lower():
-                return "Unknown"
-        return re.sub(r'[^\x00-\x7F]+', '', text).strip()
+    # 1. Preferir si tiene nombre de skill real
+    new_skill_name = new_event.get("skill_used", {}).get("name", "Unknown")
+    old_skill_name = old_event.get("skill_used", {}).get("name", "Unknown")
+    
+    if new_skill_name != "Unknown" and old_skill_name == "Unknown":
+        return True
         
-    def is_better_event(new_event, old_event):
-        # Criterios para decidir si el nuevo evento es mejor que el anterior (si son duplicados)
-        new_desc = new_event.get("action", "")
-        old_desc = old_event.get("action", "")
+    # 2. Preferir descripción más larga
+    if len(new_desc) > len(old_desc):
+        return True
         
-        # 1. Preferir si tiene nombre de skill real
-        new_skill_name = new_event.get("skill_used", {}).get("name", "Unknown")
-        old_skill_name = old_event.get("skill_used", {}).get("name", "Unknown")
+    # 3. Preferir si tiene intención táctica definida
+    new_intent = new_event.get("tactical_intent", "None")
+    old_intent = old_event.get("tactical_intent", "None")
+    if new_intent != "None" and old_intent == "None":
+        return True
         
-        if new_skill_name != "Unknown" and old_skill_name == "Unknown":
-            return True
-            
-        # 2. Preferir descripción más larga
-        if len(new_desc) > len(old_desc):
-            return True
-            
-        # 3. Preferir si tiene intención táctica definida
-        new_intent = new_event.get("tactical_intent", "None")
-        old_intent = old_event.get("tactical_intent", "None")
-        if new_intent != "None" and old_intent == "None":
-            return True
-            
-        return False
+    return False
 
-    for event in events:
+class EventCleaner:
+    """
+    Versión incremental de clean_events.
+    Solo el último evento aceptado puede ser reemplazado por un duplicado, así que
+    se retiene ese único evento (look-back acotado) y el resto se emite como final.
+    El estado de deduplicación se conserva entre segmentos.
+    """
+
+    def __init__(self):
+        self.last_event_time = -1.0
+        self.last_key = None
+        self.last_event_data = None
+        self.pending = None
+
+    def push(self, event):
+        """Procesa un evento y retorna la lista de eventos que quedaron finales."""
         # 1. Filtrar None irrelevantes
         skill = event.get("skill_used", {})
         key = skill.get("key", "None")
         action = event.get("action", "")
         
         if key == "None" and ("standing" in action.lower() or "menu" in action.lower()):
-            continue
+            return []
             
         # 2. Sanitizar
         if "name" in skill:
-            skill["name"] = sanitize_text(skill["name"])
+            skill["name"] = _sanitize_text(skill["name"])
         if "type" in skill:
-             skill["type"] = sanitize_text(skill["type"])
+             skill["type"] = _sanitize_text(skill["type"])
         if "action" in event:
-            event["action"] = sanitize_text(event["action"])
+            event["action"] = _sanitize_text(event["action"])
             
         # 3. Deduplicación inteligente
-        current_time = parse_time(event.get("timestamp", "00:00"))
+        current_time = parse_timestamp(event.get("timestamp", "00:00"))
         
         is_duplicate = False
-        if key != "None" and key == last_key and (current_time - last_event_time) < 1.0:
+        if key != "None" and key == self.last_key and (current_time - self.last_event_time) < 1.0:
             is_duplicate = True
             
         if is_duplicate:
             # Si es duplicado, ver si el nuevo es mejor para reemplazar al anterior
-            if is_better_event(event, last_event_data):
-                # Reemplazar el último evento en la lista limpia
-                cleaned[-1] = event
-                last_event_data = event
+            if _is_better_event(event, self.last_event_data):
+                # Reemplazar el último evento aceptado
+                self.pending = event
+                self.last_event_data = event
                 # No actualizamos last_event_time para mantener la ventana de bloqueo desde el primer evento
-        else:
-            # No es duplicado, agregar
-            cleaned.append(event)
-            if key != "None":
-                last_event_time = current_time
-                last_key = key
-                last_event_data = event
-            
+            return []
+
+        # No es duplicado: el pendiente ya no puede cambiar
+        finalized = [self.pending] if self.pending is not None else []
+        self.pending = event
+        if key != "None":
+            self.last_event_time = current_time
+            self.last_key = key
+            self.last_event_data = event
+        return finalized
+
+    def flush(self):
+        """Emite el evento retenido (fin del stream)."""
+        finalized = [self.pending] if self.pending is not None else []
+        self.pending = None
+        return finalized
+
+def clean_events(events):
+    """
+    Limpia la lista de eventos:
+    1. Elimina duplicados inteligentes (misma key/acción en un intervalo de 1s).
+       - Prioriza eventos con descripción más detallada.
+    2. Filtra eventos "None" o vacíos a menos que tengan descripción relevante.
+    3. Sanitiza nombres y elimina placeholders genéricos.
+    """
+    cleaner = EventCleaner()
+    cleaned = []
+    for event in events:
+        cleaned.extend(cleaner.push(event))
+    cleaned.extend(cleaner.flush())
     return cleaned
 
-def merge_results(segment_results, total_duration, params):
-    """Combina los resultados de múltiples segmentos en un reporte final."""
-    
-    all_events = []
-    for res in segment_results:
-        if "events" in res:
-            all_events.extend(res["events"])
-    
-    # Limpieza post-procesamiento
-    cleaned_events = clean_events(all_events)
-            
-    # Crear estructura final
-    final_report = {
-        "summary": "Full match analysis generated from sequential segments.",
-        "tactical_analysis": {
-            "game_phase": "Calculated from aggregate",
-            "total_events": len(cleaned_events)
-        },
-        "segments": [
-            {
-                "start": "00:00",
-                "end": f"{int(total_duration//60):02d}:{int(total_duration%60):02d}",
-                "title": "Full Match Timeline",
-                "events": cleaned_events
+def append_ndjson(path, records):
+    """Agrega registros a un archivo NDJSON (una línea JSON por registro)."""
+    with open(path, "a") as f:
+        for record in records:
+            f.write(json.dumps(record))
+            f.write("\n")
+
+def iter_ndjson(path):
+    """Itera los registros de un archivo NDJSON sin cargarlo completo."""
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+_EVENTS_PLACEHOLDER = "__TIMELINE_EVENTS__"
+
+class TimelineMerger:
+    """
+    Combina los resultados de los segmentos a medida que terminan.
+    add_segment() retorna los eventos nuevos del timeline (delta) y
+    finalize() construye el reporte final como objeto.
+    Con spill_path los eventos finales se escriben a un NDJSON en disco en lugar
+    de acumularse en memoria; write_report() genera el reporte recorriendo ese archivo.
+    """
+
+    def __init__(self, total_duration, params, spill_path=None):
+        self.total_duration = total_duration
+        self.params = params
+        self.spill_path = spill_path
+        self.cleaner = EventCleaner()
+        self.events = []
+        self.event_count = 0
+        self.processed_segments = 0
+        if spill_path:
+            open(spill_path, "w").close()
+
+    @property
+    def total_events(self):
+        return self.event_count
+
+    def _accept(self, events):
+        self.event_count += len(events)
+        if self.spill_path:
+            if events:
+                append_ndjson(self.spill_path, events)
+        else:
+            self.events.extend(events)
+        return events
+
+    def iter_events(self):
+        if self.spill_path:
+            return iter_ndjson(self.spill_path)
+        return iter(self.events)
+
+    def add_segment(self, segment_result):
+        self.processed_segments += 1
+        delta = []
+        for event in segment_result.get("events", []):
+            delta.extend(self.cleaner.push(event))
+        return self._accept(delta)
+
+    def flush(self):
+        return self._accept(self.cleaner.flush())
+
+    def build_report(self, events):
+        total_duration = self.total_duration
+        return {
+            "summary": "Full match analysis generated from sequential segments.",
+            "tactical_analysis": {
+                "game_phase": "Calculated from aggregate",
+                "total_events": self.total_events
+            },
+            "segments": [
+                {
+                    "start": "00:00",
+                    "end": f"{int(total_duration//60):02d}:{int(total_duration%60):02d}",
+                    "title": "Full Match Timeline",
+                    "events": events
+                }
+            ],
+            "metrics": {
+                "fps": self.params["fps"],
+                "detail": self.params.get("segment_duration", "unknown"),
+                "processed_segments": self.processed_segments
             }
-        ],
-        "metrics": {
-            "fps": params["fps"],
-            "detail": params.get("segment_duration", "unknown"),
-            "processed_segments": len(segment_results)
         }
-    }
-    return json.dumps(final_report, indent=2)
+
+    def finalize(self):
+        """Emite el evento retenido y retorna el reporte final (en memoria)."""
+        self.flush()
+        return self.build_report(list(self.iter_events()))
+
+    def write_report(self, path, indent=2):
+        """
+        Escribe el reporte final en `path` sin materializar la lista de eventos:
+        el esqueleto se serializa una vez y los eventos se copian en streaming.
+        """
+        self.flush()
+        skeleton = json.dumps(self.build_report(_EVENTS_PLACEHOLDER), indent=indent)
+        head, tail = skeleton.split(json.dumps(_EVENTS_PLACEHOLDER), 1)
+        with open(path, "w") as f:
+            f.write(head)
+            f.write("[")
+            count = 0
+            for event in self.iter_events():
+                f.write(",\n" if count else "\n")
+                f.write(json.dumps(event))
+                count += 1
+            f.write("\n]" if count else "]")
+            f.write(tail)
+        return path
+
+def merge_results(segment_results, total_duration, params):
+    """Combina los resultados de múltiples segmentos en un reporte final (dict)."""
+    merger = TimelineMerger(total_duration, params)
+    for res in segment_results:
+        merger.add_segment(res)
+    return merger.finalize()
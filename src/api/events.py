@@ -0,0 +1,56 @@
+from fastapi import APIRouter, HTTPException
+from typing import Optional
+
+from src.services.event_store import get_event_store
+
+router = APIRouter(prefix="/events", tags=["events"])
+
+@router.get("")
+def query_events(
+    video: Optional[str] = None,
+    start: Optional[float] = None,
+    end: Optional[float] = None,
+    skill_key: Optional[str] = None,
+    movement_type: Optional[str] = None,
+    tactical_intent: Optional[str] = None,
+    q: Optional[str] = None,
+    limit: int = 50,
+    offset: int = 0
+):
+    """
+    Time-range and faceted query over every analyzed video.
+    `start`/`end` are seconds from the start of each video, `q` is a full-text search on `action`.
+    """
+    limit = max(1, min(limit, 500))
+    return get_event_store().query_events(
+        video=video, start=start, end=end, text=q,
+        skill_key=skill_key, movement_type=movement_type, tactical_intent=tactical_intent,
+        limit=limit, offset=max(0, offset)
+    )
+
+@router.get("/facets/{field}")
+def get_facets(
+    field: str,
+    video: Optional[str] = None,
+    start: Optional[float] = None,
+    end: Optional[float] = None,
+    skill_key: Optional[str] = None,
+    movement_type: Optional[str] = None,
+    tactical_intent: Optional[str] = None,
+    q: Optional[str] = None,
+    limit: int = 50
+):
+    """Event counts grouped by `field` (video, skill_key, skill_type, movement_type, tactical_intent)."""
+    try:
+        return get_event_store().facet_counts(
+            field, limit=max(1, min(limit, 500)),
+            video=video, start=start, end=end, text=q,
+            skill_key=skill_key, movement_type=movement_type, tactical_intent=tactical_intent
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/videos")
+def list_indexed_videos(limit: int = 50, offset: int = 0):
+    """Videos with an indexed analysis."""
+    return get_event_store().list_videos(limit=max(1, min(limit, 500)), offset=max(0, offset))
@@ -1,16 +1,44 @@
 import os
 import json
-from fastapi import APIRouter, HTTPException, BackgroundTasks
+import asyncio
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.responses import FileResponse
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
 
+from src.analysis.processing import iter_ndjson
 from src.services.grounding_pipeline import GroundingPipeline
+from src.services.job_queue import get_job_queue
+from src.services.run_catalog import get_run_catalog
+from src.services.visualization import FORMATS, META_FILE, get_renderer
 
 router = APIRouter(prefix="/grounding", tags=["grounding"])
 
 # Initialize Pipeline Service
 pipeline_service = GroundingPipeline()
 
+def run_grounding_suite(ctx):
+    """Job handler: runs a suite created by /execute, reporting progress per finished config."""
+    suite_config = ctx.params["suite_config"]
+    total = len(suite_config.get("configs", []))
+    done = {"count": 0}
+
+    def on_result(result):
+        done["count"] += 1
+        ctx.set_progress(done["count"], total, f"{result.get('config_name')}: {result.get('status')}")
+
+    suite_id = pipeline_service.execute_suite(
+        suite_config, suite_id=ctx.params["suite_id"], on_result=on_result, cancel_token=ctx.cancel_token
+    )
+    return {"suite_id": suite_id}
+
+get_job_queue().register_handler("grounding_suite", run_grounding_suite)
+
+@router.on_event("startup")
+def start_job_workers():
+    # Resume suites that were queued or interrupted before a restart
+    get_job_queue().start()
+
 class TestCaseConfig(BaseModel):
     name: str
     model: str = "qwen" # qwen, mai
@@ -20,65 +48,133 @@ class TestCaseConfig(BaseModel):
     allowed_actions: List[str] = ["click", "drag", "type"]
     refinement: bool = False
     prompt_template: Optional[str] = None
+    coarse_to_fine: bool = False # Low-res pass to find the region, then re-ground on a full-res crop
+    tiled: bool = False # Split wide captures into overlapping native-resolution tiles
 
 class TestSuiteRequest(BaseModel):
     suite_name: str
     configs: List[TestCaseConfig]
+    dry_run: bool = False # Only estimate tokens/memory per config, without running models
 
 @router.post("/execute")
-async def execute_suite(request: TestSuiteRequest, background_tasks: BackgroundTasks):
+def execute_suite(request: TestSuiteRequest):
     """
-    Executes a test suite. For now we run it synchronously to return results immediately 
-    for the MVP, but ideally this should be a background task with polling.
-    Given the user wants to "see results", we'll run it and return the suite_id.
+    Queues a test suite as a background job and returns immediately.
+    Results can be followed per config on /grounding/runs/{suite_id}/stream,
+    and the job polled or cancelled on /grounding/jobs/{job_id}.
     """
     try:
         # Convert Pydantic models to dicts
         suite_config = request.dict()
         
-        # We can run this in background if it takes too long
-        # But for the UI to update, let's try synchronous for 1-2 configs, 
-        # or return ID and let UI poll (simpler for now: return ID and results if fast enough)
+        if request.dry_run:
+            return {"suite_name": request.suite_name, "dry_run": True, "configs": pipeline_service.plan_suite(suite_config)}
         
-        # Running synchronously for immediate feedback in this iteration
-        suite_id = pipeline_service.execute_suite(suite_config)
+        suite_id = pipeline_service.create_suite(suite_config)
+        job = get_job_queue().submit("grounding_suite", {"suite_id": suite_id, "suite_config": suite_config})
         
         return {
             "suite_id": suite_id,
-            "message": "Suite executed successfully",
-            "results_url": f"/grounding/runs/{suite_id}"
+            "job_id": job["id"],
+            "message": "Suite queued",
+            "results_url": f"/grounding/runs/{suite_id}",
+            "stream_url": f"/grounding/runs/{suite_id}/stream"
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+class MultiPromptRequest(BaseModel):
+    image_path: str # filename in uploads/ or absolute path
+    prompts: List[str]
+    model: str = "qwen"
+    system_prompt: Optional[str] = None
+    allowed_actions: List[str] = []
+
+@router.post("/multi")
+def ground_multi(request: MultiPromptRequest):
+    """
+    Answers several instructions about one screenshot in a single generation,
+    so the image is encoded once instead of once per instruction.
+    Returns one action list per prompt, in order.
+    """
+    if not request.prompts:
+        raise HTTPException(status_code=400, detail="prompts must not be empty")
+    try:
+        return pipeline_service.ground_multi(
+            request.image_path, request.prompts, model=request.model,
+            system_prompt=request.system_prompt, allowed_actions=request.allowed_actions
+        )
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/jobs/{job_id}")
+def get_suite_job(job_id: str):
+    job = get_job_queue().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@router.post("/jobs/{job_id}/cancel")
+def cancel_suite_job(job_id: str):
+    job = get_job_queue().cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@router.websocket("/runs/{suite_id}/stream")
+async def stream_run_results(websocket: WebSocket, suite_id: str):
+    """
+    Sends each config result as soon as it is written, then {"type": "done"}
+    once the suite summary exists.
+    """
+    await websocket.accept()
+    suite_path = os.path.join("runs", suite_id)
+    results_path = os.path.join(suite_path, "results.ndjson")
+    summary_path = os.path.join(suite_path, "summary.json")
+    if not os.path.isdir(suite_path):
+        await websocket.send_json({"type": "error", "message": "Suite not found"})
+        await websocket.close()
+        return
+
+    sent = 0
+    try:
+        while True:
+            finished = os.path.exists(summary_path)
+            if os.path.exists(results_path):
+                try:
+                    results = list(iter_ndjson(results_path))
+                except ValueError:
+                    results = []  # Line still being written, retry on the next poll
+                for result in results[sent:]:
+                    await websocket.send_json({"type": "result", "result": result})
+                    sent += 1
+            if finished:
+                await websocket.send_json({"type": "done", "suite_id": suite_id})
+                break
+            await asyncio.sleep(0.5)
+    except WebSocketDisconnect:
+        return
+    await websocket.close()
+
 @router.get("/runs")
-def list_runs():
+def list_runs(
+    limit: int = 50,
+    offset: int = 0,
+    name: Optional[str] = None,
+    model: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None
+):
     """
-    List all test suites executed.
+    List executed test suites from the run catalog (metadata only, newest first).
+    Full results are loaded by /runs/{suite_id}. Dates are ISO (YYYY-MM-DD).
     """
-    runs_dir = "runs"
-    if not os.path.exists(runs_dir):
-        return []
-    
-    suites = []
-    for suite_id in sorted(os.listdir(runs_dir), reverse=True):
-        suite_path = os.path.join(runs_dir, suite_id)
-        if os.path.isdir(suite_path):
-            # Load summary if exists
-            summary_path = os.path.join(suite_path, "summary.json")
-            summary = []
-            if os.path.exists(summary_path):
-                with open(summary_path, "r") as f:
-                    summary = json.load(f)
-            
-            suites.append({
-                "suite_id": suite_id,
-                "timestamp": suite_id.split("_")[0],
-                "name": "_".join(suite_id.split("_")[2:]),
-                "config_count": len(summary),
-                "summary": summary
-            })
-    return suites
+    return get_run_catalog().list_runs(
+        limit=max(1, min(limit, 500)), offset=max(0, offset),
+        name=name, model=model, date_from=date_from, date_to=date_to
+    )
 
 @router.get("/runs/{suite_id}")
 def get_run_details(suite_id: str):
@@ -91,13 +187,35 @@ def get_run_details(suite_id: str):
         
     summary_path = os.path.join(suite_path, "summary.json")
     if not os.path.exists(summary_path):
-         return {"suite_id": suite_id, "configs": []}
+         # Still running: return the configs finished so far
+         results_path = os.path.join(suite_path, "results.ndjson")
+         configs = list(iter_ndjson(results_path)) if os.path.exists(results_path) else []
+         return {"suite_id": suite_id, "status": "running", "configs": configs}
          
     with open(summary_path, "r") as f:
         summary = json.load(f)
         
     return {"suite_id": suite_id, "configs": summary}
 
+@router.get("/runs/{suite_id}/{config_name}/result")
+async def get_run_result_image(suite_id: str, config_name: str, format: str = "png", width: Optional[int] = None):
+    """
+    Visualization of a config result, rendered on first request and cached.
+    `format` is png, webp or jpeg; `width` returns a downscaled preview.
+    """
+    if format not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format: {format}")
+    if width is not None and width <= 0:
+        raise HTTPException(status_code=400, detail="width must be positive")
+    run_dir = os.path.join("runs", os.path.basename(suite_id), os.path.basename(config_name))
+    if not os.path.exists(os.path.join(run_dir, META_FILE)):
+        raise HTTPException(status_code=404, detail="Result not found")
+
+    loop = asyncio.get_event_loop()
+    path = await loop.run_in_executor(None, get_renderer().get, run_dir, format, width)
+    media_type = "image/jpeg" if format in ("jpeg", "jpg") else f"image/{format}"
+    return FileResponse(path, media_type=media_type, headers={"Cache-Control": "public, max-age=86400"})
+
 @router.get("/config-schema")
 def get_config_schema():
     """
@@ -0,0 +1,148 @@
+import os
+import asyncio
+import logging
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.responses import FileResponse
+from pydantic import BaseModel
+from typing import Optional
+
+from src.api.routes import UPLOAD_DIR, current_config, get_analyzer
+from src.services.event_store import get_event_store
+from src.services.job_queue import TERMINAL_STATUSES, get_job_queue
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/jobs", tags=["jobs"])
+
+class ROI(BaseModel):
+    x: int
+    y: int
+    w: int
+    h: int
+
+class AnalysisJobRequest(BaseModel):
+    filename: str
+    detail: Optional[str] = None
+    roi: Optional[ROI] = None
+    priority: int = 0
+    dry_run: bool = False
+
+def run_analysis_job(ctx):
+    """Handler de la cola: analiza un video en modo streaming dentro del directorio del job."""
+    params = ctx.params
+    video_path = os.path.join(UPLOAD_DIR, params["filename"])
+    if not os.path.exists(video_path):
+        raise FileNotFoundError(f"Video not found: {params['filename']}")
+
+    state = {"total": 0}
+
+    def progress_callback(event):
+        if event["type"] == "info":
+            state["total"] = event["total_segments"]
+            ctx.report_progress(0, state["total"], event["message"])
+        elif event["type"] == "segment_start":
+            ctx.check_cancelled()
+        elif event["type"] == "segment_complete":
+            done = event["segment_index"] + 1
+            ctx.report_progress(done, state["total"], f"Segment {done}/{state['total']} complete")
+
+    roi = params.get("roi")
+    report_path, segments_path = get_analyzer().analyze_video(
+        video_path,
+        detail=params["detail"],
+        roi=(roi["x"], roi["y"], roi["w"], roi["h"]) if roi else None,
+        system_prompt=params["system_prompt"],
+        user_prompt=params["user_prompt"],
+        progress_callback=progress_callback,
+        output_dir=ctx.output_dir,
+        cancel_token=ctx.cancel_token
+    )
+
+    try:
+        get_event_store().ingest_report_file(params["filename"], report_path, detail=params["detail"])
+    except Exception as e:
+        logger.warning(f"Could not index analysis events: {e}")
+
+    return {"report_path": report_path, "segments_path": segments_path}
+
+get_job_queue().register_handler("video_analysis", run_analysis_job)
+
+@router.on_event("startup")
+def start_job_workers():
+    # Retoma los jobs pendientes (o interrumpidos) de una ejecución anterior
+    get_job_queue().start()
+
+@router.post("")
+def submit_analysis_job(request: AnalysisJobRequest):
+    """
+    Encola el análisis de un video ya subido. Los prompts y el nivel de detalle
+    se capturan al momento del envío.
+    """
+    if not os.path.exists(os.path.join(UPLOAD_DIR, request.filename)):
+        raise HTTPException(status_code=404, detail="Video not found")
+    params = {
+        "filename": request.filename,
+        "detail": request.detail or current_config["detail"],
+        "roi": request.roi.dict() if request.roi else None,
+        "system_prompt": current_config["system_prompt"],
+        "user_prompt": current_config["user_prompt"],
+    }
+    if request.dry_run:
+        # Estimación de tokens/memoria sin encolar nada
+        roi = params["roi"]
+        return get_analyzer().plan(
+            os.path.join(UPLOAD_DIR, request.filename), detail=params["detail"],
+            roi=(roi["x"], roi["y"], roi["w"], roi["h"]) if roi else None,
+            system_prompt=params["system_prompt"], user_prompt=params["user_prompt"]
+        )
+    return get_job_queue().submit("video_analysis", params, priority=request.priority)
+
+@router.get("")
+def list_jobs(status: Optional[str] = None, kind: Optional[str] = None, limit: int = 50, offset: int = 0):
+    return get_job_queue().list(status=status, kind=kind, limit=max(1, min(limit, 500)), offset=max(0, offset))
+
+@router.get("/{job_id}")
+def get_job(job_id: str):
+    job = get_job_queue().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@router.post("/{job_id}/cancel")
+def cancel_job(job_id: str):
+    job = get_job_queue().cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@router.get("/{job_id}/result")
+def get_job_result(job_id: str):
+    job = get_job_queue().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] != "completed":
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}")
+    return FileResponse(job["result"]["report_path"], media_type="application/json")
+
+@router.websocket("/{job_id}/ws")
+async def job_updates(websocket: WebSocket, job_id: str):
+    """Envía el estado del job cada vez que cambia, hasta que termina."""
+    await websocket.accept()
+    loop = asyncio.get_event_loop()
+    queue = get_job_queue()
+    last_update = None
+    try:
+        while True:
+            job = await loop.run_in_executor(None, queue.get, job_id)
+            if job is None:
+                await websocket.send_json({"type": "error", "message": "Job not found"})
+                break
+            if job["updated_at"] != last_update:
+                last_update = job["updated_at"]
+                await websocket.send_json({"type": "job", "job": job})
+            if job["status"] in TERMINAL_STATUSES:
+                break
+            await asyncio.sleep(0.5)
+    except WebSocketDisconnect:
+        return
+    await websocket.close()
@@ -1,17 +1,22 @@
 import os
 import shutil
 import uuid
-import base64
 import json
 import logging
 import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Optional
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect
 from pydantic import BaseModel
 from openai import AsyncOpenAI
 
 from src.config import Config
-from src.utils.video_processing import extract_frames
+from src.utils.video_processing import FRAME_SELECTIONS, FRAMES_MANIFEST, extract_frames, load_frames_manifest
+from src.services.label_propagation import propagate_labels
+from src.services.labeling_predictor import LabelingPredictor, get_fewshot_context
+from src.services.dataset_export import EXPORT_FORMATS, LabelLog, export_dataset
+from src.services.job_queue import get_job_queue
 
 router = APIRouter(prefix="/labeling", tags=["labeling"])
 logger = logging.getLogger(__name__)
@@ -22,15 +27,24 @@ LABELING_JOBS_DIR = os.path.join(UPLOAD_DIR, "labeling_jobs")
 # Ensure jobs directory exists
 os.makedirs(LABELING_JOBS_DIR, exist_ok=True)
 
+# Frame extraction runs off the event loop; its progress is kept here per job
+# until LABELING_EXTRACTION_TTL after it finishes, then it is read back from disk
+_extraction_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="labeling-init")
+_extractions: Dict[str, dict] = {}
+
 # --- Pydantic Models ---
 
 class InitRequest(BaseModel):
     filename: str
     num_frames: int = 100
+    selection: str = "uniform" # "diverse" picks the most visually distinct frames
 
 class InitResponse(BaseModel):
     job_id: str
-    frames: List[str]  # List of relative URLs to frames
+    frames: List[str]  # List of relative URLs to frames (extracted so far)
+    status: str = "ready" # "extracting" while frames are still being written
+    frames_url: Optional[str] = None # Poll for the frames extracted so far
+    stream_url: Optional[str] = None # Websocket that pushes each frame as it is written
 
 class BoundingBox(BaseModel):
     x: float
@@ -42,36 +56,139 @@ class BoundingBox(BaseModel):
 class LabelEntry(BaseModel):
     frame: str
     boxes: List[BoundingBox] = []
+    source: Optional[str] = None # "model" or "propagated" for predictions
+    confidence: Optional[float] = None # Tracking confidence of propagated frames
 
 class PredictRequest(BaseModel):
     job_id: str
     examples: List[LabelEntry]
     targets: List[str] # List of frame filenames to predict
+    propagate: bool = False # Track boxes from labeled neighbours locally, the model only gets keyframes / low confidence frames
+    min_confidence: Optional[float] = None
 
 class PredictResponse(BaseModel):
     predictions: List[LabelEntry]
+    stats: Optional[Dict[str, float]] = None # Frame counts by source plus bytes/tokens sent to the model
 
 class SaveRequest(BaseModel):
     job_id: str
     labels: List[LabelEntry]
     dataset_name: Optional[str] = None
+    formats: List[str] = [] # Also export in the background: coco, yolo, shards
+
+class AutosaveRequest(BaseModel):
+    job_id: str
+    labels: List[LabelEntry] # Only the frames that changed
+
+class ExportRequest(BaseModel):
+    job_id: str
+    dataset_name: Optional[str] = None
+    formats: List[str] = list(EXPORT_FORMATS)
+    labels: Optional[List[LabelEntry]] = None # Defaults to the autosaved labels
 
 # --- Helpers ---
 
 def get_job_dir(job_id: str) -> str:
     return os.path.join(LABELING_JOBS_DIR, job_id)
 
-def encode_image(image_path: str) -> str:
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode('utf-8')
+def frame_url(job_id: str, filename: str) -> str:
+    # Assuming /uploads is mounted to UPLOAD_DIR
+    return f"/uploads/labeling_jobs/{job_id}/{filename}"
+
+def run_extraction(job_id: str, video_path: str, num_frames: int, selection: str):
+    state = _extractions[job_id]
+
+    def on_frame(filename: str, source: dict):
+        state["sources"][filename] = source
+        state["frames"].append(filename)
+
+    try:
+        extract_frames(video_path, get_job_dir(job_id), num_frames, on_frame=on_frame, selection=selection)
+        state["status"] = "ready"
+    except Exception as e:
+        logger.error(f"Frame extraction failed: {e}")
+        state["status"] = "failed"
+        state["error"] = str(e)
+    finally:
+        state["finished_at"] = time.monotonic()
+
+def prune_extractions():
+    """Drops finished extraction states older than LABELING_EXTRACTION_TTL."""
+    cutoff = time.monotonic() - Config.LABELING_EXTRACTION_TTL
+    for job_id, state in list(_extractions.items()):
+        finished_at = state.get("finished_at")
+        if finished_at is not None and finished_at < cutoff:
+            _extractions.pop(job_id, None)
+
+def extraction_state(job_id: str) -> Optional[dict]:
+    """Progress of a job's frame extraction; evicted or pre-restart jobs are read from disk."""
+    prune_extractions()
+    state = _extractions.get(job_id)
+    if state is not None:
+        return state
+    job_dir = get_job_dir(job_id)
+    if not os.path.isdir(job_dir):
+        return None
+    frames = sorted(f for f in os.listdir(job_dir) if f.startswith("frame_") and f.endswith(".jpg"))
+    # extract_frames writes the manifest last: without it the extraction never finished
+    if not os.path.exists(os.path.join(job_dir, FRAMES_MANIFEST)):
+        return {"status": "failed", "frames": frames, "sources": {}, "total": len(frames),
+                "error": "Frame extraction did not finish"}
+    sources = load_frames_manifest(job_dir)
+    return {"status": "ready", "frames": frames, "sources": sources, "total": len(frames), "error": None}
+
+def frames_payload(job_id: str, state: dict, start: int = 0) -> dict:
+    frames = list(state["frames"][start:])
+    return {
+        "job_id": job_id,
+        "status": state["status"],
+        "total": state["total"],
+        "extracted": start + len(frames),
+        "frames": [frame_url(job_id, f) for f in frames],
+        # Source position of each frame in the video ({"frame", "timestamp"})
+        "sources": [state["sources"].get(f) for f in frames],
+        "error": state.get("error")
+    }
+
+def to_boxes(raw_boxes: list) -> List[BoundingBox]:
+    boxes = []
+    for b in raw_boxes:
+        try:
+            boxes.append(BoundingBox(**b))
+        except Exception:
+            logger.warning(f"Skipping invalid box: {b}")
+    return boxes
 
 def get_ai_client():
     config = Config.ASSISTANT_CONFIG
     return AsyncOpenAI(
         api_key=config.get("api_key"),
-        base_url=config.get("base_url")
+        base_url=config.get("base_url"),
+        max_retries=0 # Retries are handled by the rate limiter
     )
 
+def run_dataset_export(ctx):
+    """Job handler: exports a labeling job in the requested formats, reporting progress per frame."""
+    params = ctx.params
+    job_dir = get_job_dir(params["job_id"])
+    labels = params.get("labels")
+    if labels is None:
+        labels = LabelLog(job_dir).load()
+    output_dir = os.path.join(job_dir, "exports", params["dataset_name"])
+    outputs = export_dataset(job_dir, labels, output_dir, params["formats"], progress=ctx.report_progress)
+    return {"output_dir": output_dir, "outputs": outputs, "frames": len(labels)}
+
+get_job_queue().register_handler("dataset_export", run_dataset_export)
+
+def queue_export(job_id: str, dataset_name: str, formats: List[str], labels: Optional[Dict[str, list]] = None) -> dict:
+    unknown = set(formats) - set(EXPORT_FORMATS)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown export formats: {sorted(unknown)}")
+    job = get_job_queue().submit("dataset_export", {
+        "job_id": job_id, "dataset_name": dataset_name, "formats": formats, "labels": labels
+    })
+    return {"export_job_id": job["id"], "status_url": f"/api/v1/jobs/{job['id']}"}
+
 # --- Endpoints ---
 
 @router.post("/init", response_model=InitResponse)
@@ -80,20 +197,121 @@ async def init_labeling(request: InitRequest):
     if not os.path.exists(video_path):
         raise HTTPException(status_code=404, detail="Video not found")
 
+    if request.selection not in FRAME_SELECTIONS:
+        raise HTTPException(status_code=400, detail=f"Unknown frame selection: {request.selection}")
+
     job_id = str(uuid.uuid4())
-    job_dir = get_job_dir(job_id)
-    
+    os.makedirs(get_job_dir(job_id), exist_ok=True)
+
+    # Extraction runs in a worker; frames become available as they are written
+    prune_extractions()
+    _extractions[job_id] = {"status": "extracting", "frames": [], "sources": {}, "total": request.num_frames, "error": None}
+    _extraction_pool.submit(run_extraction, job_id, video_path, request.num_frames, request.selection)
+
+    return InitResponse(
+        job_id=job_id,
+        frames=[],
+        status="extracting",
+        frames_url=f"/api/v1/labeling/{job_id}/frames",
+        stream_url=f"/api/v1/labeling/ws/{job_id}/frames"
+    )
+
+@router.get("/{job_id}/frames")
+async def get_frames(job_id: str, start: int = 0):
+    """Frames extracted so far (from index `start`) and the extraction status."""
+    state = extraction_state(job_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return frames_payload(job_id, state, max(0, start))
+
+@router.websocket("/ws/{job_id}/frames")
+async def stream_frames(websocket: WebSocket, job_id: str):
+    """
+    Pushes {"type": "frames", "frames": [...]} as frames are extracted, then
+    {"type": "done"} (or {"type": "error"}) when extraction finishes.
+    """
+    await websocket.accept()
+    state = extraction_state(job_id)
+    if state is None:
+        await websocket.send_json({"type": "error", "message": "Job not found"})
+        await websocket.close()
+        return
+
+    sent = 0
     try:
-        frames = extract_frames(video_path, job_dir, request.num_frames)
-    except Exception as e:
-        logger.error(f"Frame extraction failed: {e}")
-        raise HTTPException(status_code=500, detail=f"Frame extraction failed: {str(e)}")
+        while True:
+            status = state["status"]
+            payload = frames_payload(job_id, state, sent)
+            if payload["frames"]:
+                await websocket.send_json({"type": "frames", **payload})
+                sent = payload["extracted"]
+            if status == "failed":
+                await websocket.send_json({"type": "error", "message": state.get("error")})
+                break
+            if status == "ready":
+                await websocket.send_json({"type": "done", "total": sent})
+                break
+            await asyncio.sleep(0.2)
+    except WebSocketDisconnect:
+        return
+    await websocket.close()
 
-    # Return URLs accessible via static mount
-    # Assuming /uploads is mounted to UPLOAD_DIR
-    frame_urls = [f"/uploads/labeling_jobs/{job_id}/{f}" for f in frames]
-    
-    return InitResponse(job_id=job_id, frames=frame_urls)
+async def iter_predictions(request: PredictRequest, job_dir: str, predictor: Optional[LabelingPredictor] = None):
+    """
+    Yields a LabelEntry per target as soon as it is ready: propagated frames
+    first, then model predictions in completion order. API calls go through
+    the provider's adaptive rate limiter, with retries on 429/5xx/timeouts.
+    """
+    predictor = predictor or LabelingPredictor(get_ai_client())
+    loop = asyncio.get_event_loop()
+
+    # Local propagation first (CPU, off the event loop); only the rest goes to the model
+    propagated = {}
+    model_targets = request.targets
+    if request.propagate:
+        examples = {
+            os.path.basename(e.frame): [b.dict() for b in e.boxes]
+            for e in request.examples
+        }
+        targets = [os.path.basename(t) for t in request.targets]
+        try:
+            propagated, escalated = await loop.run_in_executor(
+                None, propagate_labels, job_dir, examples, targets, request.min_confidence
+            )
+            escalated = set(escalated)
+            model_targets = [t for t in request.targets if os.path.basename(t) in escalated]
+        except Exception as e:
+            logger.error(f"Label propagation failed, using the model for every target: {e}")
+
+    for target in request.targets:
+        local = propagated.get(os.path.basename(target))
+        if local:
+            yield LabelEntry(
+                frame=target, boxes=[BoundingBox(**b) for b in local["boxes"]],
+                source="propagated", confidence=local["confidence"]
+            )
+
+    if not model_targets:
+        return
+    # Few-shot context (downscaled examples) is built once per job and set of examples
+    context = await loop.run_in_executor(None, get_fewshot_context, job_dir, [e.dict() for e in request.examples])
+
+    # Model predictions in parallel (bounded by the rate limiter), in completion order.
+    # Several targets share one request when the provider accepts multiple images.
+    tasks = [
+        asyncio.ensure_future(predictor.predict_group(context, job_dir, group))
+        for group in predictor.groups(model_targets)
+    ]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            for result in await next_done:
+                yield LabelEntry(
+                    frame=result["frame"], boxes=to_boxes(result["boxes"]), source="model"
+                )
+    finally:
+        # Client gone or generator closed early: drop the pending requests
+        for task in tasks:
+            task.cancel()
 
 @router.post("/predict", response_model=PredictResponse)
 async def predict_labels(request: PredictRequest):
@@ -101,112 +319,61 @@ async def predict_labels(request: PredictRequest):
     if not os.path.exists(job_dir):
         raise HTTPException(status_code=404, detail="Job not found")
 
-    client = get_ai_client()
-    model = Config.ASSISTANT_CONFIG.get("model", "gemini-2.0-flash")
-
-    # Construct messages for Few-Shot Learning
-    messages = [
-        {
-            "role": "system", 
-            "content": """You are an expert vision assistant. Your task is to detect and label objects in images based on provided examples.
-Output ONLY a JSON list of bounding boxes for the target image. 
-Format: [{"label": "class_name", "x": 0, "y": 0, "w": 0, "h": 0}, ...]
-Coordinates (x, y, w, h) should be normalized to 0-1000 scale.
-If no objects are found, output []."""
-        }
-    ]
+    predictor = LabelingPredictor(get_ai_client())
+    results = {}
+    async for prediction in iter_predictions(request, job_dir, predictor):
+        results[prediction.frame] = prediction
+    predictions = [results[target] for target in request.targets if target in results]
 
-    # Add examples (User: Image -> Assistant: Label)
-    for example in request.examples:
-        frame_path = os.path.join(job_dir, os.path.basename(example.frame))
-        if not os.path.exists(frame_path):
-            continue # Skip missing files
-            
-        base64_image = encode_image(frame_path)
-        
-        # Convert boxes to simple list of dicts for prompt
-        boxes_json = json.dumps([b.dict() for b in example.boxes])
-        
-        messages.append({
-            "role": "user",
-            "content": [
-                {"type": "text", "text": "Detect objects in this image:"},
-                {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}}
-            ]
-        })
-        messages.append({
-            "role": "assistant",
-            "content": boxes_json
-        })
-
-    # Prepare predictions
-    predictions = []
-    
-    semaphore = asyncio.Semaphore(5) # Limit concurrency to avoid rate limits
-    
-    async def predict_single(target_filename):
-        async with semaphore:
-            target_path = os.path.join(job_dir, os.path.basename(target_filename))
-            if not os.path.exists(target_path):
-                return None
-            
-            base64_target = encode_image(target_path)
-            
-            # Copy messages and add the target
-            current_messages = list(messages)
-            current_messages.append({
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": "Detect objects in this image:"},
-                    {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_target}"}}
-                ]
-            })
-            
-            try:
-                response = await client.chat.completions.create(
-                    model=model,
-                    messages=current_messages,
-                    max_tokens=1000,
-                    response_format={"type": "json_object"}
-                )
-                content = response.choices[0].message.content.strip()
-                logger.info(f"AI Response for {target_filename}: {content}")
-                
-                # Clean markdown code blocks if present
-                try:
-                    # Some models might wrap list in a key
-                    parsed = json.loads(content)
-                    
-                    raw_boxes = []
-                    if isinstance(parsed, dict):
-                        if "boxes" in parsed and isinstance(parsed["boxes"], list):
-                            raw_boxes = parsed["boxes"]
-                        else:
-                            # Fallback: look for any list
-                            for v in parsed.values():
-                                if isinstance(v, list):
-                                    raw_boxes = v
-                                    break
-                    elif isinstance(parsed, list):
-                        raw_boxes = parsed
-                    
-                    boxes = [BoundingBox(**b) for b in raw_boxes]
-                except:
-                    logger.warning(f"Failed to parse prediction for {target_filename}: {content}")
-                    boxes = []
-                    
-                return LabelEntry(frame=target_filename, boxes=boxes)
-            except Exception as e:
-                logger.error(f"Error predicting {target_filename}: {e}")
-                return LabelEntry(frame=target_filename, boxes=[])
-
-    # Run in parallel with semaphore
-    tasks = [predict_single(target) for target in request.targets]
-    results = await asyncio.gather(*tasks)
-    
-    predictions = [r for r in results if r is not None]
-    
-    return PredictResponse(predictions=predictions)
+    model_count = sum(1 for p in predictions if p.source == "model")
+    stats = {
+        "propagated": sum(1 for p in predictions if p.source == "propagated"),
+        "model": model_count,
+        **predictor.summary(model_count)
+    }
+    return PredictResponse(predictions=predictions, stats=stats)
+
+@router.websocket("/ws/predict")
+async def predict_labels_stream(websocket: WebSocket):
+    """
+    Streaming variant of /predict: the client sends a PredictRequest and gets
+    {"type": "prediction", "prediction": LabelEntry} per frame as soon as it is
+    ready, then {"type": "done", "stats": {...}}.
+    """
+    await websocket.accept()
+    try:
+        request = PredictRequest(**await websocket.receive_json())
+    except WebSocketDisconnect:
+        return
+    except Exception as e:
+        await websocket.send_json({"type": "error", "message": f"Invalid request: {e}"})
+        await websocket.close()
+        return
+
+    job_dir = get_job_dir(request.job_id)
+    if not os.path.exists(job_dir):
+        await websocket.send_json({"type": "error", "message": "Job not found"})
+        await websocket.close()
+        return
+
+    stats = {"propagated": 0, "model": 0}
+    predictor = LabelingPredictor(get_ai_client())
+    predictions = iter_predictions(request, job_dir, predictor)
+    try:
+        async for prediction in predictions:
+            stats[prediction.source] = stats.get(prediction.source, 0) + 1
+            await websocket.send_json({"type": "prediction", "prediction": prediction.dict()})
+        stats.update(predictor.summary(stats["model"]))
+        await websocket.send_json({"type": "done", "stats": stats})
+        await websocket.close()
+    except WebSocketDisconnect:
+        logger.info(f"Prediction stream for job {request.job_id} closed by client")
+    except Exception as e:
+        logger.error(f"Prediction stream for job {request.job_id} failed: {e}")
+        await websocket.send_json({"type": "error", "message": str(e)})
+        await websocket.close()
+    finally:
+        await predictions.aclose()
 
 @router.post("/save")
 async def save_dataset(request: SaveRequest):
@@ -223,6 +390,48 @@ async def save_dataset(request: SaveRequest):
     }
     
     with open(output_file, "w") as f:
-        json.dump(data, f, indent=2)
-        
-    return {"status": "saved", "path": output_file}
+        json.dump(data, f)
+
+    result = {"status": "saved", "path": output_file}
+    if request.formats:
+        labels = {entry.frame: [b.dict() for b in entry.boxes] for entry in request.labels}
+        result.update(queue_export(request.job_id, dataset_name, request.formats, labels))
+    return result
+
+@router.post("/autosave")
+async def autosave_labels(request: AutosaveRequest):
+    """
+    Appends the changed frames to the job's label log (labels.ndjson) instead of
+    rewriting every label. GET /labeling/{job_id}/labels returns the current state.
+    """
+    job_dir = get_job_dir(request.job_id)
+    if not os.path.exists(job_dir):
+        raise HTTPException(status_code=404, detail="Job not found")
+    entries = [{"frame": e.frame, "boxes": [b.dict() for b in e.boxes]} for e in request.labels]
+    loop = asyncio.get_event_loop()
+    saved = await loop.run_in_executor(None, LabelLog(job_dir).append, entries)
+    return {"status": "saved", "frames": saved}
+
+@router.get("/{job_id}/labels")
+async def get_labels(job_id: str):
+    job_dir = get_job_dir(job_id)
+    if not os.path.exists(job_dir):
+        raise HTTPException(status_code=404, detail="Job not found")
+    loop = asyncio.get_event_loop()
+    labels = await loop.run_in_executor(None, LabelLog(job_dir).load)
+    return {"job_id": job_id, "labels": [{"frame": frame, "boxes": boxes} for frame, boxes in labels.items()]}
+
+@router.post("/export")
+async def export_labels(request: ExportRequest):
+    """
+    Queues a background export (COCO, YOLO and/or tar shards of image + annotation)
+    to uploads/labeling_jobs/{job_id}/exports/{dataset_name}/. Progress on /api/v1/jobs/{id}.
+    """
+    job_dir = get_job_dir(request.job_id)
+    if not os.path.exists(job_dir):
+        raise HTTPException(status_code=404, detail="Job not found")
+    labels = None
+    if request.labels is not None:
+        labels = {entry.frame: [b.dict() for b in entry.boxes] for entry in request.labels}
+    dataset_name = os.path.basename(request.dataset_name or f"dataset_{request.job_id}")
+    return queue_export(request.job_id, dataset_name, request.formats, labels)
@@ -1,10 +1,10 @@
 import os
-import shutil
 import cv2
 import json
 import asyncio
-from fastapi import APIRouter, UploadFile, File, WebSocket, HTTPException
-from fastapi.responses import FileResponse, JSONResponse
+import threading
+from fastapi import APIRouter, UploadFile, File, WebSocket, HTTPException, BackgroundTasks, Request
+from fastapi.responses import FileResponse, JSONResponse, Response
 from pydantic import BaseModel
 from typing import Optional
 
@@ -12,6 +12,13 @@ from src.analysis.pipeline import VideoAnalyzer
 from src.config import Config
 from src.prompts import DEFAULT_SYSTEM_PROMPT, DEFAULT_USER_PROMPT
 from src.services.assistant import PromptAssistant
+from src.services.event_store import get_event_store
+from src.services.frame_server import get_frame_server
+from src.services.upload_store import UploadStore, UploadError, CHUNK_SIZE
+from src.utils.cancellation import CancellationToken, OperationCancelled
+from src.utils.progress import ProgressChannel
+from src.utils.video_index import get_video_index
+from src.utils.video_processing import generate_sprite_sheets
 
 router = APIRouter()
 
@@ -127,45 +134,132 @@ async def websocket_logs(websocket: WebSocket):
     except:
         manager.disconnect(websocket)
 
+upload_store = UploadStore(UPLOAD_DIR)
+
+class UploadSessionRequest(BaseModel):
+    filename: str
+    size: Optional[int] = None
+
+def _schedule_probe(background_tasks: BackgroundTasks, stored: dict):
+    # Probe/index once per stored object; a deduplicated upload is already indexed
+    if upload_store.is_video(stored["filename"]):
+        background_tasks.add_task(get_video_index, stored["path"])
+
+async def _iter_upload_file(file: UploadFile):
+    while True:
+        chunk = await file.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        yield chunk
+
 @router.post("/upload")
-async def upload_video(file: UploadFile = File(...)):
-# ... (rest of code)
-    file_location = os.path.join(UPLOAD_DIR, file.filename)
-    with open(file_location, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-    
-    return {"filename": file.filename, "url": f"/uploads/{file.filename}"}
+async def upload_video(background_tasks: BackgroundTasks, file: UploadFile = File(...)):
+    stored = await upload_store.store_stream(file.filename, _iter_upload_file(file))
+    _schedule_probe(background_tasks, stored)
+    return {k: v for k, v in stored.items() if k != "path"}
+
+@router.post("/upload/sessions")
+def create_upload_session(request: UploadSessionRequest):
+    """Starts a resumable chunked upload."""
+    return upload_store.create_session(request.filename, request.size)
+
+@router.get("/upload/sessions/{upload_id}")
+def get_upload_session(upload_id: str):
+    """Returns how many bytes were received so a client can resume."""
+    try:
+        return upload_store.get_session(upload_id)
+    except UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+@router.put("/upload/sessions/{upload_id}")
+async def upload_chunk(upload_id: str, request: Request, offset: int = 0):
+    """Appends the raw request body at `offset` (must match the bytes already received)."""
+    try:
+        return await upload_store.write_chunk(upload_id, offset, request.stream())
+    except UploadError as e:
+        detail = {"message": str(e), "received": e.received}
+        raise HTTPException(status_code=e.status_code, detail=detail)
+
+@router.post("/upload/sessions/{upload_id}/complete")
+async def complete_upload(upload_id: str, background_tasks: BackgroundTasks):
+    try:
+        stored = await upload_store.complete(upload_id)
+    except UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail={"message": str(e), "received": e.received})
+    _schedule_probe(background_tasks, stored)
+    return {k: v for k, v in stored.items() if k != "path"}
 
 @router.get("/video/{filename}/frame")
-async def get_video_frame(filename: str, timestamp: float = 0.0):
+async def get_video_frame(filename: str, request: Request, timestamp: float = 0.0, width: Optional[int] = None):
     video_path = os.path.join(UPLOAD_DIR, filename)
     if not os.path.exists(video_path):
         raise HTTPException(status_code=404, detail="Video not found")
-        
-    cap = cv2.VideoCapture(video_path)
-    # Calculate frame number
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    frame_no = int(timestamp * fps)
-    cap.set(cv2.CAP_PROP_POS_FRAMES, frame_no)
-    
-    ret, frame = cap.read()
-    cap.release()
-    
-    if not ret:
-        raise HTTPException(status_code=500, detail="Could not read frame")
-        
-    # Encode to jpg
-    ret, buffer = cv2.imencode('.jpg', frame)
-    if not ret:
-        raise HTTPException(status_code=500, detail="Could not encode frame")
-        
-    # Save temp file to serve (or stream bytes directly)
-    # Streaming bytes is better but FileResponse is easier for now with temp file
-    temp_frame = f"temp_frame_{filename}_{timestamp}.jpg"
-    with open(temp_frame, "wb") as f:
-        f.write(buffer)
-        
-    return FileResponse(temp_frame)
+
+    frame_server = get_frame_server()
+    loop = asyncio.get_event_loop()
+
+    try:
+        frame_no, width, etag = await loop.run_in_executor(
+            None, lambda: frame_server.resolve(video_path, timestamp, width)
+        )
+        headers = {
+            "Cache-Control": "public, max-age=86400",
+            "ETag": etag,
+            "X-Frame-Index": str(frame_no),
+        }
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers=headers)
+
+        # Decode in the executor: the frame server keeps decoders open and caches JPEG bytes
+        data, _ = await loop.run_in_executor(
+            None, lambda: frame_server.get_frame(video_path, timestamp, width)
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    return Response(content=data, media_type="image/jpeg", headers=headers)
+
+SPRITES_DIR = os.path.join(UPLOAD_DIR, "sprites")
+_sprite_locks = {}
+
+def _get_sprite_sheets(video_path: str, output_dir: str, interval: float, tile_width: int, columns: int) -> dict:
+    # One generation per (video, params); concurrent requests wait for the same pass
+    lock = _sprite_locks.setdefault(output_dir, threading.Lock())
+    with lock:
+        index_file = os.path.join(output_dir, "index.json")
+        if os.path.exists(index_file) and os.path.getmtime(index_file) >= os.path.getmtime(video_path):
+            with open(index_file, "r") as f:
+                return json.load(f)
+        return generate_sprite_sheets(video_path, output_dir, interval=interval, tile_width=tile_width, columns=columns)
+
+@router.get("/video/{filename}/sprites")
+async def get_video_sprites(filename: str, interval: float = 1.0, tile_width: int = 160, columns: int = 10):
+    """
+    Timeline thumbnails as sprite sheets plus a tile -> timestamp index,
+    generated in one sequential decode pass and cached on disk per video.
+    """
+    video_path = os.path.join(UPLOAD_DIR, filename)
+    if not os.path.exists(video_path):
+        raise HTTPException(status_code=404, detail="Video not found")
+    if interval <= 0 or not 16 <= tile_width <= 640 or not 1 <= columns <= 50:
+        raise HTTPException(status_code=400, detail="Invalid sprite parameters")
+
+    variant = f"{interval:g}s_{tile_width}w_{columns}c"
+    output_dir = os.path.join(SPRITES_DIR, filename, variant)
+
+    loop = asyncio.get_event_loop()
+    try:
+        sprite_index = await loop.run_in_executor(
+            None, lambda: _get_sprite_sheets(video_path, output_dir, interval, tile_width, columns)
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    base_url = f"/uploads/sprites/{filename}/{variant}"
+    return {
+        **sprite_index,
+        "sheet_urls": [f"{base_url}/{sheet}" for sheet in sprite_index["sheets"]]
+    }
 
 @router.get("/config")
 def get_config():
@@ -232,32 +326,51 @@ async def websocket_endpoint(websocket: WebSocket):
 
         analyzer = get_analyzer()
         
-        # Define callback to push to websocket
-        # Note: WebSocket send is async, but analyzer is sync. 
-        # We need a way to bridge this. 
-        # For this prototype, we'll use a queue or just run analyzer in a thread 
-        # and use an event loop safe way to send messages.
-        # OR simpler: We just make the callback run_coroutine_threadsafe if we were async,
-        # but here we are inside an async handler calling a sync function.
-        # We can use fastapi's background tasks or run_in_executor.
-        
-        # Let's use a simple queue approach or direct send if we can.
-        # Since analyze_video is blocking, we should run it in an executor.
-        
         loop = asyncio.get_event_loop()
         
-        def progress_callback(event):
-            # This runs in the thread, so we need to schedule sending to WS on the loop
-            asyncio.run_coroutine_threadsafe(websocket.send_json(event), loop)
-
         roi_tuple = None
         if roi:
             roi_tuple = (int(roi['x']), int(roi['y']), int(roi['w']), int(roi['h']))
 
+        if data.get("dry_run"):
+            # Solo la estimación de tokens/memoria, sin llamar al modelo
+            plan = await loop.run_in_executor(
+                None,
+                lambda: analyzer.plan(
+                    video_path, detail=current_config["detail"], roi=roi_tuple,
+                    system_prompt=current_config["system_prompt"], user_prompt=current_config["user_prompt"]
+                )
+            )
+            await websocket.send_json({"type": "plan", "plan": plan})
+            return
+        
+        # El hilo de análisis publica en un canal acotado; si el cliente va lento
+        # los eventos se fusionan y, en último caso, el análisis espera.
+        # Si el cliente se desconecta (o envía {"type": "cancel"}) se cancela el análisis.
+        cancel_token = CancellationToken()
+        channel = ProgressChannel(loop, cancel_token=cancel_token)
+
+        def cancel():
+            cancel_token.cancel()
+            channel.close()
+
+        async def watch_client():
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    cancel()
+                    return
+                try:
+                    payload = json.loads(message.get("text") or "{}")
+                except ValueError:
+                    continue
+                if isinstance(payload, dict) and payload.get("type") == "cancel":
+                    cancel()
+
         await websocket.send_json({"type": "status", "message": "Starting analysis..."})
 
         # Run analysis in a separate thread to not block the event loop
-        result, segments = await loop.run_in_executor(
+        analysis = loop.run_in_executor(
             None, 
             lambda: analyzer.analyze_video(
                 video_path, 
@@ -265,12 +378,38 @@ async def websocket_endpoint(websocket: WebSocket):
                 roi=roi_tuple,
                 system_prompt=current_config["system_prompt"],
                 user_prompt=current_config["user_prompt"],
-                progress_callback=progress_callback
+                progress_callback=channel.put,
+                cancel_token=cancel_token
             )
         )
+        analysis.add_done_callback(lambda _: channel.close())
+        watcher = asyncio.create_task(watch_client())
+        try:
+            while (event := await channel.get()) is not None:
+                await websocket.send_json(event)
+            result, segments = await analysis
+        except Exception:
+            cancel()
+            raise
+        finally:
+            watcher.cancel()
         
-        await websocket.send_json({"type": "complete", "result": json.loads(result)})
+        await websocket.send_json({"type": "complete", "result": result})
         
+        # Index the events so they can be queried across videos
+        try:
+            await loop.run_in_executor(
+                None, lambda: get_event_store().ingest_report(filename, result, detail=current_config["detail"])
+            )
+        except Exception as e:
+            logging.getLogger(__name__).warning(f"Could not index analysis events: {e}")
+        
+    except OperationCancelled:
+        logging.getLogger(__name__).info(f"Analysis of {filename} cancelled by client")
+        try:
+            await websocket.send_json({"type": "cancelled"})
+        except:
+            pass
     except Exception as e:
         print(f"Error: {e}")
         try:
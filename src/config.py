@@ -35,6 +35,78 @@ class Config:
     
     # Analysis Configuration
     DEFAULT_DETAIL = "medium"
+    # Continuaciones automáticas cuando la salida de un modelo local se corta por max_tokens
+    MAX_CONTINUATIONS = 1
+    # Máximo de tokens de prefill (visuales + texto) por llamada al modelo.
+    # Si un segmento lo supera se reducen max_pixels/fps automáticamente (None = sin límite).
+    PREFILL_TOKEN_BUDGET = 16384
+
+    # Local storage (SQLite)
+    EVENT_STORE_PATH = "data/events.db"
+    JOB_STORE_PATH = "data/jobs.db"
+    JOBS_DIR = "data/jobs"
+    RUN_CATALOG_PATH = "data/runs.db"
+
+    # Subidas reanudables: fuera de uploads/ (que se sirve como estático) y con expiración
+    UPLOAD_PARTIAL_DIR = "data/upload_partials"
+    UPLOAD_SESSION_TTL = 24 * 3600  # Segundos sin recibir chunks antes de descartar una sesión
+
+    # Batch jobs: cuántos análisis corren en paralelo (comparten un solo motor)
+    JOB_WORKERS = 1
+
+    # Grounding suites: configs del mismo modelo por generate() y refinamientos por API en paralelo
+    GROUNDING_BATCH_SIZE = 4
+    GROUNDING_REFINE_WORKERS = 4
+    # Grounding coarse-to-fine: primera pasada a baja resolución, luego recorte a resolución completa
+    COARSE_MAX_PIXELS = 640 * 28 * 28
+    COARSE_MARGIN = 0.1  # Margen alrededor de la región encontrada (fracción del ancho/alto)
+    COARSE_MIN_REGION = 0.25  # Lado mínimo del recorte (fracción del ancho/alto)
+    COARSE_MAX_REGION = 0.6  # Si la región cubre más área que esto, se usa la primera pasada
+    # Grounding por tiles para capturas muy anchas / multi-monitor
+    TILE_MAX_PIXELS = 1024 * 28 * 28  # Resolución nativa por tile
+    TILE_OVERLAP = 0.15  # Solapamiento entre tiles (fracción del lado del tile)
+    TILE_DEDUPE_IOU = 0.5
+
+    # Visualización de resultados de grounding (se renderiza fuera de la inferencia)
+    VISUALIZATION_WORKERS = 2
+    VISUALIZATION_QUALITY = 85
+    VISUALIZATION_PREVIEW_WIDTH = 640
+
+    # Etiquetado: propagación local de cajas entre frames antes de llamar al modelo
+    PROPAGATION_MIN_CONFIDENCE = 0.6
+    PROPAGATION_KEYFRAME_INTERVAL = 10  # Frames máximos desde un ejemplo etiquetado
+    PROPAGATION_WORK_WIDTH = 640
+    # Selección de frames por diversidad: frames escaneados por frame pedido y tamaño de la miniatura
+    FRAME_SELECTION_OVERSAMPLE = 10
+    FRAME_SELECTION_SCAN_WIDTH = 64
+
+    # Llamadas a la API remota (etiquetado): token bucket adaptativo por proveedor
+    API_RATE_LIMIT = 2.0  # Peticiones/segundo iniciales
+    API_RATE_BURST = 5
+    API_RATE_MIN = 0.2
+    API_RATE_MAX = 10.0
+    API_MAX_CONCURRENCY = 5
+    API_TARGET_LATENCY = 15.0  # Segundos; respuestas más lentas reducen la tasa
+    API_MAX_RETRIES = 3
+    API_RETRY_BASE_DELAY = 1.0
+
+    # Etiquetado con el modelo remoto: imágenes reducidas y varios frames por petición
+    LABELING_EXAMPLE_MAX_SIDE = 768
+    LABELING_TARGET_MAX_SIDE = 1024
+    LABELING_JPEG_QUALITY = 80
+    LABELING_EXTRACTION_TTL = 600  # Segundos que se guarda en memoria el estado de una extracción terminada
+    # targets_per_request > 1 solo si el proveedor acepta varias imágenes por mensaje;
+    # prompt_cache_key solo donde la API lo soporta (caché de prefijo del lado del proveedor)
+    LABELING_PROVIDER_FEATURES = {
+        "gemini": {"targets_per_request": 4},
+        "openai": {"targets_per_request": 4, "prompt_cache_key": True},
+        "kilo": {"targets_per_request": 1},
+    }
+
+    # Exportación de datasets de etiquetado
+    EXPORT_SHARD_SIZE = 500  # Muestras por shard tar
+    LABELS_LOG_COMPACT_MIN_BYTES = 1024 * 1024  # El autoguardado se compacta recién desde este tamaño
+    LABELS_LOG_COMPACT_FACTOR = 4  # ... y si tiene más de N líneas por frame etiquetado
 
     # AI Assistant Configuration (Prompt Editor)
     ASSISTANT_CONFIG = {
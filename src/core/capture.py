@@ -7,15 +7,18 @@ class ScreenCapture:
     def __init__(self):
         self.sct = mss.mss()
 
-    def capture_screen(self, monitor_index: int = 1) -> Image.Image:
+    def capture_screen(self, monitor_index: int = 0) -> Image.Image:
         """
-        Captura la pantalla completa.
+        Captura la unión de todos los monitores (monitor_index=0, por defecto) o uno solo (1 = principal).
+        Para capturas multi-monitor muy anchas conviene el grounding por tiles
+        (config "tiled") o monitor_regions() para separarlas.
         Soporta: MSS (Nativo Linux/Windows), System Fallback (scrot/gnome-screenshot) y WSL2 (PowerShell).
         """
         try:
             # Intento 1: MSS (Rápido y eficiente para Linux nativo / Windows nativo)
             # En WSL, esto fallará con XGetImage error porque no hay X11 display real del host.
-            monitor = self.sct.monitors[0]
+            monitors = self.sct.monitors
+            monitor = monitors[monitor_index] if monitor_index < len(monitors) else monitors[0]
             sct_img = self.sct.grab(monitor)
             img = Image.frombytes("RGB", sct_img.size, sct_img.bgra, "raw", "BGRX")
             return img
@@ -33,6 +36,15 @@ class ScreenCapture:
             # Intento 2: Fallback para Linux nativo (Wayland/X11 restringido)
             return self._capture_linux_fallback()
 
+    def monitor_regions(self) -> list:
+        """Rectángulo [x1, y1, x2, y2] de cada monitor dentro de la captura completa (monitor_index=0)."""
+        union, *monitors = self.sct.monitors
+        return [
+            [m["left"] - union["left"], m["top"] - union["top"],
+             m["left"] - union["left"] + m["width"], m["top"] - union["top"] + m["height"]]
+            for m in monitors
+        ]
+
     def _capture_wsl_powershell(self) -> Image.Image:
         """
         Usa PowerShell desde WSL para capturar la pantalla de Windows.
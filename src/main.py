@@ -3,6 +3,8 @@ from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 from src.api.routes import router
 from src.api.labeling import router as labeling_router
+from src.api.events import router as events_router
+from src.api.jobs import router as jobs_router
 
 app = FastAPI(
     title="PixelSense API",
@@ -14,6 +16,8 @@ app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
 
 app.include_router(router, prefix="/api/v1")
 app.include_router(labeling_router, prefix="/api/v1")
+app.include_router(events_router, prefix="/api/v1")
+app.include_router(jobs_router, prefix="/api/v1")
 
 @app.get("/")
 def health_check():
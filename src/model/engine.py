@@ -1,16 +1,29 @@
 import torch
 from transformers import Qwen2_5_VLForConditionalGeneration, AutoProcessor, AutoModelForCausalLM, MllamaForConditionalGeneration
+from transformers import StoppingCriteria, StoppingCriteriaList
 from qwen_vl_utils import process_vision_info
 from PIL import Image
 import logging
 import os
+import threading
+from contextlib import contextmanager
 from openai import OpenAI
 from src.config import Config
+from src.utils.cancellation import raise_if_cancelled
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+class CancellationCriteria(StoppingCriteria):
+    """Detiene generate() en el siguiente token si se canceló la operación."""
+
+    def __init__(self, cancel_token):
+        self.cancel_token = cancel_token
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return torch.full((input_ids.shape[0],), self.cancel_token.cancelled, dtype=torch.bool, device=input_ids.device)
+
 class VisionEngine:
     _instance = None
 
@@ -22,9 +35,31 @@ class VisionEngine:
             cls._instance.device = "cuda" if torch.cuda.is_available() else "cpu"
             cls._instance.current_model_name = None
             cls._instance.api_client = None
+            # Serializa carga e inferencia: los workers de jobs comparten este motor
+            cls._instance._lock = threading.RLock()
         return cls._instance
 
     def load_model(self, model_name: str = "Qwen/Qwen2.5-VL-3B-Instruct"):
+        with self._lock:
+            return self._load_model(model_name)
+
+    @contextmanager
+    def exclusive(self):
+        """
+        Retiene el motor durante todo el bloque: carga e inferencias dentro del
+        bloque ven el mismo modelo aunque otros hilos esperen (el lock es reentrante).
+        """
+        with self._lock:
+            yield self
+
+    @contextmanager
+    def using(self, model_name: str):
+        """Carga `model_name` y retiene el motor hasta salir del bloque (ver exclusive)."""
+        with self._lock:
+            self._load_model(model_name)
+            yield self
+
+    def _load_model(self, model_name: str):
         """
         Carga el modelo y el procesador en memoria.
         Soporta Qwen 2.5 VL, Phi-3.5 Vision y Llama 3.2 Vision.
@@ -137,28 +172,82 @@ class VisionEngine:
             logger.error(f"Failed to load model: {e}")
             raise e
 
-    def analyze(self, messages: list, max_tokens: int = 2048) -> str:
+    def analyze(self, messages: list, max_tokens: int = 2048, max_continuations: int = 0, cancel_token=None) -> str:
         """
         Realiza la inferencia sobre una lista de mensajes estructurados (Chat Format).
+        max_continuations: para modelos locales, cuántas veces continuar la generación
+        (reutilizando el KV cache) si la salida se cortó por max_tokens.
+        cancel_token: si se cancela, la generación se detiene en el siguiente token
+        y se lanza OperationCancelled.
         """
+        with self._lock:
+            # Puede haberse cancelado mientras esperaba el motor
+            raise_if_cancelled(cancel_token)
+            response = self._dispatch(messages, max_tokens, max_continuations, cancel_token)
+            raise_if_cancelled(cancel_token)
+            return response
+
+    def _dispatch(self, messages, max_tokens, max_continuations, cancel_token=None):
         if self.current_model_name is None:
             self.load_model() # Carga default si no hay nada
 
+        stopping_criteria = StoppingCriteriaList([CancellationCriteria(cancel_token)]) if cancel_token else None
+
         if "gemini" in self.current_model_name:
             return self._analyze_gemini_api(messages, max_tokens)
         elif "Qwen" in self.current_model_name:
-            return self._analyze_qwen(messages, max_tokens)
+            return self._analyze_qwen(messages, max_tokens, max_continuations, stopping_criteria)
         elif "Tongyi-MAI" in self.current_model_name:
             # MAI uses similar flow to Qwen but might have different chat template handling
-            return self._analyze_qwen(messages, max_tokens)
+            return self._analyze_qwen(messages, max_tokens, max_continuations, stopping_criteria)
         elif "Phi-3.5-vision" in self.current_model_name:
-            return self._analyze_phi(messages, max_tokens)
+            return self._analyze_phi(messages, max_tokens, stopping_criteria)
         elif "Llama-3.2" in self.current_model_name:
-            return self._analyze_llama(messages, max_tokens)
+            return self._analyze_llama(messages, max_tokens, stopping_criteria)
         else:
             return self._analyze_generic(messages, max_tokens)
 
-    def _analyze_gemini_api(self, messages, max_tokens):
+    def analyze_batch(self, messages_list: list, max_tokens: int = 2048, max_continuations: int = 0, cancel_token=None) -> list:
+        """
+        Inferencia de varias conversaciones con el modelo cargado.
+        Qwen/MAI las procesan en un solo generate() con padding a la izquierda;
+        el resto de modelos (o un lote de uno) se ejecutan en secuencia.
+        """
+        with self._lock:
+            raise_if_cancelled(cancel_token)
+            if self.current_model_name is None:
+                self.load_model()
+
+            batched = "Qwen" in self.current_model_name or "Tongyi-MAI" in self.current_model_name
+            if len(messages_list) == 1 or not batched:
+                responses = [
+                    self._dispatch(messages, max_tokens, max_continuations, cancel_token)
+                    for messages in messages_list
+                ]
+            else:
+                stopping_criteria = StoppingCriteriaList([CancellationCriteria(cancel_token)]) if cancel_token else None
+                responses = self._analyze_qwen_batch(messages_list, max_tokens, stopping_criteria)
+            raise_if_cancelled(cancel_token)
+            return responses
+
+    def analyze_api(self, messages: list, model_name: str, max_tokens: int = 2048) -> str:
+        """
+        Llama a un modelo por API sin tocar el modelo local cargado ni tomar el lock
+        del motor, de modo que puede correr en paralelo con la inferencia local.
+        """
+        api_key = Config.ASSISTANT_CONFIG.get("api_key")
+        if not api_key:
+            raise ValueError("API Key is required for API models")
+        client = OpenAI(api_key=api_key, base_url=Config.ASSISTANT_CONFIG.get("base_url"))
+        response = client.chat.completions.create(
+            model=model_name,
+            messages=self._to_api_messages(messages),
+            max_tokens=max_tokens
+        )
+        return response.choices[0].message.content
+
+    @staticmethod
+    def _to_api_messages(messages):
         # Convert local message format to OpenAI/Gemini format
         # Local format often has complex objects for images (PIL images)
         # We need to convert PIL images to base64 for API
@@ -191,11 +280,13 @@ class VisionEngine:
                 "role": msg["role"],
                 "content": content
             })
+        return api_messages
 
+    def _analyze_gemini_api(self, messages, max_tokens):
         try:
             response = self.api_client.chat.completions.create(
                 model=self.current_model_name,
-                messages=api_messages,
+                messages=self._to_api_messages(messages),
                 max_tokens=max_tokens
             )
             return response.choices[0].message.content
@@ -203,19 +294,76 @@ class VisionEngine:
             logger.error(f"API Error: {e}")
             return f"Error calling API: {str(e)}"
 
-    def _analyze_qwen(self, messages, max_tokens):
+    def _eos_token_ids(self):
+        eos = self.model.generation_config.eos_token_id
+        if eos is None:
+            eos = self.processor.tokenizer.eos_token_id
+        return set(eos) if isinstance(eos, (list, tuple)) else {eos}
+
+    def _analyze_qwen(self, messages, max_tokens, max_continuations=0, stopping_criteria=None):
         text = self.processor.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
         if self.device == "cuda": torch.cuda.empty_cache()
         image_inputs, video_inputs = process_vision_info(messages)
         inputs = self.processor(text=[text], images=image_inputs, videos=video_inputs, padding=True, return_tensors="pt")
         inputs = inputs.to(self.device)
+        prompt_length = inputs.input_ids.shape[1]
+        eos_ids = self._eos_token_ids()
+
         with torch.no_grad():
-            generated_ids = self.model.generate(**inputs, max_new_tokens=max_tokens)
-        generated_ids_trimmed = [out_ids[len(in_ids) :] for in_ids, out_ids in zip(inputs.input_ids, generated_ids)]
+            output = self.model.generate(
+                **inputs, max_new_tokens=max_tokens, return_dict_in_generate=True, stopping_criteria=stopping_criteria
+            )
+            sequences = output.sequences
+
+            # Si la salida se cortó por max_tokens, continuar desde el KV cache existente
+            # en vez de repetir el prefill completo (imagen/video + prompt).
+            for _ in range(max_continuations):
+                generated = sequences.shape[1] - prompt_length
+                truncated = generated > 0 and sequences[0, -1].item() not in eos_ids and generated % max_tokens == 0
+                if not truncated or output.past_key_values is None:
+                    break
+                logger.info("Output truncated at max_tokens, continuing generation from cached state...")
+                continuation_inputs = dict(inputs)
+                continuation_inputs["input_ids"] = sequences
+                continuation_inputs["attention_mask"] = torch.ones_like(sequences)
+                output = self.model.generate(
+                    **continuation_inputs,
+                    past_key_values=output.past_key_values,
+                    max_new_tokens=max_tokens,
+                    return_dict_in_generate=True,
+                    stopping_criteria=stopping_criteria
+                )
+                sequences = output.sequences
+
+        generated_ids_trimmed = [out_ids[prompt_length:] for out_ids in sequences]
         output_text = self.processor.batch_decode(generated_ids_trimmed, skip_special_tokens=True, clean_up_tokenization_spaces=False)
         return output_text[0]
 
-    def _analyze_phi(self, messages, max_tokens):
+    def _analyze_qwen_batch(self, messages_list, max_tokens, stopping_criteria=None):
+        texts = [
+            self.processor.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+            for messages in messages_list
+        ]
+        if self.device == "cuda": torch.cuda.empty_cache()
+        image_inputs, video_inputs = process_vision_info(messages_list)
+
+        # Generación por lotes: el padding debe ir a la izquierda
+        tokenizer = self.processor.tokenizer
+        padding_side = tokenizer.padding_side
+        tokenizer.padding_side = "left"
+        try:
+            inputs = self.processor(text=texts, images=image_inputs, videos=video_inputs, padding=True, return_tensors="pt")
+        finally:
+            tokenizer.padding_side = padding_side
+        inputs = inputs.to(self.device)
+
+        with torch.no_grad():
+            generated_ids = self.model.generate(**inputs, max_new_tokens=max_tokens, stopping_criteria=stopping_criteria)
+
+        generated_ids_trimmed = generated_ids[:, inputs.input_ids.shape[1]:]
+        return self.processor.batch_decode(generated_ids_trimmed, skip_special_tokens=True, clean_up_tokenization_spaces=False)
+
+    def _analyze_phi(self, messages, max_tokens, stopping_criteria=None):
         # Phi-3.5 Vision handling
         # Extract images from messages
         images = []
@@ -255,6 +403,7 @@ class VisionEngine:
             "max_new_tokens": max_tokens, 
             "temperature": 0.0, 
             "do_sample": False, 
+            "stopping_criteria": stopping_criteria,
         } 
 
         generate_ids = self.model.generate(**inputs, eos_token_id=self.processor.tokenizer.eos_token_id, **generation_args) 
@@ -263,7 +412,7 @@ class VisionEngine:
         response = self.processor.batch_decode(generate_ids, skip_special_tokens=True, clean_up_tokenization_spaces=False)[0] 
         return response
 
-    def _analyze_llama(self, messages, max_tokens):
+    def _analyze_llama(self, messages, max_tokens, stopping_criteria=None):
         # Llama 3.2 Vision handling
         # Similar extraction
         text = self.processor.apply_chat_template(messages, add_generation_prompt=True)
@@ -285,7 +434,7 @@ class VisionEngine:
         inputs = self.processor(text=text, images=images if images else None, return_tensors="pt").to(self.device)
         
         with torch.no_grad():
-            generated_ids = self.model.generate(**inputs, max_new_tokens=max_tokens)
+            generated_ids = self.model.generate(**inputs, max_new_tokens=max_tokens, stopping_criteria=stopping_criteria)
             
         generated_ids = generated_ids[:, inputs['input_ids'].shape[1]:]
         return self.processor.decode(generated_ids[0], skip_special_tokens=True)
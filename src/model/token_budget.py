@@ -0,0 +1,258 @@
+import math
+import logging
+from typing import Optional
+
+from src.config import Config
+
+logger = logging.getLogger(__name__)
+
+# Aproximación de tokens de texto sin cargar el tokenizer
+CHARS_PER_TOKEN = 4
+
+# Límites de qwen_vl_utils para video
+VIDEO_MIN_PIXELS = 128 * 28 * 28
+FPS_MIN_FRAMES = 4
+FPS_MAX_FRAMES = 768
+FRAME_FACTOR = 2
+MIN_FPS = 0.5
+
+# Factores de visión por familia de modelo.
+# patch_size * merge_size = lado en píxeles de cada token visual (Qwen);
+# temporal_patch_size = frames que se agrupan en un mismo token.
+# Las cifras de memoria son para estimar el KV cache y los pesos en bf16.
+MODEL_SPECS = {
+    "qwen": {
+        "patch_size": 14, "merge_size": 2, "temporal_patch_size": 2,
+        "image_min_pixels": 56 * 56, "image_max_pixels": 12845056,
+        "num_layers": 36, "num_kv_heads": 2, "head_dim": 128, "params_b": 3.75,
+    },
+    "mai": {
+        # MAI-UI usa la arquitectura Qwen3-VL (patch 16)
+        "patch_size": 16, "merge_size": 2, "temporal_patch_size": 2,
+        "image_min_pixels": 64 * 64, "image_max_pixels": 16777216,
+        "num_layers": 28, "num_kv_heads": 8, "head_dim": 128, "params_b": 2.1,
+    },
+    "phi": {
+        # Crops de 336px, 144 tokens por crop más la vista global (aproximado)
+        "tile_size": 336, "tokens_per_tile": 144, "max_tiles": 16,
+        "num_layers": 32, "num_kv_heads": 32, "head_dim": 96, "params_b": 4.2,
+    },
+    "llama": {
+        # Tiles de 560px con 1601 tokens cada uno (van por cross-attention)
+        "tile_size": 560, "tokens_per_tile": 1601, "max_tiles": 4,
+        "num_layers": 40, "num_kv_heads": 8, "head_dim": 128, "params_b": 10.6,
+    },
+    "gemini": {
+        # Costo fijo por imagen / por frame muestreado; sin memoria local
+        "tokens_per_image": 258,
+    },
+}
+
+BYTES_PER_PARAM = 2  # bf16 / fp16
+
+
+def model_family(model_name: str) -> str:
+    name = model_name or Config.MODEL_NAME
+    if "gemini" in name:
+        return "gemini"
+    if "Tongyi-MAI" in name:
+        return "mai"
+    if "Qwen" in name:
+        return "qwen"
+    if "Phi-3.5" in name:
+        return "phi"
+    if "Llama-3.2" in name:
+        return "llama"
+    return "qwen"
+
+
+def smart_resize(height: int, width: int, factor: int = 28, min_pixels: int = 56 * 56, max_pixels: int = 14 * 14 * 4 * 1280):
+    """Mismo redimensionado que aplica el procesador de Qwen2-VL/2.5-VL."""
+    if height < factor or width < factor:
+        raise ValueError(f"height:{height} or width:{width} must be larger than factor:{factor}")
+    elif max(height, width) / min(height, width) > 200:
+        raise ValueError(
+            f"absolute aspect ratio must be smaller than 200, got {max(height, width) / min(height, width)}"
+        )
+    h_bar = round(height / factor) * factor
+    w_bar = round(width / factor) * factor
+    if h_bar * w_bar > max_pixels:
+        beta = math.sqrt((height * width) / max_pixels)
+        h_bar = math.floor(height / beta / factor) * factor
+        w_bar = math.floor(width / beta / factor) * factor
+    elif h_bar * w_bar < min_pixels:
+        beta = math.sqrt(min_pixels / (height * width))
+        h_bar = math.ceil(height * beta / factor) * factor
+        w_bar = math.ceil(width * beta / factor) * factor
+    return h_bar, w_bar
+
+
+def smart_nframes(duration: float, video_fps: float, fps: float) -> int:
+    """Frames que muestrea qwen_vl_utils para un tramo de `duration` segundos."""
+    total_frames = max(1, int(round(duration * video_fps)))
+    min_frames = math.ceil(FPS_MIN_FRAMES / FRAME_FACTOR) * FRAME_FACTOR
+    max_frames = math.floor(min(FPS_MAX_FRAMES, total_frames) / FRAME_FACTOR) * FRAME_FACTOR
+    nframes = duration * fps
+    nframes = min(min(max(nframes, min_frames), max_frames), total_frames)
+    return max(FRAME_FACTOR, math.floor(nframes / FRAME_FACTOR) * FRAME_FACTOR)
+
+
+def _tiled_tokens(width: int, height: int, spec: dict) -> int:
+    tiles = min(spec["max_tiles"], math.ceil(width / spec["tile_size"]) * math.ceil(height / spec["tile_size"]))
+    # +1: vista global de la imagen completa
+    return (tiles + 1) * spec["tokens_per_tile"]
+
+
+def image_tokens(width: int, height: int, model_name: Optional[str] = None, max_pixels: Optional[int] = None) -> dict:
+    """Tokens visuales de una imagen y el tamaño con el que la ve el modelo."""
+    family = model_family(model_name)
+    spec = MODEL_SPECS[family]
+    if family in ("qwen", "mai"):
+        factor = spec["patch_size"] * spec["merge_size"]
+        h, w = smart_resize(max(height, factor), max(width, factor), factor=factor, min_pixels=spec["image_min_pixels"],
+                            max_pixels=max_pixels or spec["image_max_pixels"])
+        return {"tokens": (h // factor) * (w // factor), "resized": [w, h]}
+    if family == "gemini":
+        return {"tokens": spec["tokens_per_image"], "resized": [width, height]}
+    return {"tokens": _tiled_tokens(width, height, spec), "resized": [width, height]}
+
+
+def native_tile_side(model_name: Optional[str] = None, max_pixels: Optional[int] = None) -> int:
+    """Lado de un tile cuadrado que el modelo procesa sin reescalar (múltiplo de su patch o tile)."""
+    spec = MODEL_SPECS[model_family(model_name)]
+    side = math.sqrt(max_pixels or Config.TILE_MAX_PIXELS)
+    if "patch_size" in spec:
+        factor = spec["patch_size"] * spec["merge_size"]
+    else:
+        factor = spec.get("tile_size", 28)
+    return max(factor, int(side // factor) * factor)
+
+
+def video_tokens(width: int, height: int, duration: float, video_fps: float, fps: float, max_pixels: int,
+                 model_name: Optional[str] = None) -> dict:
+    """Tokens visuales de un tramo de video muestreado a `fps`."""
+    family = model_family(model_name)
+    spec = MODEL_SPECS[family]
+    nframes = smart_nframes(duration, video_fps, fps)
+    if family in ("qwen", "mai"):
+        factor = spec["patch_size"] * spec["merge_size"]
+        h, w = smart_resize(max(height, factor), max(width, factor), factor=factor, min_pixels=VIDEO_MIN_PIXELS, max_pixels=max_pixels)
+        groups = math.ceil(nframes / spec["temporal_patch_size"])
+        return {"frames": nframes, "tokens": groups * (h // factor) * (w // factor), "resized": [w, h]}
+    per_frame = image_tokens(width, height, model_name)["tokens"]
+    return {"frames": nframes, "tokens": nframes * per_frame, "resized": [width, height]}
+
+
+def text_tokens(*texts) -> int:
+    return sum(math.ceil(len(t or "") / CHARS_PER_TOKEN) for t in texts)
+
+
+def estimate_memory(prefill_tokens: int, max_new_tokens: int, model_name: Optional[str] = None) -> Optional[dict]:
+    """Pesos + KV cache para la secuencia completa. None para modelos por API."""
+    spec = MODEL_SPECS[model_family(model_name)]
+    if "num_layers" not in spec:
+        return None
+    seq_len = prefill_tokens + max_new_tokens
+    kv_per_token = 2 * spec["num_layers"] * spec["num_kv_heads"] * spec["head_dim"] * BYTES_PER_PARAM
+    weights = int(spec["params_b"] * 1e9 * BYTES_PER_PARAM)
+    kv_cache = kv_per_token * seq_len
+    return {"weights_bytes": weights, "kv_cache_bytes": kv_cache, "total_bytes": weights + kv_cache}
+
+
+def _plan_segments(meta: dict, params: dict, roi, prompt_text: str, model_name: str) -> list:
+    duration = meta["duration"]
+    segment_duration = params["segment_duration"]
+    num_segments = math.ceil(duration / segment_duration)
+    prompt_tokens = text_tokens(prompt_text)
+
+    segments = []
+    cache = {}
+    for i in range(num_segments):
+        start = i * segment_duration
+        end = min((i + 1) * segment_duration, duration)
+        length = round(end - start, 3)
+        # Todos los segmentos completos cuestan lo mismo; solo el último puede variar
+        if length not in cache:
+            main = video_tokens(meta["width"], meta["height"], length, meta["fps"], params["fps"], params["max_pixels"], model_name)
+            visual = main["tokens"]
+            if roi:
+                crop = video_tokens(roi[2], roi[3], length, meta["fps"], params["fps"], params["max_pixels"], model_name)
+                visual += crop["tokens"]
+            cache[length] = (main, visual)
+        main, visual = cache[length]
+        segments.append({
+            "segment_index": i,
+            "start": start,
+            "end": end,
+            "frames": main["frames"],
+            "resized": main["resized"],
+            "visual_tokens": visual,
+            "text_tokens": prompt_tokens,
+            "prefill_tokens": visual + prompt_tokens,
+        })
+    return segments
+
+
+def plan_video_analysis(meta: dict, params: dict, roi=None, model_name: Optional[str] = None,
+                        prompt_text: str = "", budget: Optional[int] = None) -> dict:
+    """
+    Estima el costo de analizar un video sin llamar al modelo.
+    meta: {duration, fps, width, height} (p. ej. de VideoIndex).
+    Si `budget` (tokens de prefill por segmento) se supera, reduce primero
+    max_pixels y luego fps hasta entrar en el presupuesto; `params` en el
+    resultado son los parámetros a usar.
+    """
+    model_name = model_name or Config.MODEL_NAME
+    budget = budget if budget is not None else Config.PREFILL_TOKEN_BUDGET
+    family = model_family(model_name)
+    params = dict(params)
+    segments = _plan_segments(meta, params, roi, prompt_text, model_name)
+    adjusted = False
+
+    for _ in range(20):
+        peak = max((s["prefill_tokens"] for s in segments), default=0)
+        if not budget or peak <= budget:
+            break
+        visual_peak = max(s["visual_tokens"] for s in segments)
+        ratio = max(0.1, (budget - segments[0]["text_tokens"]) / visual_peak) if visual_peak else 1.0
+        if family in ("qwen", "mai") and params["max_pixels"] > VIDEO_MIN_PIXELS:
+            params["max_pixels"] = max(VIDEO_MIN_PIXELS, int(params["max_pixels"] * min(ratio, 0.9)))
+        elif params["fps"] > MIN_FPS:
+            params["fps"] = max(MIN_FPS, round(params["fps"] * min(ratio, 0.9), 3))
+        else:
+            logger.warning(f"Cannot fit segments under the {budget} token budget (peak {peak})")
+            break
+        adjusted = True
+        segments = _plan_segments(meta, params, roi, prompt_text, model_name)
+
+    peak = max((s["prefill_tokens"] for s in segments), default=0)
+    return {
+        "model": model_name,
+        "params": params,
+        "adjusted": adjusted,
+        "budget": budget,
+        "num_segments": len(segments),
+        "total_visual_tokens": sum(s["visual_tokens"] for s in segments),
+        "total_prefill_tokens": sum(s["prefill_tokens"] for s in segments),
+        "max_prefill_tokens": peak,
+        "max_output_tokens": params["max_tokens"] * len(segments),
+        "estimated_memory": estimate_memory(peak, params["max_tokens"], model_name),
+        "segments": segments,
+    }
+
+
+def plan_image_request(width: int, height: int, model_name: Optional[str] = None, prompt_text: str = "",
+                       max_new_tokens: int = 2048) -> dict:
+    """Estimación para una petición de una imagen (grounding)."""
+    model_name = model_name or Config.MODEL_NAME
+    visual = image_tokens(width, height, model_name)
+    prefill = visual["tokens"] + text_tokens(prompt_text)
+    return {
+        "model": model_name,
+        "image_size": [width, height],
+        "resized": visual["resized"],
+        "visual_tokens": visual["tokens"],
+        "prefill_tokens": prefill,
+        "over_budget": bool(Config.PREFILL_TOKEN_BUDGET) and prefill > Config.PREFILL_TOKEN_BUDGET,
+        "estimated_memory": estimate_memory(prefill, max_new_tokens, model_name),
+    }
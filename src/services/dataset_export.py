@@ -0,0 +1,241 @@
+import io
+import os
+import json
+import time
+import tarfile
+import logging
+import threading
+from typing import Callable, Dict, List, Optional
+
+from PIL import Image
+
+from src.analysis.processing import append_ndjson, iter_ndjson
+from src.config import Config
+
+logger = logging.getLogger(__name__)
+
+LABELS_LOG = "labels.ndjson"
+EXPORT_FORMATS = ("coco", "yolo", "shards")
+
+_log_locks = {}
+_log_locks_guard = threading.Lock()
+
+
+def _lock_for(path: str) -> threading.Lock:
+    with _log_locks_guard:
+        return _log_locks.setdefault(path, threading.Lock())
+
+
+class LabelLog:
+    """
+    Autoguardado append-only de las etiquetas de un job: cada cambio agrega una
+    línea {frame, boxes, ts} y al leer gana la última de cada frame.
+    Cuando el log crece mucho respecto a los frames vivos se compacta una vez
+    (reescritura atómica), así los guardados incrementales nunca reescriben todo.
+    """
+
+    def __init__(self, job_dir: str):
+        self.path = os.path.join(job_dir, LABELS_LOG)
+        self._lock = _lock_for(self.path)
+
+    def append(self, entries: List[dict]) -> int:
+        now = time.time()
+        records = [{"frame": e["frame"], "boxes": e.get("boxes"), "ts": now} for e in entries]
+        with self._lock:
+            append_ndjson(self.path, records)
+        self._maybe_compact()
+        return len(records)
+
+    def load(self) -> Dict[str, list]:
+        """{frame: boxes} con el último estado de cada frame (boxes None = borrado)."""
+        with self._lock:
+            return self._read()
+
+    def _read(self) -> Dict[str, list]:
+        # Sin lock: quien llama ya lo tiene
+        labels = {}
+        if not os.path.exists(self.path):
+            return labels
+        for record in iter_ndjson(self.path):
+            if record.get("boxes") is None:
+                labels.pop(record["frame"], None)
+            else:
+                labels[record["frame"]] = record["boxes"]
+        return labels
+
+    def _maybe_compact(self):
+        # Chequeo barato primero: solo se cuentan líneas si el archivo ya es grande
+        if os.path.getsize(self.path) < Config.LABELS_LOG_COMPACT_MIN_BYTES:
+            return
+        # Conteo, lectura y reescritura bajo el mismo lock: un append concurrente no se pierde
+        with self._lock:
+            with open(self.path, "r") as f:
+                lines = sum(1 for _ in f)
+            labels = self._read()
+            if lines <= Config.LABELS_LOG_COMPACT_FACTOR * max(1, len(labels)):
+                return
+            tmp_path = self.path + ".tmp"
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            append_ndjson(tmp_path, [{"frame": frame, "boxes": boxes, "ts": time.time()} for frame, boxes in labels.items()])
+            os.replace(tmp_path, self.path)
+        logger.info(f"Compacted {self.path}: {lines} -> {len(labels)} lines")
+
+
+def _image_size(path: str):
+    with Image.open(path) as image:
+        return image.size
+
+
+def _classes(frames: List[tuple]) -> List[str]:
+    return sorted({box.get("label") or "object" for *_, boxes in frames for box in boxes})
+
+
+def _to_pixels(box: dict, width: int, height: int):
+    """Caja del etiquetador (x, y, w, h en 0-1000, esquina superior izquierda) -> píxeles."""
+    return (box["x"] / 1000 * width, box["y"] / 1000 * height, box["w"] / 1000 * width, box["h"] / 1000 * height)
+
+
+def resolve_frames(job_dir: str, labels: Dict[str, list]) -> List[tuple]:
+    """
+    (frame, ruta, ancho, alto, cajas) de los frames etiquetados que existen, en orden.
+    Se resuelve una sola vez por exportación: cada imagen se abre una vez sin
+    importar cuántos formatos se pidan.
+    """
+    frames = []
+    for frame in sorted(labels):
+        path = os.path.join(job_dir, os.path.basename(frame))
+        if not os.path.exists(path):
+            logger.warning(f"Skipping missing frame {frame}")
+            continue
+        width, height = _image_size(path)
+        frames.append((os.path.basename(frame), path, width, height, labels[frame]))
+    return frames
+
+
+def export_coco(frames: List[tuple], output_dir: str, progress: Optional[Callable] = None) -> str:
+    classes = _classes(frames)
+    category_ids = {name: i + 1 for i, name in enumerate(classes)}
+    coco = {
+        "images": [],
+        "annotations": [],
+        "categories": [{"id": category_ids[name], "name": name} for name in classes],
+    }
+    for image_id, (frame, _, width, height, boxes) in enumerate(frames, start=1):
+        coco["images"].append({"id": image_id, "file_name": frame, "width": width, "height": height})
+        for box in boxes:
+            x, y, w, h = _to_pixels(box, width, height)
+            coco["annotations"].append({
+                "id": len(coco["annotations"]) + 1,
+                "image_id": image_id,
+                "category_id": category_ids[box.get("label") or "object"],
+                "bbox": [round(x, 2), round(y, 2), round(w, 2), round(h, 2)],
+                "area": round(w * h, 2),
+                "iscrowd": 0,
+            })
+        if progress:
+            progress()
+
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, "annotations.json")
+    with open(path, "w") as f:
+        json.dump(coco, f)
+    return path
+
+
+def export_yolo(frames: List[tuple], output_dir: str, progress: Optional[Callable] = None) -> str:
+    """labels/<frame>.txt con "clase cx cy w h" normalizados 0-1; las imágenes se enlazan (o copian)."""
+    classes = _classes(frames)
+    class_ids = {name: i for i, name in enumerate(classes)}
+    images_dir = os.path.join(output_dir, "images")
+    labels_dir = os.path.join(output_dir, "labels")
+    os.makedirs(images_dir, exist_ok=True)
+    os.makedirs(labels_dir, exist_ok=True)
+
+    for frame, path, _, _, boxes in frames:
+        stem = os.path.splitext(frame)[0]
+        lines = []
+        for box in boxes:
+            cx = (box["x"] + box["w"] / 2) / 1000
+            cy = (box["y"] + box["h"] / 2) / 1000
+            lines.append(f"{class_ids[box.get('label') or 'object']} {cx:.6f} {cy:.6f} {box['w'] / 1000:.6f} {box['h'] / 1000:.6f}")
+        with open(os.path.join(labels_dir, f"{stem}.txt"), "w") as f:
+            f.write("\n".join(lines))
+        target = os.path.join(images_dir, frame)
+        if not os.path.exists(target):
+            try:
+                os.link(path, target)
+            except OSError:
+                with open(path, "rb") as src, open(target, "wb") as dst:
+                    dst.write(src.read())
+        if progress:
+            progress()
+
+    with open(os.path.join(output_dir, "data.yaml"), "w") as f:
+        f.write(f"path: {os.path.abspath(output_dir)}\ntrain: images\nval: images\nnames:\n")
+        f.writelines(f"  {i}: {name}\n" for i, name in enumerate(classes))
+    return output_dir
+
+
+def export_shards(frames: List[tuple], output_dir: str, progress: Optional[Callable] = None,
+                  shard_size: Optional[int] = None) -> str:
+    """
+    Shards tar estilo WebDataset: cada muestra es <stem>.jpg + <stem>.json juntos,
+    para lecturas secuenciales rápidas desde los loaders de entrenamiento.
+    """
+    shard_size = shard_size or Config.EXPORT_SHARD_SIZE
+    os.makedirs(output_dir, exist_ok=True)
+    shards = []
+    tar = None
+
+    def close_shard():
+        if tar is not None:
+            tar.close()
+            os.replace(shards[-1]["path"] + ".tmp", shards[-1]["path"])
+
+    for i, (frame, path, width, height, boxes) in enumerate(frames):
+        if i % shard_size == 0:
+            close_shard()
+            shard_path = os.path.join(output_dir, f"shard-{len(shards):05d}.tar")
+            shards.append({"path": shard_path, "samples": 0})
+            tar = tarfile.open(shard_path + ".tmp", "w")
+        stem = os.path.splitext(frame)[0]
+        tar.add(path, arcname=f"{stem}.jpg")
+        annotation = json.dumps({"frame": frame, "width": width, "height": height, "boxes": boxes}).encode("utf-8")
+        info = tarfile.TarInfo(f"{stem}.json")
+        info.size = len(annotation)
+        info.mtime = int(time.time())
+        tar.addfile(info, io.BytesIO(annotation))
+        shards[-1]["samples"] += 1
+        if progress:
+            progress()
+    close_shard()
+
+    with open(os.path.join(output_dir, "index.json"), "w") as f:
+        json.dump({
+            "classes": _classes(frames),
+            "shards": [{"file": os.path.basename(s["path"]), "samples": s["samples"]} for s in shards],
+        }, f)
+    return output_dir
+
+
+EXPORTERS = {"coco": export_coco, "yolo": export_yolo, "shards": export_shards}
+
+
+def export_dataset(job_dir: str, labels: Dict[str, list], output_dir: str, formats: List[str],
+                   progress: Optional[Callable[[int, int, str], None]] = None) -> Dict[str, str]:
+    """Exporta en cada formato pedido (a output_dir/<formato>). Retorna {formato: ruta}."""
+    unknown = set(formats) - set(EXPORTERS)
+    if unknown:
+        raise ValueError(f"Unknown export formats: {sorted(unknown)}")
+    frames = resolve_frames(job_dir, labels)
+    total = len(frames) * len(formats)
+    state = {"done": 0}
+    outputs = {}
+    for fmt in formats:
+        def step(fmt=fmt):
+            state["done"] += 1
+            if progress:
+                progress(state["done"], total, f"Exporting {fmt}")
+        outputs[fmt] = EXPORTERS[fmt](frames, os.path.join(output_dir, fmt), progress=step)
+    return outputs
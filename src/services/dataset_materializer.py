@@ -0,0 +1,187 @@
+import io
+import os
+import json
+import logging
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Callable, Iterable, Optional
+
+from PIL import Image
+
+from src.analysis.processing import append_ndjson, iter_ndjson
+
+logger = logging.getLogger(__name__)
+
+ANNOTATIONS_DIR = "annotations"
+RAW_ANNOTATIONS = "raw_annotations.json"
+MANIFEST = "manifest.json"
+
+
+def _shard_path(annotations_dir: str, shard: int) -> str:
+    return os.path.join(annotations_dir, f"shard-{shard:05d}.ndjson")
+
+
+def encode_image(image, image_path: str, quality: int = 95):
+    """
+    Corre en un proceso del pool: decodifica la imagen (bytes/ruta de un
+    `datasets.Image(decode=False)`, una ruta o una imagen PIL), la pasa a RGB
+    y la guarda como JPEG. Retorna (ancho, alto) o None si no se pudo leer.
+    """
+    try:
+        if isinstance(image, dict):
+            source = io.BytesIO(image["bytes"]) if image.get("bytes") else image.get("path")
+            image = Image.open(source)
+        elif isinstance(image, str):
+            image = Image.open(image)
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        image.save(image_path, quality=quality)
+        return image.width, image.height
+    except Exception as e:
+        logger.warning(f"Could not encode {image_path}: {e}")
+        return None
+
+
+def completed_shards(annotations_dir: str) -> int:
+    """Shards terminados consecutivos desde el 0 (los shards se escriben de forma atómica)."""
+    count = 0
+    while os.path.exists(_shard_path(annotations_dir, count)):
+        count += 1
+    return count
+
+
+class DatasetMaterializer:
+    """
+    Vuelca un dataset (cualquier iterable de dicts, p. ej. un dataset de HF en
+    streaming) a <dataset_path>/images/*.jpg + anotaciones en shards NDJSON.
+    Las imágenes se codifican en un pool de procesos; cada shard de anotaciones se
+    escribe recién cuando todas sus imágenes están en disco, así un corte solo
+    pierde el shard en curso y `run` retoma desde el último shard completo.
+    Al terminar arma raw_annotations.json (el formato que leen unify/benchmark).
+    annotations/manifest.json guarda fuente, prefijo y tamaño de shard: retomar
+    con otros valores saltaría o duplicaría muestras, así que se rechaza.
+    """
+
+    def __init__(self, dataset_path: str, prefix: str, shard_size: int = 1000, workers: Optional[int] = None,
+                 image_key: str = "image", quality: int = 95, source: Optional[str] = None):
+        self.dataset_path = dataset_path
+        self.source = source
+        self.prefix = prefix
+        self.shard_size = shard_size
+        self.workers = workers or os.cpu_count() or 1
+        self.image_key = image_key
+        self.quality = quality
+        self.images_dir = os.path.join(dataset_path, "images")
+        self.annotations_dir = os.path.join(dataset_path, ANNOTATIONS_DIR)
+
+    def run(self, samples: Iterable[dict], progress: Optional[Callable[[int], None]] = None) -> dict:
+        os.makedirs(self.images_dir, exist_ok=True)
+        os.makedirs(self.annotations_dir, exist_ok=True)
+
+        done_shards = completed_shards(self.annotations_dir)
+        self._check_manifest(done_shards)
+        skip = done_shards * self.shard_size
+        if skip:
+            logger.info(f"Resuming after {done_shards} completed shard(s) ({skip} samples)")
+            # Los datasets de HF saltan sin decodificar; cualquier otro iterable se consume
+            samples = samples.skip(skip) if hasattr(samples, "skip") else islice(samples, skip, None)
+        if progress:
+            progress(skip)
+
+        stats = {"resumed_from": skip, "written": 0, "skipped": 0, "shards": done_shards}
+        iterator = iter(samples)
+        pending = deque()
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            shard = done_shards
+            try:
+                while True:
+                    chunk = list(islice(iterator, self.shard_size))
+                    if not chunk:
+                        break
+                    pending.append((shard, self._submit(pool, chunk, shard * self.shard_size)))
+                    shard += 1
+                    # Mientras el pool codifica un shard, el hilo principal ya lee el siguiente
+                    if len(pending) > 1:
+                        self._finish_shard(*pending.popleft(), stats, progress)
+            finally:
+                # También si la fuente falla a mitad: los shards ya enviados al pool se guardan
+                while pending:
+                    self._finish_shard(*pending.popleft(), stats, progress)
+
+        stats["total_annotations"] = self._write_raw_annotations()
+        return stats
+
+    def _check_manifest(self, done_shards: int):
+        manifest = {"source": self.source, "prefix": self.prefix, "shard_size": self.shard_size}
+        path = os.path.join(self.annotations_dir, MANIFEST)
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                previous = json.load(f)
+            if previous != manifest:
+                raise ValueError(
+                    f"{self.annotations_dir} was written with {previous}, not {manifest}; "
+                    "use the same settings or a fresh output directory"
+                )
+            return
+        if done_shards:
+            raise ValueError(f"{self.annotations_dir} has shards but no {MANIFEST}; cannot tell how to resume")
+        with open(path + ".tmp", "w") as f:
+            json.dump(manifest, f)
+        os.replace(path + ".tmp", path)
+
+    def _submit(self, pool, chunk: list, start: int) -> list:
+        entries = []
+        for offset, item in enumerate(chunk):
+            image = item.get(self.image_key)
+            if not image:
+                entries.append(None)
+                continue
+            file_name = f"{self.prefix}_{start + offset:05d}.jpg"
+            meta = {k: v for k, v in item.items() if k != self.image_key}
+            meta["file_name"] = file_name
+            future = pool.submit(encode_image, image, os.path.join(self.images_dir, file_name), self.quality)
+            entries.append((meta, future))
+        return entries
+
+    def _finish_shard(self, shard: int, entries: list, stats: dict, progress: Optional[Callable[[int], None]]):
+        records = []
+        for entry in entries:
+            if entry is None:
+                stats["skipped"] += 1
+                continue
+            meta, future = entry
+            size = future.result()
+            if size is None:
+                stats["skipped"] += 1
+                continue
+            meta["width"], meta["height"] = size
+            records.append(meta)
+
+        path = _shard_path(self.annotations_dir, shard)
+        tmp_path = path + ".tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        append_ndjson(tmp_path, records)
+        os.replace(tmp_path, path)
+
+        stats["written"] += len(records)
+        stats["shards"] = shard + 1
+        if progress:
+            progress(len(entries))
+
+    def _write_raw_annotations(self) -> int:
+        """Concatena los shards en un solo arreglo JSON sin cargarlos en memoria."""
+        path = os.path.join(self.dataset_path, RAW_ANNOTATIONS)
+        tmp_path = path + ".tmp"
+        count = 0
+        with open(tmp_path, "w") as f:
+            f.write("[")
+            for shard in range(completed_shards(self.annotations_dir)):
+                for record in iter_ndjson(_shard_path(self.annotations_dir, shard)):
+                    f.write(",\n" if count else "\n")
+                    f.write(json.dumps(record))
+                    count += 1
+            f.write("\n]\n")
+        os.replace(tmp_path, path)
+        return count
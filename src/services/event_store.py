@@ -0,0 +1,217 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+from contextlib import contextmanager
+from typing import Iterable, Optional
+
+from src.analysis.processing import parse_timestamp
+from src.config import Config
+
+logger = logging.getLogger(__name__)
+
+# Columnas que se pueden filtrar/agrupar (nombre público -> columna)
+FACET_FIELDS = {
+    "video": "video",
+    "skill_key": "skill_key",
+    "skill_type": "skill_type",
+    "movement_type": "movement_type",
+    "tactical_intent": "tactical_intent",
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS analyses (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    video TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    duration REAL,
+    detail TEXT,
+    total_events INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    analysis_id INTEGER NOT NULL REFERENCES analyses(id) ON DELETE CASCADE,
+    video TEXT NOT NULL,
+    t REAL NOT NULL,
+    timestamp TEXT,
+    action TEXT,
+    skill_key TEXT,
+    skill_name TEXT,
+    skill_type TEXT,
+    movement_type TEXT,
+    tactical_intent TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_analyses_video ON analyses(video);
+CREATE INDEX IF NOT EXISTS idx_events_video_t ON events(video, t);
+CREATE INDEX IF NOT EXISTS idx_events_t ON events(t);
+CREATE INDEX IF NOT EXISTS idx_events_skill_key ON events(skill_key, t);
+CREATE INDEX IF NOT EXISTS idx_events_movement_type ON events(movement_type, t);
+CREATE INDEX IF NOT EXISTS idx_events_tactical_intent ON events(tactical_intent, t);
+"""
+
+
+class EventStore:
+    """
+    Almacén local (SQLite) de eventos de análisis, para consultar muchos videos
+    sin cargar cada reporte: índices por video, tiempo, skill, movimiento e
+    intención táctica y búsqueda full-text (FTS5) sobre `action`.
+    Re-ingestar un video reemplaza su análisis anterior.
+    """
+
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = db_path or Config.EVENT_STORE_PATH
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            try:
+                conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS events_fts USING fts5(action)")
+                self.has_fts = True
+            except sqlite3.OperationalError:
+                logger.warning("SQLite FTS5 not available, falling back to LIKE search")
+                self.has_fts = False
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA foreign_keys=ON")
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    # --- Ingest ---
+
+    def ingest_events(self, video: str, events: Iterable[dict], duration: Optional[float] = None, detail: Optional[str] = None) -> int:
+        """Guarda los eventos de un análisis. `events` puede ser un iterador (p. ej. un NDJSON)."""
+        with self._connect() as conn:
+            self._delete_video(conn, video)
+            cur = conn.execute(
+                "INSERT INTO analyses (video, created_at, duration, detail) VALUES (?, ?, ?, ?)",
+                (video, time.time(), duration, detail)
+            )
+            analysis_id = cur.lastrowid
+            count = 0
+            for event in events:
+                skill = event.get("skill_used") or {}
+                if not isinstance(skill, dict):
+                    skill = {}
+                action = event.get("action", "")
+                cur = conn.execute(
+                    """INSERT INTO events (analysis_id, video, t, timestamp, action, skill_key, skill_name,
+                       skill_type, movement_type, tactical_intent, data)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                    (
+                        analysis_id, video, parse_timestamp(event.get("timestamp", "00:00")), event.get("timestamp"),
+                        action, skill.get("key"), skill.get("name"), skill.get("type"),
+                        event.get("movement_type"), event.get("tactical_intent"), json.dumps(event)
+                    )
+                )
+                if self.has_fts:
+                    conn.execute("INSERT INTO events_fts (rowid, action) VALUES (?, ?)", (cur.lastrowid, action))
+                count += 1
+            conn.execute("UPDATE analyses SET total_events = ? WHERE id = ?", (count, analysis_id))
+        logger.info(f"Indexed {count} events for {video}")
+        return analysis_id
+
+    def ingest_report(self, video: str, report: dict, detail: Optional[str] = None) -> int:
+        """Ingesta la salida de merge_results / TimelineMerger.finalize()."""
+        events = (event for segment in report.get("segments", []) for event in segment.get("events", []))
+        duration = None
+        segments = report.get("segments") or []
+        if segments:
+            duration = parse_timestamp(segments[-1].get("end", "00:00"))
+        return self.ingest_events(video, events, duration=duration, detail=detail)
+
+    def ingest_report_file(self, video: str, report_path: str, detail: Optional[str] = None) -> int:
+        with open(report_path, "r") as f:
+            return self.ingest_report(video, json.load(f), detail=detail)
+
+    def _delete_video(self, conn, video: str):
+        if self.has_fts:
+            conn.execute("DELETE FROM events_fts WHERE rowid IN (SELECT id FROM events WHERE video = ?)", (video,))
+        conn.execute("DELETE FROM analyses WHERE video = ?", (video,))
+
+    def delete_video(self, video: str):
+        with self._connect() as conn:
+            self._delete_video(conn, video)
+
+    # --- Queries ---
+
+    def _where(self, video=None, start=None, end=None, text=None, **facets):
+        clauses, params = [], []
+        if video:
+            clauses.append("e.video = ?")
+            params.append(video)
+        if start is not None:
+            clauses.append("e.t >= ?")
+            params.append(start)
+        if end is not None:
+            clauses.append("e.t <= ?")
+            params.append(end)
+        for field, value in facets.items():
+            if value is not None:
+                clauses.append(f"e.{FACET_FIELDS[field]} = ?")
+                params.append(value)
+        if text:
+            if self.has_fts:
+                clauses.append("e.id IN (SELECT rowid FROM events_fts WHERE events_fts MATCH ?)")
+                # Cada palabra como término literal (evita errores de sintaxis FTS)
+                text = " ".join('"' + token.replace('"', '""') + '"' for token in text.split())
+            else:
+                clauses.append("e.action LIKE ?")
+                text = f"%{text}%"
+            params.append(text)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        return where, params
+
+    def query_events(self, limit: int = 50, offset: int = 0, **filters) -> dict:
+        """Eventos ordenados por video y tiempo, paginados."""
+        where, params = self._where(**filters)
+        with self._connect() as conn:
+            total = conn.execute(f"SELECT COUNT(*) FROM events e {where}", params).fetchone()[0]
+            rows = conn.execute(
+                f"SELECT e.id, e.video, e.t, e.data FROM events e {where} ORDER BY e.video, e.t, e.id LIMIT ? OFFSET ?",
+                params + [limit, offset]
+            ).fetchall()
+        items = [{"id": r["id"], "video": r["video"], "time": r["t"], **json.loads(r["data"])} for r in rows]
+        return {"total": total, "limit": limit, "offset": offset, "items": items}
+
+    def facet_counts(self, field: str, limit: int = 50, **filters) -> list:
+        """Conteo de eventos por valor de `field` dentro de los filtros dados."""
+        if field not in FACET_FIELDS:
+            raise ValueError(f"Unknown facet field: {field}")
+        column = FACET_FIELDS[field]
+        where, params = self._where(**filters)
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT e.{column} AS value, COUNT(*) AS count FROM events e {where} "
+                f"GROUP BY e.{column} ORDER BY count DESC LIMIT ?",
+                params + [limit]
+            ).fetchall()
+        return [{"value": r["value"], "count": r["count"]} for r in rows]
+
+    def list_videos(self, limit: int = 50, offset: int = 0) -> dict:
+        with self._connect() as conn:
+            total = conn.execute("SELECT COUNT(*) FROM analyses").fetchone()[0]
+            rows = conn.execute(
+                "SELECT * FROM analyses ORDER BY created_at DESC LIMIT ? OFFSET ?", (limit, offset)
+            ).fetchall()
+        return {"total": total, "limit": limit, "offset": offset, "items": [dict(r) for r in rows]}
+
+
+_event_store = None
+
+
+def get_event_store() -> EventStore:
+    global _event_store
+    if _event_store is None:
+        _event_store = EventStore()
+    return _event_store
@@ -0,0 +1,163 @@
+import os
+import threading
+import logging
+from collections import OrderedDict
+from typing import Optional
+import cv2
+
+from src.utils.video_index import get_video_index, seek_frame
+
+logger = logging.getLogger(__name__)
+
+
+class _DecoderHandle:
+    """VideoCapture abierto junto con la posición del próximo frame a leer."""
+
+    def __init__(self, video_path: str):
+        self.cap = cv2.VideoCapture(video_path)
+        if not self.cap.isOpened():
+            raise ValueError(f"Could not open video: {video_path}")
+        self.position = 0
+
+    def release(self):
+        self.cap.release()
+
+
+class FrameServer:
+    """
+    Sirve frames JPEG desde memoria.
+    - Mantiene un pool de decoders abiertos por video (evita reabrir el archivo).
+    - Cachea los frames codificados en un LRU por (video, frame, ancho).
+    """
+
+    def __init__(self, max_handles_per_video: int = 2, cache_max_bytes: int = 64 * 1024 * 1024, jpeg_quality: int = 85):
+        self.max_handles_per_video = max_handles_per_video
+        self.cache_max_bytes = cache_max_bytes
+        self.jpeg_quality = jpeg_quality
+
+        self._pools = {}  # path -> (stamp, [handles libres])
+        self._pool_lock = threading.Lock()
+
+        self._cache = OrderedDict()  # (path, mtime, frame_no, width) -> bytes
+        self._cache_bytes = 0
+        self._cache_lock = threading.Lock()
+
+    # --- Decoder pool ---
+
+    def _acquire(self, video_path: str, stamp: float, frame_no: int) -> _DecoderHandle:
+        with self._pool_lock:
+            entry = self._pools.get(video_path)
+            if entry is not None and entry[0] != stamp:
+                # El archivo cambió: descartar los handles viejos
+                for handle in entry[1]:
+                    handle.release()
+                entry = None
+            if entry is None:
+                entry = (stamp, [])
+                self._pools[video_path] = entry
+            idle = entry[1]
+            if idle:
+                # Preferir el handle que está justo antes del frame pedido (scrubbing hacia adelante)
+                best = min(idle, key=lambda h: frame_no - h.position if h.position <= frame_no else float("inf"))
+                idle.remove(best)
+                return best
+        return _DecoderHandle(video_path)
+
+    def _release(self, video_path: str, stamp: float, handle: _DecoderHandle):
+        with self._pool_lock:
+            entry = self._pools.get(video_path)
+            if entry is not None and entry[0] == stamp and len(entry[1]) < self.max_handles_per_video:
+                entry[1].append(handle)
+                return
+        handle.release()
+
+    def close(self, video_path: Optional[str] = None):
+        """Libera los decoders de un video (o de todos)."""
+        with self._pool_lock:
+            paths = [video_path] if video_path else list(self._pools.keys())
+            for path in paths:
+                entry = self._pools.pop(path, None)
+                if entry:
+                    for handle in entry[1]:
+                        handle.release()
+
+    # --- LRU cache ---
+
+    def _cache_get(self, key):
+        with self._cache_lock:
+            data = self._cache.get(key)
+            if data is not None:
+                self._cache.move_to_end(key)
+            return data
+
+    def _cache_put(self, key, data: bytes):
+        with self._cache_lock:
+            if key in self._cache:
+                return
+            self._cache[key] = data
+            self._cache_bytes += len(data)
+            while self._cache_bytes > self.cache_max_bytes and self._cache:
+                _, evicted = self._cache.popitem(last=False)
+                self._cache_bytes -= len(evicted)
+
+    # --- Public API ---
+
+    def resolve(self, video_path: str, timestamp: float, width: Optional[int] = None):
+        """
+        Resuelve (frame_no, width efectivo, etag) sin decodificar nada.
+        """
+        index = get_video_index(video_path)
+        frame_no = index.frame_at(timestamp)
+        if width is not None and (width <= 0 or width >= index.width):
+            width = None
+        stamp = os.path.getmtime(video_path)
+        etag = f'"{int(stamp)}-{frame_no}-{width or 0}"'
+        return frame_no, width, etag
+
+    def get_frame(self, video_path: str, timestamp: float, width: Optional[int] = None):
+        """
+        Devuelve (jpeg_bytes, frame_no) para el frame en `timestamp`.
+        Si se indica `width`, el frame se reescala manteniendo el aspecto.
+        """
+        index = get_video_index(video_path)
+        frame_no, width, _ = self.resolve(video_path, timestamp, width)
+
+        stamp = os.path.getmtime(video_path)
+        key = (os.path.abspath(video_path), stamp, frame_no, width)
+        cached = self._cache_get(key)
+        if cached is not None:
+            return cached, frame_no
+
+        handle = self._acquire(video_path, stamp, frame_no)
+        try:
+            handle.position = seek_frame(handle.cap, index, frame_no, handle.position)
+            ret, frame = handle.cap.read()
+            if not ret:
+                raise ValueError(f"Could not read frame {frame_no}")
+            handle.position += 1
+        except Exception:
+            handle.release()
+            raise
+        self._release(video_path, stamp, handle)
+
+        if width is not None:
+            height = max(1, round(frame.shape[0] * width / frame.shape[1]))
+            frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+
+        ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+        if not ret:
+            raise ValueError("Could not encode frame")
+
+        data = buffer.tobytes()
+        self._cache_put(key, data)
+        return data, frame_no
+
+
+_frame_server = None
+
+
+def get_frame_server() -> FrameServer:
+    global _frame_server
+    if _frame_server is None:
+        _frame_server = FrameServer()
+    return _frame_server
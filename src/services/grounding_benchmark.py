@@ -0,0 +1,349 @@
+import os
+import json
+import math
+import time
+import random
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from src.utils.geometry import bbox_center, bbox_iou, bbox_to_pixels, point_in_bbox, point_to_pixels
+
+logger = logging.getLogger(__name__)
+
+REPORT_VERSION = 1
+
+# Claves que usan los datasets descargados por scripts/dataset_tools
+INSTRUCTION_KEYS = ("instruction", "prompt", "query", "task", "text", "label")
+BBOX_KEYS = ("bbox", "box", "bounding_box")
+POINT_KEYS = ("point", "click", "coordinate")
+NESTED_KEYS = ("elements", "annotations", "objects", "detections")
+
+# Tolerancia para acertar un punto cuando la predicción no trae bbox (fracción de la diagonal)
+POINT_TOLERANCE = 0.02
+
+# Convenciones del ground truth; se fijan una vez por dataset (flag, schema.json o inferencia global)
+BOX_FORMATS = ("xyxy", "xywh")
+COORD_SCALES = ("pixels", "fraction")
+SCHEMA_FILE = "schema.json"
+
+
+def _gt_to_pixels(coords, width, height, coord_scale: str):
+    """Ground truth en fracciones 0-1 o en píxeles absolutos, según el dataset."""
+    if coord_scale == "fraction":
+        return [c * (width if i % 2 == 0 else height) for i, c in enumerate(coords)]
+    return [float(c) for c in coords]
+
+
+def _first(item: dict, keys):
+    for key in keys:
+        value = item.get(key)
+        if value not in (None, "", []):
+            return value
+    return None
+
+
+def _is_coords(value, size) -> bool:
+    return isinstance(value, (list, tuple)) and len(value) == size and all(isinstance(c, (int, float)) for c in value)
+
+
+def _expand_nested(nested) -> list:
+    """Lista de elementos o, estilo HF, un dict de columnas ({"bbox": [...], "label": [...]})."""
+    if isinstance(nested, list):
+        return nested
+    if isinstance(nested, dict) and all(isinstance(v, list) for v in nested.values()):
+        length = min((len(v) for v in nested.values()), default=0)
+        return [{k: v[i] for k, v in nested.items()} for i in range(length)]
+    return []
+
+
+def _raw_coords(item: dict):
+    bbox = _first(item, BBOX_KEYS)
+    point = _first(item, POINT_KEYS)
+    return (bbox if _is_coords(bbox, 4) else None), (point if _is_coords(point, 2) else None)
+
+
+def _normalize_sample(item: dict, image_path: str, width: int, height: int, sample_id: str, schema: dict) -> Optional[dict]:
+    instruction = _first(item, INSTRUCTION_KEYS)
+    if isinstance(instruction, list):
+        instruction = instruction[0] if instruction else None
+    if not instruction:
+        return None
+
+    bbox, point = _raw_coords(item)
+    if bbox is not None:
+        bbox = _gt_to_pixels(bbox, width, height, schema["coord_scale"])
+        if schema["box_format"] == "xywh":
+            bbox = [bbox[0], bbox[1], bbox[0] + bbox[2], bbox[1] + bbox[3]]
+    if point is not None:
+        point = _gt_to_pixels(point, width, height, schema["coord_scale"])
+    if bbox is None and point is None:
+        return None
+
+    return {
+        "id": sample_id,
+        "image_path": image_path,
+        "instruction": str(instruction),
+        "bbox": bbox,
+        "point": point,
+        "width": width,
+        "height": height,
+    }
+
+
+def infer_schema(items: List[dict]) -> dict:
+    """
+    Convenciones deducidas mirando todo el dataset (no cada muestra): fracciones
+    solo si ninguna coordenada supera 1, xywh si alguna caja no puede ser xyxy.
+    """
+    boxes, coords = [], []
+    for item in items:
+        bbox, point = _raw_coords(item)
+        if bbox is not None:
+            boxes.append(bbox)
+            coords.extend(bbox)
+        if point is not None:
+            coords.extend(point)
+    coord_scale = "fraction" if coords and all(0 <= c <= 1 for c in coords) else "pixels"
+    box_format = "xywh" if any(b[2] < b[0] or b[3] < b[1] for b in boxes) else "xyxy"
+    return {"box_format": box_format, "coord_scale": coord_scale}
+
+
+def _iter_elements(raw: list):
+    """(registro, elemento fusionado, id) de cada muestra; los elementos anidados heredan el registro."""
+    for i, item in enumerate(raw):
+        elements = _expand_nested(_first(item, NESTED_KEYS)) or [item]
+        for j, element in enumerate(elements):
+            if not isinstance(element, dict):
+                continue
+            sample_id = f"{i:05d}" if len(elements) == 1 else f"{i:05d}_{j:02d}"
+            # La instrucción puede estar a nivel de registro y las cajas en cada elemento
+            merged = {k: v for k, v in item.items() if k not in NESTED_KEYS}
+            merged.update(element)
+            yield item, merged, sample_id
+
+
+def load_dataset(dataset_dir: str, box_format: Optional[str] = None, coord_scale: Optional[str] = None):
+    """
+    Carga un directorio con raw_annotations.json + images/ (formato de
+    download_datasets.py). Un registro puede traer varios elementos anidados
+    (elements/annotations/...), cada uno se vuelve una muestra.
+    El formato de caja y la escala salen de los argumentos, si no de
+    <dataset>/schema.json, y si no se infieren una vez para todo el dataset.
+    Retorna (muestras, schema usado).
+    """
+    with open(os.path.join(dataset_dir, "raw_annotations.json"), "r") as f:
+        raw = json.load(f)
+
+    schema = {}
+    schema_path = os.path.join(dataset_dir, SCHEMA_FILE)
+    if os.path.exists(schema_path):
+        with open(schema_path, "r") as f:
+            schema = {k: v for k, v in json.load(f).items() if k in ("box_format", "coord_scale")}
+    if box_format:
+        schema["box_format"] = box_format
+    if coord_scale:
+        schema["coord_scale"] = coord_scale
+    if len(schema) < 2:
+        inferred = infer_schema([merged for _, merged, _ in _iter_elements(raw)])
+        logger.info(f"Inferred ground truth convention for the whole dataset: {inferred}")
+        schema = {**inferred, **schema}
+    if schema["box_format"] not in BOX_FORMATS or schema["coord_scale"] not in COORD_SCALES:
+        raise ValueError(f"Unsupported dataset schema: {schema}")
+
+    samples = []
+    sizes = {}
+    for item, merged, sample_id in _iter_elements(raw):
+        image_path = os.path.join(dataset_dir, "images", item["file_name"])
+        if image_path not in sizes:
+            width, height = item.get("width"), item.get("height")
+            if not width or not height:
+                from PIL import Image
+                with Image.open(image_path) as image:
+                    width, height = image.size
+            sizes[image_path] = (width, height)
+        width, height = sizes[image_path]
+        sample = _normalize_sample(merged, image_path, width, height, sample_id, schema)
+        if sample:
+            samples.append(sample)
+    return samples, schema
+
+
+def load_dataset_dir(dataset_dir: str, box_format: Optional[str] = None, coord_scale: Optional[str] = None) -> List[dict]:
+    return load_dataset(dataset_dir, box_format, coord_scale)[0]
+
+
+def select_samples(samples: List[dict], limit: Optional[int] = None, seed: Optional[int] = None) -> List[dict]:
+    """Primeras `limit` muestras, o una muestra aleatoria reproducible si hay `seed`."""
+    if seed is not None:
+        samples = random.Random(seed).sample(samples, len(samples))
+    return samples[:limit] if limit else samples
+
+
+class PipelinePredictor:
+    """Predicciones reales con GroundingPipeline (carga el modelo local)."""
+
+    def __init__(self, model: str = "qwen", prompt_template: Optional[str] = None, allowed_actions=None,
+                 coarse_to_fine: bool = False, tiled: bool = False):
+        from src.services.grounding_pipeline import GroundingPipeline
+        self.pipeline = GroundingPipeline()
+        self.model = model
+        self.prompt_template = prompt_template
+        self.allowed_actions = allowed_actions or []
+        self.coarse_to_fine = coarse_to_fine
+        self.tiled = tiled
+
+    def __call__(self, sample: dict) -> List[dict]:
+        config = {
+            "name": sample["id"],
+            "model": self.model,
+            "prompt": sample["instruction"],
+            "image_path": sample["image_path"],
+            "prompt_template": self.prompt_template,
+            "allowed_actions": self.allowed_actions,
+            "coarse_to_fine": self.coarse_to_fine,
+            "tiled": self.tiled,
+        }
+        return self.pipeline.ground(config)["actions"]
+
+
+class StubPredictor:
+    """
+    Motor simulado para probar el harness sin GPU: responde la caja correcta
+    (en escala 0-1000, como los modelos) con ruido y latencia configurables.
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, miss_rate: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.miss_rate = miss_rate
+        self._random = random.Random(seed)
+
+    def __call__(self, sample: dict) -> List[dict]:
+        if self.latency:
+            time.sleep(self.latency)
+        if self._random.random() < self.miss_rate:
+            return []
+        w, h = sample["width"], sample["height"]
+        box = sample["bbox"] or [sample["point"][0] - 5, sample["point"][1] - 5, sample["point"][0] + 5, sample["point"][1] + 5]
+        noise = lambda: self._random.uniform(-self.jitter, self.jitter)
+        normalized = [
+            min(1000, max(0, round((box[0] / w + noise()) * 1000))),
+            min(1000, max(0, round((box[1] / h + noise()) * 1000))),
+            min(1000, max(0, round((box[2] / w + noise()) * 1000))),
+            min(1000, max(0, round((box[3] / h + noise()) * 1000))),
+        ]
+        return [{"action": "click", "bbox": normalized}]
+
+
+def score_prediction(sample: dict, actions: List[dict]) -> dict:
+    """Hit de click e IoU de la primera acción con bbox o coordenada."""
+    width, height = sample["width"], sample["height"]
+    pred_box, pred_point = None, None
+    for action in actions:
+        box = action.get("bbox") or action.get("start_bbox")
+        if isinstance(box, list) and len(box) == 4:
+            pred_box = bbox_to_pixels(box, width, height)
+            pred_point = bbox_center(pred_box)
+            break
+        coord = action.get("coordinate")
+        if isinstance(coord, list) and len(coord) == 2:
+            pred_point = point_to_pixels(coord, width, height)
+            break
+
+    result = {"predicted": pred_point is not None, "hit": False, "iou": None}
+    if pred_point is None:
+        return result
+
+    if sample["bbox"]:
+        result["hit"] = point_in_bbox(pred_point, sample["bbox"])
+        if pred_box:
+            result["iou"] = round(bbox_iou(pred_box, sample["bbox"]), 4)
+    else:
+        gt = sample["point"]
+        tolerance = POINT_TOLERANCE * math.hypot(width, height)
+        near = math.hypot(pred_point[0] - gt[0], pred_point[1] - gt[1]) <= tolerance
+        result["hit"] = near or bool(pred_box and point_in_bbox(gt, pred_box))
+    return result
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Percentil por rango más cercano."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def run_benchmark(samples: List[dict], predictor: Callable[[dict], List[dict]], parallelism: int = 1,
+                  metadata: Optional[dict] = None) -> dict:
+    """Ejecuta el predictor sobre las muestras y arma el reporte."""
+
+    def run_one(sample):
+        start = time.perf_counter()
+        try:
+            actions = predictor(sample)
+            error = None
+        except Exception as e:
+            logger.warning(f"Sample {sample['id']} failed: {e}")
+            actions, error = [], str(e)
+        latency = time.perf_counter() - start
+        result = {"id": sample["id"], "latency": round(latency, 4), "error": error}
+        result.update(score_prediction(sample, actions))
+        return result
+
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, parallelism)) as pool:
+        results = list(pool.map(run_one, samples))
+    wall_time = time.perf_counter() - wall_start
+
+    latencies = [r["latency"] for r in results if r["error"] is None]
+    ious = [r["iou"] for r in results if r["iou"] is not None]
+    n = len(results)
+    report = {
+        "version": REPORT_VERSION,
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        **(metadata or {}),
+        "samples": n,
+        "parallelism": parallelism,
+        "metrics": {
+            "hit_rate": round(sum(r["hit"] for r in results) / n, 4) if n else None,
+            "mean_iou": round(sum(ious) / len(ious), 4) if ious else None,
+            "iou_at_0_5": round(sum(i >= 0.5 for i in ious) / len(ious), 4) if ious else None,
+            "no_prediction": sum(not r["predicted"] for r in results),
+            "errors": sum(r["error"] is not None for r in results),
+        },
+        "latency": {
+            "mean": round(sum(latencies) / len(latencies), 4) if latencies else None,
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+        },
+        "throughput": round(n / wall_time, 4) if wall_time > 0 else None,
+        "wall_time": round(wall_time, 4),
+        "results": results,
+    }
+    return report
+
+
+def compare_reports(baseline: dict, current: dict) -> Dict[str, dict]:
+    """Diferencias de métricas, latencia y throughput entre dos reportes."""
+    diff = {}
+    sections = [("metrics", baseline.get("metrics", {}), current.get("metrics", {})),
+                ("latency", baseline.get("latency", {}), current.get("latency", {})),
+                ("", {"throughput": baseline.get("throughput")}, {"throughput": current.get("throughput")})]
+    for section, old, new in sections:
+        for key in sorted(set(old) | set(new)):
+            a, b = old.get(key), new.get(key)
+            name = f"{section}.{key}" if section else key
+            delta = round(b - a, 4) if isinstance(a, (int, float)) and isinstance(b, (int, float)) else None
+            diff[name] = {"baseline": a, "current": b, "delta": delta}
+    return diff
+
+
+def save_report(report: dict, path: str):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
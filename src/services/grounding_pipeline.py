@@ -1,15 +1,26 @@
 import os
 import json
 import re
+import math
 import yaml
 import time
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Any, Optional
-from PIL import Image, ImageDraw
+from PIL import Image
 from datetime import datetime
 
 from src.model.engine import VisionEngine
 from src.config import Config
+from src.utils.json_recovery import recover_json, is_action_payload
+from src.model.token_budget import native_tile_side, plan_image_request
+from src.analysis.processing import append_ndjson, iter_ndjson
+from src.utils.cancellation import OperationCancelled, raise_if_cancelled
+from src.services.run_catalog import get_run_catalog
+from src.services.visualization import get_renderer, save_render_source
+from src.utils.geometry import bbox_to_normalized, bbox_to_pixels, expand_bbox, point_to_pixels, union_bbox
+from src.utils.tiling import dedupe_boxes, plan_tiles
 
 logger = logging.getLogger(__name__)
 
@@ -20,10 +31,9 @@ class GroundingPipeline:
         if not os.path.exists(self.runs_dir):
             os.makedirs(self.runs_dir)
 
-    def execute_suite(self, suite_config: Dict[str, Any]) -> str:
+    def create_suite(self, suite_config: Dict[str, Any]) -> str:
         """
-        Executes a full test suite containing multiple configs.
-        Returns the suite_id.
+        Creates the run directory and saves the suite config. Returns the suite_id.
         """
         suite_id = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{suite_config.get('suite_name', 'suite').replace(' ', '_')}"
         suite_dir = os.path.join(self.runs_dir, suite_id)
@@ -33,35 +43,561 @@ class GroundingPipeline:
         with open(os.path.join(suite_dir, "suite_config.json"), "w") as f:
             json.dump(suite_config, f, indent=2)
 
-        results = []
-        
-        for config in suite_config.get("configs", []):
+        models = [self._resolve_model(config) for config in suite_config.get("configs", [])]
+        get_run_catalog().add_run(suite_id, suite_config, models)
+        return suite_id
+
+    def execute_suite(self, suite_config: Dict[str, Any], suite_id: Optional[str] = None, on_result=None, cancel_token=None) -> str:
+        """
+        Executes a full test suite containing multiple configs.
+        Configs are grouped by model (one load per model, starting with the one
+        already loaded) and same-model configs are batched into a single
+        generate call. API refinement, visualization and saving run in a thread
+        pool while the next batch is inferred locally.
+        Each finished config is appended to results.ndjson and passed to
+        `on_result` as soon as it is ready; summary.json keeps the original order.
+        Re-running an existing suite_id skips configs already in results.ndjson.
+        Returns the suite_id.
+        """
+        suite_id = suite_id or self.create_suite(suite_config)
+        suite_dir = os.path.join(self.runs_dir, suite_id)
+        results_path = os.path.join(suite_dir, "results.ndjson")
+
+        configs = suite_config.get("configs", [])
+        results = [None] * len(configs)
+        if os.path.exists(results_path):
+            for result in iter_ndjson(results_path):
+                if result.get("config_index") is not None:
+                    results[result["config_index"]] = result
+
+        results_lock = threading.Lock()
+
+        def publish(index, result):
+            result["config_index"] = index
+            with results_lock:
+                results[index] = result
+                append_ndjson(results_path, [result])
+                if on_result:
+                    on_result(result)
+
+        def finalize(index, prepared, raw_response):
             try:
-                result = self.execute_step(config, suite_dir, suite_id)
-                results.append(result)
+                publish(index, self._finalize_step(prepared, raw_response, suite_id))
             except Exception as e:
-                logger.error(f"Error executing config {config.get('name')}: {e}")
-                results.append({
-                    "config_name": config.get("name"),
-                    "status": "error",
-                    "error": str(e)
-                })
-
-        # Update summary
-        with open(os.path.join(suite_dir, "summary.json"), "w") as f:
-            json.dump(results, f, indent=2)
+                self._publish_error(publish, index, configs[index], e)
+
+        pending = [(i, config) for i, config in enumerate(configs) if results[i] is None]
+        status = "completed"
+        try:
+            with ThreadPoolExecutor(max_workers=Config.GROUNDING_REFINE_WORKERS) as pool:
+                for hf_model_name, group in self._group_by_model(pending):
+                    raise_if_cancelled(cancel_token)
+                    prepared = []
+                    for index, config in group:
+                        try:
+                            prepared.append((index, self._prepare_step(config, suite_dir)))
+                        except Exception as e:
+                            self._publish_error(publish, index, config, e)
+                    if not prepared:
+                        continue
+
+                    # The engine stays on this model until the group is done (other requests wait)
+                    with self.engine.exclusive():
+                        try:
+                            self.engine.load_model(hf_model_name)
+                        except Exception as e:
+                            for index, _ in prepared:
+                                self._publish_error(publish, index, configs[index], e)
+                            continue
+
+                        for start in range(0, len(prepared), Config.GROUNDING_BATCH_SIZE):
+                            batch = prepared[start:start + Config.GROUNDING_BATCH_SIZE]
+                            logger.info(f"Running inference for {len(batch)} config(s) with {hf_model_name}...")
+                            try:
+                                responses = self._infer([p for _, p in batch], cancel_token)
+                            except OperationCancelled:
+                                raise
+                            except Exception as e:
+                                for index, _ in batch:
+                                    self._publish_error(publish, index, configs[index], e)
+                                continue
+                            for (index, p), raw_response in zip(batch, responses):
+                                pool.submit(finalize, index, p, raw_response)
+        except OperationCancelled:
+            status = "cancelled"
+            raise
+        except Exception:
+            status = "failed"
+            raise
+        finally:
+            # Update summary (also for cancelled/failed runs, with what finished)
+            finished = [r for r in results if r is not None]
+            with open(os.path.join(suite_dir, "summary.json"), "w") as f:
+                json.dump(finished, f, indent=2)
+            try:
+                get_run_catalog().finish_run(suite_id, finished, status)
+            except Exception as e:
+                logger.error(f"Could not update run catalog for {suite_id}: {e}")
             
         return suite_id
 
+    def _publish_error(self, publish, index, config, error):
+        logger.error(f"Error executing config {config.get('name')}: {error}")
+        publish(index, {
+            "config_name": config.get("name"),
+            "status": "error",
+            "error": str(error)
+        })
+
+    def _group_by_model(self, indexed_configs):
+        """[(model, [(index, config), ...]), ...] in order of first appearance, loaded model first."""
+        groups = {}
+        for index, config in indexed_configs:
+            groups.setdefault(self._resolve_model(config), []).append((index, config))
+        current = self.engine.current_model_name
+        return sorted(groups.items(), key=lambda item: item[0] != current)
+
     def execute_step(self, config: Dict[str, Any], suite_dir: str, suite_id: str) -> Dict[str, Any]:
         """
         Executes a single test configuration step.
         """
+        prepared = self._prepare_step(config, suite_dir)
+        logger.info(f"Running inference for {prepared['config_name']} with {prepared['model']}...")
+        with self.engine.using(prepared["model"]):
+            raw_response = self._infer([prepared])[0]
+        return self._finalize_step(prepared, raw_response, suite_id)
+
+    def ground(self, config: Dict[str, Any], cancel_token=None) -> Dict[str, Any]:
+        """
+        Runs a single config without refinement or writing a run directory
+        (used by the benchmark harness). Returns the parsed actions.
+        """
+        prepared = self._prepare_step(config)
+        with self.engine.using(prepared["model"]):
+            raw_response = self._infer([prepared], cancel_token)[0]
+        return {
+            "model": prepared["model"],
+            "image_size": list(prepared["image"].size),
+            "actions": self._final_actions(prepared, raw_response),
+            "region": prepared.get("region"),
+            "tiles": prepared.get("tiles"),
+            "raw_response": raw_response
+        }
+
+    def ground_multi(self, image_path: str, prompts: List[str], model: str = "qwen", system_prompt: str = "",
+                     allowed_actions: Optional[List[str]] = None, cancel_token=None) -> Dict[str, Any]:
+        """
+        Answers several instructions about the same screenshot in one generation.
+        The image is encoded and prefilled once and the model returns an action list
+        per numbered instruction; instructions missing from that answer are retried
+        together in a single batched call. Returns one entry per prompt, in order.
+        """
+        config = {"model": model, "image_path": image_path, "allowed_actions": allowed_actions or []}
+        hf_model_name = self._resolve_model(config)
+        image = Image.open(self._resolve_image_path(config))
+        image.load()
+
+        messages = self._image_messages(image, self._build_multi_prompt(prompts, system_prompt or ""))
+        with self.engine.using(hf_model_name):
+            raw_response = self.engine.analyze(
+                messages, max_tokens=max(2048, 512 * len(prompts)),
+                max_continuations=Config.MAX_CONTINUATIONS, cancel_token=cancel_token
+            )
+            answers = self._split_multi_response(raw_response, len(prompts))
+
+            results = [
+                {"prompt": prompt, "source": "shared", "actions": self._filter_allowed(actions, config["allowed_actions"])}
+                for prompt, actions in zip(prompts, answers)
+            ]
+
+            missing = [i for i, actions in enumerate(answers) if actions is None]
+            if missing:
+                logger.warning(f"{len(missing)} of {len(prompts)} instructions missing from the shared answer, retrying")
+                retry_messages = [
+                    self._image_messages(image, self._build_prompt({"prompt": prompts[i], "system_prompt": system_prompt or ""}))
+                    for i in missing
+                ]
+                responses = self.engine.analyze_batch(
+                    retry_messages, max_continuations=Config.MAX_CONTINUATIONS, cancel_token=cancel_token
+                )
+                for i, response in zip(missing, responses):
+                    results[i]["source"] = "fallback"
+                    results[i]["actions"] = self._extract_actions(config, response)
+
+        return {
+            "model": hf_model_name,
+            "image_size": list(image.size),
+            "results": results,
+            "raw_response": raw_response
+        }
+
+    def _image_messages(self, image: Image.Image, prompt_text: str) -> List[Dict]:
+        # We need to wrap this in <image> for Qwen/MAI as per our test
+        return [
+            {
+                "role": "user",
+                "content": [
+                    {"type": "image", "image": image},
+                    {"type": "text", "text": '<image>\n' + prompt_text}
+                ]
+            }
+        ]
+
+    def _prepare_step(self, config: Dict[str, Any], suite_dir: Optional[str] = None) -> Dict[str, Any]:
         config_name = config.get("name", "unnamed").replace(" ", "_")
-        run_dir = os.path.join(suite_dir, config_name)
-        os.makedirs(run_dir)
+        run_dir = None
+        if suite_dir:
+            run_dir = os.path.join(suite_dir, config_name)
+            os.makedirs(run_dir, exist_ok=True)
         
-        # 1. Load Model
+        # 1. Resolve Model
+        hf_model_name = self._resolve_model(config)
+        
+        # 2. Prepare Inputs
+        image_path = self._resolve_image_path(config)
+        image = Image.open(image_path)
+        image.load()
+        
+        prompt_template = self._build_prompt(config)
+            
+        # 3. LMM Messages
+        tiles = self._plan_tiles(image, hf_model_name) if config.get("tiled") else None
+        if tiles:
+            # Tiled: one request per tile at native resolution, resolved in _prepare_tile_stage
+            messages, coarse_image = None, None
+            tile_messages = [
+                self._image_messages(image.crop(tile), self._build_tile_prompt(config, k, len(tiles)))
+                for k, tile in enumerate(tiles)
+            ]
+        else:
+            tile_messages = None
+            # Coarse-to-fine: the first pass only sees a low-resolution copy
+            coarse_image = self._downscale(image, Config.COARSE_MAX_PIXELS) if config.get("coarse_to_fine") else None
+            messages = self._image_messages(coarse_image or image, prompt_template)
+        return {
+            "config": config,
+            "config_name": config_name,
+            "run_dir": run_dir,
+            "model": hf_model_name,
+            "image": image,
+            "image_path": image_path,
+            "coarse_size": coarse_image.size if coarse_image else None,
+            "tiles": tiles,
+            "tile_messages": tile_messages,
+            "messages": messages
+        }
+
+    def _plan_tiles(self, image: Image.Image, hf_model_name: str) -> Optional[List[List[int]]]:
+        """Overlapping tiles for captures larger than the model's native resolution (None if one fits)."""
+        side = native_tile_side(hf_model_name)
+        tiles = plan_tiles(image.size[0], image.size[1], side, int(side * Config.TILE_OVERLAP))
+        return tiles if len(tiles) > 1 else None
+
+    def _infer(self, prepared_list: List[Dict], cancel_token=None) -> List[str]:
+        """
+        Runs the requests of the prepared configs (one per tile for tiled configs)
+        in batches of GROUNDING_BATCH_SIZE, then the second stage of coarse-to-fine
+        and tiled ones. Tile responses are kept in prepared["tile_responses"].
+        """
+        requests = [
+            (i, messages)
+            for i, prepared in enumerate(prepared_list)
+            for messages in (prepared.get("tile_messages") or [prepared["messages"]])
+        ]
+        outputs = [[] for _ in prepared_list]
+        for start in range(0, len(requests), Config.GROUNDING_BATCH_SIZE):
+            chunk = requests[start:start + Config.GROUNDING_BATCH_SIZE]
+            responses = self.engine.analyze_batch(
+                [messages for _, messages in chunk], max_continuations=Config.MAX_CONTINUATIONS, cancel_token=cancel_token
+            )
+            for (i, _), response in zip(chunk, responses):
+                outputs[i].append(response)
+
+        responses = []
+        for prepared, output in zip(prepared_list, outputs):
+            if prepared.get("tiles"):
+                prepared["tile_responses"] = output
+                responses.append("\n\n".join(f"[tile {k} {tile}]\n{r}" for k, (tile, r) in enumerate(zip(prepared["tiles"], output))))
+            else:
+                responses.append(output[0])
+        return self._run_fine_stage(prepared_list, responses, cancel_token)
+
+    def _downscale(self, image: Image.Image, max_pixels: int) -> Image.Image:
+        width, height = image.size
+        if width * height <= max_pixels:
+            return image
+        scale = math.sqrt(max_pixels / (width * height))
+        return image.resize((max(28, round(width * scale)), max(28, round(height * scale))), Image.LANCZOS)
+
+    def _run_fine_stage(self, prepared_list: List[Dict], responses: List[str], cancel_token=None) -> List[str]:
+        """
+        Second pass of coarse-to-fine configs (crops the region found on the
+        low-resolution pass at full resolution) and of tiled configs whose tiles
+        disagree (grounds the region around all tile answers in one piece).
+        Runs as one batch. Returns the responses to finalize (second pass where it ran).
+        """
+        fine = []
+        for i, prepared in enumerate(prepared_list):
+            if prepared.get("coarse_size"):
+                messages = self._prepare_fine_stage(prepared, responses[i])
+            elif prepared.get("tiles"):
+                messages = self._prepare_tile_stage(prepared)
+            else:
+                continue
+            if messages:
+                fine.append((i, messages))
+        if not fine:
+            return responses
+
+        responses = list(responses)
+        fine_responses = self.engine.analyze_batch(
+            [messages for _, messages in fine], max_continuations=Config.MAX_CONTINUATIONS, cancel_token=cancel_token
+        )
+        for (i, _), response in zip(fine, fine_responses):
+            responses[i] = response
+        return responses
+
+    def _prepare_fine_stage(self, prepared: Dict[str, Any], coarse_response: str) -> Optional[List[Dict]]:
+        config = prepared["config"]
+        image = prepared["image"]
+        width, height = image.size
+        coarse_actions = self._map_actions(
+            self._extract_actions(config, coarse_response), prepared["coarse_size"], [0, 0, width, height], (width, height)
+        )
+        prepared["coarse_actions"] = coarse_actions
+        prepared["coarse_response"] = coarse_response
+
+        boxes = self._action_boxes(coarse_actions, width, height)
+        if not boxes:
+            return None
+        region = expand_bbox(union_bbox(boxes), width, height, Config.COARSE_MARGIN, Config.COARSE_MIN_REGION)
+        if (region[2] - region[0]) * (region[3] - region[1]) > Config.COARSE_MAX_REGION * width * height:
+            logger.info(f"Region for {prepared['config_name']} covers most of the image, keeping the coarse pass")
+            return None
+
+        crop = image.crop(region)
+        prepared["region"] = region
+        prepared["crop_size"] = crop.size
+        return self._image_messages(crop, self._build_prompt(config))
+
+    def _final_actions(self, prepared: Dict[str, Any], raw_response: str) -> List[Dict]:
+        """Actions in the original frame (0-1000), resolving the coarse-to-fine stages."""
+        config = prepared["config"]
+        if prepared.get("tiles"):
+            actions = self._extract_actions(config, raw_response) if prepared.get("region") else None
+            if not actions:
+                return self._best_tile_actions(prepared)
+            return self._map_actions(actions, prepared["crop_size"], prepared["region"], prepared["image"].size)
+        if not prepared.get("coarse_size"):
+            return self._extract_actions(config, raw_response)
+        if not prepared.get("region"):
+            return prepared.get("coarse_actions", [])
+        actions = self._extract_actions(config, raw_response)
+        if not actions:
+            return prepared["coarse_actions"]
+        return self._map_actions(actions, prepared["crop_size"], prepared["region"], prepared["image"].size)
+
+    def _prepare_tile_stage(self, prepared: Dict[str, Any]) -> Optional[List[Dict]]:
+        """
+        Resolves the tile answers into one answer for the instruction. Tiles answer []
+        when the target is not in view. If the other answering tiles only repeat actions
+        seen in the overlap, one tile wins. If tiles found different things (a guess in
+        a tile without the target, or a drag split across tiles), the region around all
+        the answers is grounded again in one piece. Returns those messages, or None.
+        """
+        config = prepared["config"]
+        width, height = prepared["image"].size
+        candidates, items = [], []
+        for k, (tile, response) in enumerate(zip(prepared["tiles"], prepared["tile_responses"])):
+            tile_size = (tile[2] - tile[0], tile[3] - tile[1])
+            actions = self._map_actions(self._extract_actions(config, response), tile_size, tile, (width, height))
+            if not actions:
+                continue
+            candidates.append((k, actions))
+            for action in actions:
+                boxes = self._action_boxes([action], width, height)
+                if boxes:
+                    items.append((union_bbox(boxes), (k, action)))
+        prepared["tile_candidates"] = candidates
+        if len(candidates) <= 1:
+            return None
+
+        # Only the same action seen from two tiles is a duplicate; a large drag box must not swallow other actions
+        kept = dedupe_boxes(
+            items, Config.TILE_DEDUPE_IOU,
+            comparable=lambda a, b: a[0] != b[0] and str(a[1].get("action", "")).lower() == str(b[1].get("action", "")).lower()
+        )
+        winners = {k for _, (k, _) in kept}
+        if len(winners) == 1:
+            prepared["tile_winner"] = winners.pop()
+            return None
+
+        region = expand_bbox(union_bbox([box for box, _ in items]), width, height, Config.COARSE_MARGIN, Config.COARSE_MIN_REGION)
+        if (region[2] - region[0]) * (region[3] - region[1]) > Config.COARSE_MAX_REGION * width * height:
+            logger.info(f"Tile answers for {prepared['config_name']} are spread over most of the image, keeping the best tile")
+            return None
+        crop = prepared["image"].crop(region)
+        prepared["region"] = region
+        prepared["crop_size"] = crop.size
+        return self._image_messages(crop, self._build_prompt(config))
+
+    def _best_tile_actions(self, prepared: Dict[str, Any]) -> List[Dict]:
+        """The winning tile's answer: the one left after overlap dedupe, else the most confident."""
+        candidates = dict(prepared.get("tile_candidates") or [])
+        if not candidates:
+            return []
+        if prepared.get("tile_winner") in candidates:
+            return candidates[prepared["tile_winner"]]
+
+        def confidence(actions):
+            values = [a["confidence"] for a in actions if isinstance(a.get("confidence"), (int, float))]
+            return sum(values) / len(values) if values else 0.0
+
+        return max(candidates.values(), key=confidence)
+
+    def _action_boxes(self, actions: List[Dict], width: int, height: int) -> List[List[int]]:
+        boxes = []
+        for action in actions:
+            for key in ("bbox", "start_bbox", "end_bbox"):
+                box = action.get(key)
+                if isinstance(box, list) and len(box) == 4:
+                    boxes.append(bbox_to_pixels(box, width, height))
+            coord = action.get("coordinate")
+            if isinstance(coord, list) and len(coord) == 2:
+                x, y = point_to_pixels(coord, width, height)
+                boxes.append([x, y, x, y])
+        return boxes
+
+    def _map_actions(self, actions: List[Dict], from_size, region, to_size) -> List[Dict]:
+        """
+        Maps coordinates given for an image of `from_size` that covers `region`
+        (pixels of the target frame) to 0-1000 coordinates of the target frame.
+        """
+        from_width, from_height = from_size
+        to_width, to_height = to_size
+        scale_x = (region[2] - region[0]) / from_width
+        scale_y = (region[3] - region[1]) / from_height
+
+        def to_frame(box):
+            return bbox_to_normalized([
+                region[0] + box[0] * scale_x,
+                region[1] + box[1] * scale_y,
+                region[0] + box[2] * scale_x,
+                region[1] + box[3] * scale_y,
+            ], to_width, to_height)
+
+        mapped = []
+        for action in actions:
+            action = dict(action)
+            for key in ("bbox", "start_bbox", "end_bbox"):
+                box = action.get(key)
+                if isinstance(box, list) and len(box) == 4:
+                    action[key] = to_frame(bbox_to_pixels(box, from_width, from_height))
+            coord = action.get("coordinate")
+            if isinstance(coord, list) and len(coord) == 2:
+                x, y = point_to_pixels(coord, from_width, from_height)
+                action["coordinate"] = to_frame([x, y, x, y])[:2]
+            mapped.append(action)
+        return mapped
+
+    def _finalize_step(self, prepared: Dict[str, Any], raw_response: str, suite_id: str) -> Dict[str, Any]:
+        config = prepared["config"]
+        config_name = prepared["config_name"]
+        run_dir = prepared["run_dir"]
+        image = prepared["image"]
+        prompt = config.get("prompt", "")
+
+        actions = self._final_actions(prepared, raw_response)
+
+        # 6. Refinement (Gemini) - Optional
+        if config.get("refinement", False):
+            actions = self._refine_with_gemini(actions, image, prompt)
+
+        # 7. Visualization & Save
+        # Rendering happens off the inference path: a small preview in the background,
+        # the full-resolution image on first request.
+        save_render_source(run_dir, prepared["image_path"], actions)
+        preview_width = Config.VISUALIZATION_PREVIEW_WIDTH
+        get_renderer().submit(run_dir, "webp", preview_width)
+        result_url = f"/grounding/runs/{suite_id}/{config_name}/result"
+        
+        # Save JSON
+        with open(os.path.join(run_dir, "actions.json"), "w") as f:
+            json.dump(actions, f, indent=2)
+            
+        # Save Logs/Raw Response
+        with open(os.path.join(run_dir, "raw_response.txt"), "w") as f:
+            f.write(raw_response)
+
+        stages = {}
+        if prepared.get("coarse_size"):
+            stages = {"region": prepared.get("region"), "coarse_response": prepared.get("coarse_response")}
+        elif prepared.get("tiles"):
+            stages = {"tiles": prepared["tiles"], "region": prepared.get("region")}
+
+        return {
+            **stages,
+            "config_name": config_name,
+            "status": "success",
+            "model": prepared["model"],
+            "image_url": result_url, # Relative URL for frontend
+            "preview_url": f"{result_url}?format=webp&width={preview_width}",
+            "actions": actions,
+            "raw_response": raw_response
+        }
+
+    def _extract_actions(self, config: Dict[str, Any], raw_response: str) -> List[Dict]:
+        # 4. Parse Actions
+        actions = self._parse_json_response(raw_response)
+        
+        # 5. Validation (Allowed Actions)
+        return self._filter_allowed(actions, config.get("allowed_actions", []))
+
+    def _filter_allowed(self, actions: List[Dict], allowed_actions: List[str]) -> List[Dict]:
+        if not allowed_actions or actions is None:
+            return actions
+        allowed = [a.lower() for a in allowed_actions]
+        filtered_actions = []
+        for action in actions:
+            act_type = action.get("action", "").lower()
+            if act_type in allowed:
+                filtered_actions.append(action)
+            else:
+                logger.warning(f"Action '{act_type}' filtered out (not in allowed list)")
+        return filtered_actions
+
+    def plan_suite(self, suite_config: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        Dry run: token and memory estimate for each config without loading any model.
+        """
+        plans = []
+        for config in suite_config.get("configs", []):
+            try:
+                hf_model_name = self._resolve_model(config)
+                with Image.open(self._resolve_image_path(config)) as image:
+                    width, height = image.size
+                if config.get("coarse_to_fine") and width * height > Config.COARSE_MAX_PIXELS:
+                    # Only the first pass is known up front; the crop depends on what it finds
+                    scale = math.sqrt(Config.COARSE_MAX_PIXELS / (width * height))
+                    width, height = round(width * scale), round(height * scale)
+                tiles = None
+                if config.get("tiled"):
+                    side = native_tile_side(hf_model_name)
+                    tiles = plan_tiles(width, height, side, int(side * Config.TILE_OVERLAP))
+                if tiles and len(tiles) > 1:
+                    # One request per tile, all the same size
+                    tile_width, tile_height = tiles[0][2] - tiles[0][0], tiles[0][3] - tiles[0][1]
+                    plan = plan_image_request(tile_width, tile_height, hf_model_name, prompt_text=self._build_prompt(config))
+                    plan["tiles"] = len(tiles)
+                    plan["total_prefill_tokens"] = plan["prefill_tokens"] * len(tiles)
+                else:
+                    plan = plan_image_request(width, height, hf_model_name, prompt_text=self._build_prompt(config))
+                plans.append({"config_name": config.get("name"), "status": "planned", **plan})
+            except Exception as e:
+                plans.append({"config_name": config.get("name"), "status": "error", "error": str(e)})
+        return plans
+
+    def _resolve_model(self, config: Dict[str, Any]) -> str:
         model_name = config.get("model", "qwen")
         hf_model_name = "LZXzju/Qwen2.5-VL-3B-UI-R1-E" # Default Qwen
         if model_name == "mai":
@@ -71,10 +607,9 @@ class GroundingPipeline:
         # Support full HF paths too
         if "/" in model_name:
             hf_model_name = model_name
-            
-        self.engine.load_model(hf_model_name)
-        
-        # 2. Prepare Inputs
+        return hf_model_name
+
+    def _resolve_image_path(self, config: Dict[str, Any]) -> str:
         image_path = config.get("image_path")
         # Handle uploaded images path resolution
         if not os.path.isabs(image_path) and not os.path.exists(image_path):
@@ -85,10 +620,9 @@ class GroundingPipeline:
         
         if not os.path.exists(image_path):
             raise FileNotFoundError(f"Image not found: {image_path}")
-            
-        image = Image.open(image_path)
-        origin_width, origin_height = image.size
-        
+        return image_path
+
+    def _build_prompt(self, config: Dict[str, Any]) -> str:
         prompt = config.get("prompt", "")
         system_prompt = config.get("system_prompt", "")
         
@@ -97,7 +631,7 @@ class GroundingPipeline:
         prompt_template = config.get("prompt_template")
         if not prompt_template:
             # Default template similar to our successful test
-            prompt_template = (
+            return (
                 f"User instruction: {prompt}\n"
                 f"{system_prompt}\n"
                 "Please decompose this task into a sequence of low-level UI actions.\n"
@@ -107,116 +641,73 @@ class GroundingPipeline:
                 "[{{\"action\": \"drag\", \"start_bbox\": [100, 200, 150, 250], \"end_bbox\": [400, 200, 500, 600], \"description\": \"Drag A to B\"}}]\n"
                 "Now, provide the JSON for the user instruction."
             )
-        else:
-            prompt_template = prompt_template.format(prompt=prompt)
-            
-        # 3. LMM Inference
-        # We need to wrap this in <image> for Qwen/MAI as per our test
-        query = '<image>\n' + prompt_template
-        messages = [
-            {
-                "role": "user",
-                "content": [
-                    {"type": "image", "image": image},
-                    {"type": "text", "text": query}
-                ]
-            }
-        ]
-        
-        logger.info(f"Running inference for {config_name} with {hf_model_name}...")
-        raw_response = self.engine.analyze(messages)
-        
-        # 4. Parse Actions
-        actions = self._parse_json_response(raw_response)
-        
-        # 5. Validation (Allowed Actions)
-        allowed_actions = config.get("allowed_actions", [])
-        if allowed_actions:
-            filtered_actions = []
-            for action in actions:
-                act_type = action.get("action", "").lower()
-                if act_type in [a.lower() for a in allowed_actions]:
-                    filtered_actions.append(action)
-                else:
-                    logger.warning(f"Action '{act_type}' filtered out (not in allowed list)")
-            actions = filtered_actions
+        return prompt_template.format(prompt=prompt)
 
-        # 6. Refinement (Gemini) - Optional
-        if config.get("refinement", False):
-            actions = self._refine_with_gemini(actions, image, prompt)
+    def _build_tile_prompt(self, config: Dict[str, Any], index: int, count: int) -> str:
+        return (
+            f"This image is a partial view (tile {index + 1} of {count}) of a larger screen.\n"
+            f"{self._build_prompt(config)}\n"
+            "Only return actions whose targets are fully visible in this tile, each with a \"confidence\" between 0 and 1.\n"
+            "If the target of the instruction is not in this tile, answer with an empty list: []"
+        )
 
-        # 7. Visualization & Save
-        result_image_path = os.path.join(run_dir, "result.png")
-        self._visualize_actions(image.copy(), actions, result_image_path, origin_width, origin_height)
-        
-        # Save JSON
-        with open(os.path.join(run_dir, "actions.json"), "w") as f:
-            json.dump(actions, f, indent=2)
-            
-        # Save Logs/Raw Response
-        with open(os.path.join(run_dir, "raw_response.txt"), "w") as f:
-            f.write(raw_response)
+    def _build_multi_prompt(self, prompts: List[str], system_prompt: str) -> str:
+        instructions = "\n".join(f"{i + 1}. {prompt}" for i, prompt in enumerate(prompts))
+        return (
+            f"User instructions about this screen:\n{instructions}\n"
+            f"{system_prompt}\n"
+            "For EACH instruction, decompose it into a sequence of low-level UI actions.\n"
+            "If an instruction involves moving an item (drag and drop), you MUST provide the start coordinate (the item to move) and the end coordinate (the destination container).\n"
+            "Format your answer strictly as a JSON object that maps each instruction number to its list of actions.\n"
+            "Example:\n"
+            "{\"1\": [{\"action\": \"click\", \"bbox\": [100, 200, 150, 250], \"description\": \"Click A\"}], "
+            "\"2\": [{\"action\": \"drag\", \"start_bbox\": [100, 200, 150, 250], \"end_bbox\": [400, 200, 500, 600], \"description\": \"Drag A to B\"}]}\n"
+            "Now, provide the JSON for all the instructions."
+        )
 
-        return {
-            "config_name": config_name,
-            "status": "success",
-            "model": hf_model_name,
-            "image_url": f"/runs/{suite_id}/{config_name}/result.png", # Relative URL for frontend
-            "actions": actions,
-            "raw_response": raw_response
-        }
+    def _split_multi_response(self, text: str, count: int) -> List[Optional[List[Dict]]]:
+        """
+        Per-instruction action lists from a multi-prompt answer. Accepts {"1": [...]},
+        [{"id": 1, "actions": [...]}] or a plain list of lists. None = not answered.
+        """
+        parsed, _ = recover_json(text, accept=lambda value: isinstance(value, (dict, list)))
+        answers: List[Optional[List[Dict]]] = [None] * count
 
-    def _parse_json_response(self, text: str) -> List[Dict]:
-        try:
-            # Find JSON array
-            json_match = re.search(r'\[\s*\{.*\}\s*\]', text, re.DOTALL)
-            if json_match:
-                return json.loads(json_match.group(0))
-            return json.loads(text)
-        except Exception:
-            logger.warning("Failed to parse JSON, returning empty list")
-            return []
+        def assign(key, actions):
+            try:
+                index = int(str(key).strip().rstrip(".")) - 1
+            except ValueError:
+                return
+            if 0 <= index < count:
+                if isinstance(actions, dict):
+                    actions = actions.get("actions", [actions])
+                if isinstance(actions, list):
+                    answers[index] = [a for a in actions if isinstance(a, dict)]
 
-    def _visualize_actions(self, image, actions, output_path, width, height):
-        draw = ImageDraw.Draw(image)
-        for i, step in enumerate(actions):
-            bbox = step.get("bbox") or step.get("start_bbox")
-            if bbox:
-                # Normalize check (0-1000)
-                if all(isinstance(c, (int, float)) and c <= 1000 for c in bbox):
-                    x1 = int(bbox[0] / 1000 * width)
-                    y1 = int(bbox[1] / 1000 * height)
-                    x2 = int(bbox[2] / 1000 * width)
-                    y2 = int(bbox[3] / 1000 * height)
-                else:
-                    x1, y1, x2, y2 = bbox # Assume absolute if > 1000 (though unlikely for Qwen/MAI standard)
-
-                # Draw Start
-                draw.rectangle([x1, y1, x2, y2], outline="red", width=3)
-                cx, cy = (x1 + x2) // 2, (y1 + y2) // 2
-                draw.ellipse((cx - 10, cy - 10, cx + 10, cy + 10), fill='blue', outline='white')
-                
-                action_type = step.get("action", "action").upper()
-                draw.text((x1, y1 - 15), f"{i+1}: {action_type}", fill='red')
-
-                # Draw End (Drag)
-                if "end_bbox" in step:
-                    end_bbox = step["end_bbox"]
-                    if all(isinstance(c, (int, float)) and c <= 1000 for c in end_bbox):
-                        ex1 = int(end_bbox[0] / 1000 * width)
-                        ey1 = int(end_bbox[1] / 1000 * height)
-                        ex2 = int(end_bbox[2] / 1000 * width)
-                        ey2 = int(end_bbox[3] / 1000 * height)
-                    else:
-                        ex1, ey1, ex2, ey2 = end_bbox
-                    
-                    ecx, ecy = (ex1 + ex2) // 2, (ey1 + ey2) // 2
-                    draw.rectangle([ex1, ey1, ex2, ey2], outline="green", width=3)
-                    draw.ellipse((ecx - 10, ecy - 10, ecx + 10, ecy + 10), fill='green', outline='white')
-                    draw.line([(cx, cy), (ecx, ecy)], fill="yellow", width=3)
-                    draw.text((ex1, ey1 - 15), "DROP", fill='green')
-        
-        image.save(output_path)
+        if isinstance(parsed, dict):
+            for key, actions in parsed.items():
+                assign(key, actions)
+        elif isinstance(parsed, list):
+            for position, item in enumerate(parsed):
+                if isinstance(item, list):
+                    assign(position + 1, item)
+                elif isinstance(item, dict) and isinstance(item.get("actions"), list):
+                    assign(item.get("id", item.get("instruction", position + 1)), item["actions"])
+        return answers
+
+    def _parse_json_response(self, text: str) -> List[Dict]:
+        # Tolerant parse: ignores surrounding prose and salvages complete actions from truncated arrays
+        parsed, _ = recover_json(text, accept=is_action_payload)
+        if isinstance(parsed, list):
+            return [a for a in parsed if isinstance(a, dict)]
+        if isinstance(parsed, dict):
+            # Some models wrap the list in a key
+            for value in parsed.values():
+                if isinstance(value, list) and all(isinstance(a, dict) for a in value):
+                    return value
+            return [parsed]
+        logger.warning("Failed to parse JSON, returning empty list")
+        return []
 
     def _refine_with_gemini(self, actions: List[Dict], image: Image.Image, prompt: str) -> List[Dict]:
         # This calls the Gemini API via the engine to refine the actions
@@ -234,38 +725,25 @@ class GroundingPipeline:
             "Return ONLY the corrected JSON list of actions."
         )
         
-        # We need to temporarily switch to Gemini model if not already
-        # But VisionEngine switches automatically if we pass a gemini model name
-        # We need the API key from config
         if not Config.ASSISTANT_CONFIG.get("api_key"):
             logger.warning("No API key for refinement, skipping.")
             return actions
 
-        # We need to preserve current model to switch back? 
-        # VisionEngine loads on demand, so next step will reload local model if needed.
-        # But this is expensive. For MVP, let's assume refinement is high value.
-        
         try:
-            # Force load gemini for this call
+            # Separate API call: the local model stays loaded, so refinement can
+            # run while the next configs are being inferred.
             gemini_model = "google/gemini-2.0-flash-exp" # Or whatever is configured
-            # Actually we should use the one in Config or passed in
-            
-            # Since VisionEngine.analyze handles loading, we just pass the model name in a "virtual" way
-            # But wait, VisionEngine.analyze uses `self.current_model_name`.
-            # We need to instantiate a separate client or force switch.
-            # Let's force switch for now.
-            
-            # Save current
-            prev_model = self.engine.current_model_name
-            
-            self.engine.load_model(gemini_model)
-            refined_response = self.engine.analyze_image(image, refine_prompt)
+            messages = [
+                {
+                    "role": "user",
+                    "content": [
+                        {"type": "image", "image": image},
+                        {"type": "text", "text": refine_prompt},
+                    ],
+                }
+            ]
+            refined_response = self.engine.analyze_api(messages, gemini_model)
             refined_actions = self._parse_json_response(refined_response)
-            
-            # Switch back or leave it for next step to handle
-            if prev_model and "gemini" not in prev_model:
-                self.engine.load_model(prev_model)
-                
             return refined_actions if refined_actions else actions
             
         except Exception as e:
@@ -0,0 +1,288 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+
+from src.config import Config
+from src.utils.cancellation import CancellationToken, OperationCancelled
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = {"completed", "failed", "cancelled"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    params TEXT NOT NULL,
+    progress_done INTEGER NOT NULL DEFAULT 0,
+    progress_total INTEGER NOT NULL DEFAULT 0,
+    message TEXT,
+    result TEXT,
+    error TEXT,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_queue ON jobs(status, priority DESC, created_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_kind ON jobs(kind, created_at);
+"""
+
+
+class JobCancelled(OperationCancelled):
+    """Se lanza dentro de un handler cuando su job fue cancelado."""
+
+
+class JobContext:
+    """Lo que un handler ve de su job: parámetros, directorio de salida y progreso."""
+
+    def __init__(self, queue: "JobQueue", job: dict):
+        self.queue = queue
+        self.job_id = job["id"]
+        self.params = job["params"]
+        self.output_dir = os.path.join(queue.jobs_dir, job["id"])
+        os.makedirs(self.output_dir, exist_ok=True)
+        # Se pasa al pipeline/motor para detener el trabajo en curso
+        self.cancel_token = CancellationToken()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_token.cancelled
+
+    def check_cancelled(self):
+        if self.cancelled:
+            raise JobCancelled(self.job_id)
+
+    def set_progress(self, done: int, total: int, message: Optional[str] = None):
+        """Actualiza el progreso persistido (seguro desde cualquier hilo)."""
+        self.queue._update(self.job_id, progress_done=done, progress_total=total, message=message)
+
+    def report_progress(self, done: int, total: int, message: Optional[str] = None):
+        """Como set_progress, pero lanza JobCancelled si se pidió cancelar."""
+        self.set_progress(done, total, message)
+        self.check_cancelled()
+
+
+class JobQueue:
+    """
+    Cola de jobs persistente en SQLite con prioridad y número de workers configurable.
+    Cada tipo de job (`kind`) tiene un handler registrado: handler(ctx) -> resultado (JSON).
+    Los jobs que quedaron 'running' tras un reinicio vuelven a 'pending'.
+    """
+
+    def __init__(self, db_path: Optional[str] = None, jobs_dir: Optional[str] = None, workers: Optional[int] = None):
+        self.db_path = db_path or Config.JOB_STORE_PATH
+        self.jobs_dir = jobs_dir or Config.JOBS_DIR
+        self.num_workers = workers or Config.JOB_WORKERS
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        os.makedirs(self.jobs_dir, exist_ok=True)
+
+        self._handlers: Dict[str, Callable] = {}
+        self._running: Dict[str, JobContext] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition()
+        self._threads = []
+
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _row_to_job(row) -> dict:
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        job["cancel_requested"] = bool(job["cancel_requested"])
+        # ETA estimada a partir del ritmo observado
+        job["eta_seconds"] = None
+        if job["status"] == "running" and job["started_at"] and 0 < job["progress_done"] < job["progress_total"]:
+            elapsed = time.time() - job["started_at"]
+            remaining = job["progress_total"] - job["progress_done"]
+            job["eta_seconds"] = round(elapsed / job["progress_done"] * remaining, 1)
+        return job
+
+    def _update(self, job_id: str, **fields):
+        fields["updated_at"] = time.time()
+        columns = ", ".join(f"{k} = ?" for k in fields)
+        with self._connect() as conn:
+            conn.execute(f"UPDATE jobs SET {columns} WHERE id = ?", list(fields.values()) + [job_id])
+
+    # --- Public API ---
+
+    def register_handler(self, kind: str, handler: Callable):
+        self._handlers[kind] = handler
+
+    def submit(self, kind: str, params: dict, priority: int = 0) -> dict:
+        if kind not in self._handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, kind, status, priority, params, created_at, updated_at) VALUES (?, ?, 'pending', ?, ?, ?, ?)",
+                (job_id, kind, priority, json.dumps(params), now, now)
+            )
+        self.start()
+        with self._wakeup:
+            self._wakeup.notify()
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def list(self, status: Optional[str] = None, kind: Optional[str] = None, limit: int = 50, offset: int = 0) -> dict:
+        clauses, params = [], []
+        if status:
+            clauses.append("status = ?")
+            params.append(status)
+        if kind:
+            clauses.append("kind = ?")
+            params.append(kind)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self._connect() as conn:
+            total = conn.execute(f"SELECT COUNT(*) FROM jobs {where}", params).fetchone()[0]
+            rows = conn.execute(
+                f"SELECT * FROM jobs {where} ORDER BY created_at DESC LIMIT ? OFFSET ?", params + [limit, offset]
+            ).fetchall()
+        return {"total": total, "limit": limit, "offset": offset, "items": [self._row_to_job(r) for r in rows]}
+
+    def cancel(self, job_id: str) -> Optional[dict]:
+        """
+        Cancela un job pendiente de inmediato; uno en ejecución se detiene en su
+        próximo checkpoint (incluido el siguiente token generado).
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'cancelled', finished_at = ?, updated_at = ? WHERE id = ? AND status = 'pending'",
+                (now, now, job_id)
+            )
+            conn.execute(
+                "UPDATE jobs SET cancel_requested = 1, updated_at = ? WHERE id = ? AND status = 'running'",
+                (now, job_id)
+            )
+        with self._lock:
+            ctx = self._running.get(job_id)
+        if ctx is not None:
+            ctx.cancel_token.cancel()
+        return self.get(job_id)
+
+    # --- Workers ---
+
+    def _kinds_clause(self):
+        """
+        Filtro por los tipos con handler en este proceso: las dos apps comparten
+        data/jobs.db y cada una solo debe tocar sus propios jobs.
+        """
+        kinds = sorted(self._handlers)
+        return f"kind IN ({', '.join('?' * len(kinds))})", kinds
+
+    def start(self):
+        """
+        Arranca los workers (idempotente). Los jobs que quedaron 'running' tras un
+        reinicio vuelven a la cola, salvo los que ya tenían cancelación pedida.
+        """
+        with self._lock:
+            if self._threads:
+                return
+            kinds_sql, kinds = self._kinds_clause()
+            now = time.time()
+            with self._connect() as conn:
+                conn.execute(
+                    f"UPDATE jobs SET status = 'cancelled', finished_at = ?, updated_at = ? "
+                    f"WHERE status = 'running' AND cancel_requested = 1 AND {kinds_sql}",
+                    [now, now] + kinds
+                )
+                conn.execute(
+                    f"UPDATE jobs SET status = 'pending', started_at = NULL WHERE status = 'running' AND {kinds_sql}",
+                    kinds
+                )
+            for i in range(self.num_workers):
+                thread = threading.Thread(target=self._worker_loop, name=f"job-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        logger.info(f"Job queue started with {self.num_workers} worker(s)")
+
+    def _claim_next(self) -> Optional[dict]:
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                kinds_sql, kinds = self._kinds_clause()
+                row = conn.execute(
+                    f"SELECT * FROM jobs WHERE status = 'pending' AND {kinds_sql} ORDER BY priority DESC, created_at LIMIT 1",
+                    kinds
+                ).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return None
+                now = time.time()
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', started_at = ?, updated_at = ? WHERE id = ?",
+                    (now, now, row["id"])
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return self.get(row["id"])
+
+    def _worker_loop(self):
+        while True:
+            try:
+                job = self._claim_next()
+            except Exception as e:
+                logger.error(f"Job queue error: {e}")
+                job = None
+            if job is None:
+                with self._wakeup:
+                    self._wakeup.wait(timeout=1.0)
+                continue
+            self._run(job)
+
+    def _run(self, job: dict):
+        ctx = JobContext(self, job)
+        with self._lock:
+            self._running[job["id"]] = ctx
+        logger.info(f"Running job {job['id']} ({job['kind']})")
+        try:
+            result = self._handlers[job["kind"]](ctx)
+            self._update(job["id"], status="completed", result=json.dumps(result), finished_at=time.time())
+        except OperationCancelled:
+            logger.info(f"Job {job['id']} cancelled")
+            self._update(job["id"], status="cancelled", finished_at=time.time())
+        except Exception as e:
+            logger.error(f"Job {job['id']} failed: {e}")
+            self._update(job["id"], status="failed", error=str(e), finished_at=time.time())
+        finally:
+            with self._lock:
+                self._running.pop(job["id"], None)
+
+
+_job_queue = None
+
+
+def get_job_queue() -> JobQueue:
+    global _job_queue
+    if _job_queue is None:
+        _job_queue = JobQueue()
+    return _job_queue
@@ -0,0 +1,136 @@
+import os
+import logging
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+
+from src.config import Config
+
+logger = logging.getLogger(__name__)
+
+
+def _load_gray(path: str, work_width: int):
+    frame = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    if frame is None:
+        return None
+    height, width = frame.shape
+    if width > work_width:
+        frame = cv2.resize(frame, (work_width, max(1, round(height * work_width / width))), interpolation=cv2.INTER_AREA)
+    return frame
+
+
+def _frame_similarity(a, b) -> float:
+    """1.0 = idénticos. Diferencia media absoluta sobre una miniatura (detecta cortes de escena)."""
+    size = (64, 36)
+    diff = cv2.absdiff(cv2.resize(a, size, interpolation=cv2.INTER_AREA), cv2.resize(b, size, interpolation=cv2.INTER_AREA))
+    return max(0.0, 1.0 - float(diff.mean()) / 64.0)
+
+
+def track_box(source, target, box: dict, search_factor: float = 1.0) -> Tuple[Optional[dict], float]:
+    """
+    Busca en `target` el contenido de `box` (x, y, w, h en 0-1000) de `source`
+    con template matching alrededor de su posición original.
+    Retorna (caja movida, confianza 0-1).
+    """
+    height, width = source.shape
+    x1 = int(box["x"] / 1000 * width)
+    y1 = int(box["y"] / 1000 * height)
+    x2 = min(width, max(x1 + 4, int((box["x"] + box["w"]) / 1000 * width)))
+    y2 = min(height, max(y1 + 4, int((box["y"] + box["h"]) / 1000 * height)))
+    template = source[y1:y2, x1:x2]
+    th, tw = template.shape
+    if th < 4 or tw < 4 or float(template.std()) < 1.0:
+        # Caja vacía o sin textura: no hay nada que seguir
+        return None, 0.0
+
+    margin_x, margin_y = int(tw * search_factor) + 8, int(th * search_factor) + 8
+    wx1, wy1 = max(0, x1 - margin_x), max(0, y1 - margin_y)
+    wx2, wy2 = min(width, x2 + margin_x), min(height, y2 + margin_y)
+    window = target[wy1:wy2, wx1:wx2]
+    if window.shape[0] < th or window.shape[1] < tw:
+        return None, 0.0
+
+    scores = cv2.matchTemplate(window, template, cv2.TM_CCOEFF_NORMED)
+    _, score, _, (mx, my) = cv2.minMaxLoc(scores)
+    moved = dict(box)
+    moved["x"] = round((wx1 + mx) / width * 1000, 1)
+    moved["y"] = round((wy1 + my) / height * 1000, 1)
+    return moved, max(0.0, float(score))
+
+
+class LabelPropagator:
+    """
+    Propaga cajas entre frames cercanos del mismo job en CPU (template matching),
+    para no llamar al modelo remoto por cada frame casi idéntico.
+    Un frame se escala al modelo si está a más de `keyframe_interval` frames de
+    un ejemplo etiquetado (keyframe) o si la confianza del seguimiento es baja.
+    """
+
+    def __init__(self, min_confidence: Optional[float] = None, keyframe_interval: Optional[int] = None,
+                 work_width: Optional[int] = None):
+        self.min_confidence = min_confidence if min_confidence is not None else Config.PROPAGATION_MIN_CONFIDENCE
+        self.keyframe_interval = keyframe_interval or Config.PROPAGATION_KEYFRAME_INTERVAL
+        self.work_width = work_width or Config.PROPAGATION_WORK_WIDTH
+
+    def propagate(self, job_dir: str, examples: Dict[str, List[dict]], targets: List[str]) -> Tuple[Dict[str, dict], List[str]]:
+        """
+        examples: {frame: [boxes]} etiquetados por el usuario.
+        Retorna ({frame: {"boxes", "confidence", "source_frame"}}, frames que necesitan al modelo).
+        """
+        frames = sorted(f for f in os.listdir(job_dir) if f.lower().endswith((".jpg", ".jpeg", ".png")))
+        position = {f: i for i, f in enumerate(frames)}
+        labeled = [position[f] for f in examples if f in position]
+        if not labeled:
+            return {}, list(targets)
+
+        known = {position[f]: boxes for f, boxes in examples.items() if f in position}
+        cache = {}
+
+        def gray(index):
+            if index not in cache:
+                cache[index] = _load_gray(os.path.join(job_dir, frames[index]), self.work_width)
+            return cache[index]
+
+        def distance_to_labeled(index):
+            return min(abs(index - i) for i in labeled)
+
+        propagated, escalate = {}, []
+        # Primero los más cercanos a un ejemplo: así cada frame puede partir del vecino ya propagado
+        ordered = sorted((t for t in targets if t in position), key=lambda t: (distance_to_labeled(position[t]), position[t]))
+        escalate.extend(t for t in targets if t not in position)
+
+        for target in ordered:
+            index = position[target]
+            if distance_to_labeled(index) > self.keyframe_interval:
+                escalate.append(target)
+                continue
+            source = min(known, key=lambda i: (abs(i - index), i not in labeled))
+            boxes, confidence = self._track(gray(source), gray(index), known[source])
+            if boxes is None or confidence < self.min_confidence:
+                escalate.append(target)
+                continue
+            known[index] = boxes
+            propagated[target] = {"boxes": boxes, "confidence": round(confidence, 3), "source_frame": frames[source]}
+
+        logger.info(f"Propagated {len(propagated)} frame(s) locally, {len(escalate)} need the model")
+        return propagated, escalate
+
+    def _track(self, source, target, boxes: List[dict]) -> Tuple[Optional[List[dict]], float]:
+        if source is None or target is None:
+            return None, 0.0
+        if source.shape != target.shape:
+            target = cv2.resize(target, (source.shape[1], source.shape[0]), interpolation=cv2.INTER_AREA)
+        confidence = _frame_similarity(source, target)
+        moved = []
+        for box in boxes:
+            new_box, score = track_box(source, target, box)
+            if new_box is None:
+                return None, 0.0
+            moved.append(new_box)
+            confidence = min(confidence, score)
+        return moved, confidence
+
+
+def propagate_labels(job_dir: str, examples: Dict[str, List[dict]], targets: List[str],
+                     min_confidence: Optional[float] = None) -> Tuple[Dict[str, dict], List[str]]:
+    return LabelPropagator(min_confidence=min_confidence).propagate(job_dir, examples, targets)
@@ -0,0 +1,210 @@
+import os
+import json
+import base64
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import cv2
+
+from src.config import Config
+from src.services.rate_limiter import get_rate_limiter
+
+logger = logging.getLogger(__name__)
+
+SYSTEM_PROMPT = """You are an expert vision assistant. Your task is to detect and label objects in images based on provided examples.
+Output ONLY a JSON list of bounding boxes for the target image.
+Format: [{"label": "class_name", "x": 0, "y": 0, "w": 0, "h": 0}, ...]
+Coordinates (x, y, w, h) should be normalized to 0-1000 scale.
+If no objects are found, output []."""
+
+DETECT_PROMPT = "Detect objects in this image:"
+
+
+def encode_frame(path: str, max_side: int, quality: int) -> Optional[str]:
+    """JPEG en base64 reducido a `max_side` (las cajas van en 0-1000, no dependen del tamaño)."""
+    image = cv2.imread(path)
+    if image is None:
+        return None
+    height, width = image.shape[:2]
+    scale = max_side / max(height, width)
+    if scale < 1:
+        image = cv2.resize(image, (max(1, round(width * scale)), max(1, round(height * scale))), interpolation=cv2.INTER_AREA)
+    ok, buffer = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        return None
+    return base64.b64encode(buffer.tobytes()).decode("utf-8")
+
+
+def _image_part(b64: str) -> dict:
+    return {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{b64}"}}
+
+
+class FewShotContext:
+    """
+    Mensajes de sistema + ejemplos de un job, armados una sola vez.
+    Los ejemplos se ordenan por frame para que el prefijo sea idéntico en cada
+    petición (y el proveedor pueda reutilizarlo con su caché de prompts).
+    """
+
+    def __init__(self, job_dir: str, examples: List[dict]):
+        self.messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+        for example in sorted(examples, key=lambda e: e["frame"]):
+            frame_path = os.path.join(job_dir, os.path.basename(example["frame"]))
+            if not os.path.exists(frame_path):
+                continue  # Skip missing files
+            b64 = encode_frame(frame_path, Config.LABELING_EXAMPLE_MAX_SIDE, Config.LABELING_JPEG_QUALITY)
+            if b64 is None:
+                continue
+            self.messages.append({"role": "user", "content": [{"type": "text", "text": DETECT_PROMPT}, _image_part(b64)]})
+            self.messages.append({"role": "assistant", "content": json.dumps(example["boxes"])})
+        self.size = len(json.dumps(self.messages))
+        self.cache_key = hashlib.sha1(json.dumps(self.messages).encode()).hexdigest()[:16]
+
+
+_contexts = OrderedDict()
+_CONTEXT_CACHE_SIZE = 8
+
+
+def get_fewshot_context(job_dir: str, examples: List[dict]) -> FewShotContext:
+    """Contexto cacheado por job y conjunto de ejemplos (cambia si se edita una etiqueta)."""
+    key = (job_dir, hashlib.sha1(json.dumps(sorted(examples, key=lambda e: e["frame"]), sort_keys=True).encode()).hexdigest())
+    if key in _contexts:
+        _contexts.move_to_end(key)
+        return _contexts[key]
+    context = FewShotContext(job_dir, examples)
+    _contexts[key] = context
+    if len(_contexts) > _CONTEXT_CACHE_SIZE:
+        _contexts.popitem(last=False)
+    return context
+
+
+def parse_boxes(content: str) -> list:
+    # Some models might wrap list in a key
+    parsed = json.loads(content)
+    if isinstance(parsed, dict):
+        if "boxes" in parsed and isinstance(parsed["boxes"], list):
+            return parsed["boxes"]
+        # Fallback: look for any list
+        for v in parsed.values():
+            if isinstance(v, list):
+                return v
+        return []
+    return parsed if isinstance(parsed, list) else []
+
+
+class LabelingPredictor:
+    """
+    Predice cajas para los frames de un job con el modelo remoto.
+    Reutiliza el contexto few-shot, reduce las imágenes y, si el proveedor
+    acepta varias imágenes, agrupa varios frames objetivo por petición
+    (los que no vengan en la respuesta se piden de a uno).
+    `stats` acumula bytes enviados y tokens facturados.
+    """
+
+    def __init__(self, client, provider: Optional[str] = None, model: Optional[str] = None):
+        self.client = client
+        self.provider = provider or Config.ASSISTANT_CONFIG.get("provider", "default")
+        self.model = model or Config.ASSISTANT_CONFIG.get("model", "gemini-2.0-flash")
+        self.features = Config.LABELING_PROVIDER_FEATURES.get(self.provider, {})
+        self.limiter = get_rate_limiter(self.provider)
+        self.stats = {"requests": 0, "bytes_uploaded": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0}
+
+    async def _complete(self, context: FewShotContext, messages: list, max_tokens: int = 1000) -> str:
+        extra = {}
+        if self.features.get("prompt_cache_key"):
+            # Provider-side prompt caching: same key for every request sharing the few-shot prefix
+            extra["extra_body"] = {"prompt_cache_key": context.cache_key}
+        response = await self.limiter.call(lambda: self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            max_tokens=max_tokens,
+            response_format={"type": "json_object"},
+            **extra
+        ))
+        self.stats["requests"] += 1
+        self.stats["bytes_uploaded"] += context.size + len(json.dumps(messages[len(context.messages):]))
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            self.stats["prompt_tokens"] += getattr(usage, "prompt_tokens", 0) or 0
+            self.stats["completion_tokens"] += getattr(usage, "completion_tokens", 0) or 0
+            details = getattr(usage, "prompt_tokens_details", None)
+            self.stats["cached_tokens"] += getattr(details, "cached_tokens", 0) or 0
+        return response.choices[0].message.content.strip()
+
+    async def _encode_target(self, job_dir: str, target: str) -> Optional[str]:
+        target_path = os.path.join(job_dir, os.path.basename(target))
+        if not os.path.exists(target_path):
+            return None
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            None, encode_frame, target_path, Config.LABELING_TARGET_MAX_SIDE, Config.LABELING_JPEG_QUALITY
+        )
+
+    async def predict_single(self, context: FewShotContext, job_dir: str, target: str) -> Optional[dict]:
+        b64 = await self._encode_target(job_dir, target)
+        if b64 is None:
+            return None
+        messages = context.messages + [{"role": "user", "content": [{"type": "text", "text": DETECT_PROMPT}, _image_part(b64)]}]
+        try:
+            content = await self._complete(context, messages)
+            logger.info(f"AI Response for {target}: {content}")
+            try:
+                boxes = parse_boxes(content)
+            except ValueError:
+                logger.warning(f"Failed to parse prediction for {target}: {content}")
+                boxes = []
+            return {"frame": target, "boxes": boxes}
+        except Exception as e:
+            logger.error(f"Error predicting {target}: {e}")
+            return {"frame": target, "boxes": []}
+
+    async def predict_group(self, context: FewShotContext, job_dir: str, targets: List[str]) -> List[dict]:
+        """Varios frames en una petición; respuesta {"1": [...], "2": [...]}."""
+        if len(targets) == 1:
+            result = await self.predict_single(context, job_dir, targets[0])
+            return [result] if result else []
+
+        encoded = [(t, await self._encode_target(job_dir, t)) for t in targets]
+        encoded = [(t, b64) for t, b64 in encoded if b64 is not None]
+        content = [{"type": "text", "text": (
+            f"Detect objects in each of these {len(encoded)} images. Answer with a JSON object that maps "
+            "each image number to its list of boxes, e.g. {\"1\": [...], \"2\": []}."
+        )}]
+        for i, (_, b64) in enumerate(encoded):
+            content += [{"type": "text", "text": f"Image {i + 1}:"}, _image_part(b64)]
+
+        answers = {}
+        try:
+            raw = await self._complete(
+                context, context.messages + [{"role": "user", "content": content}], max_tokens=1000 * len(encoded)
+            )
+            logger.info(f"AI Response for {len(encoded)} packed frames: {raw}")
+            parsed = json.loads(raw)
+            if isinstance(parsed, dict):
+                for key, boxes in parsed.items():
+                    if str(key).strip().isdigit() and isinstance(boxes, list):
+                        answers[int(key) - 1] = boxes
+        except Exception as e:
+            logger.warning(f"Packed prediction failed, falling back to one frame per request: {e}")
+
+        results = [{"frame": t, "boxes": answers[i]} for i, (t, _) in enumerate(encoded) if i in answers]
+        missing = [t for i, (t, _) in enumerate(encoded) if i not in answers]
+        if missing:
+            singles = await asyncio.gather(*[self.predict_single(context, job_dir, t) for t in missing])
+            results += [r for r in singles if r]
+        return results
+
+    def groups(self, targets: List[str]) -> List[List[str]]:
+        size = max(1, self.features.get("targets_per_request", 1))
+        return [targets[i:i + size] for i in range(0, len(targets), size)]
+
+    def summary(self, predicted_frames: int) -> Dict[str, float]:
+        """Totales más promedios por frame predicho por el modelo."""
+        summary = dict(self.stats)
+        if predicted_frames:
+            summary["bytes_per_frame"] = round(self.stats["bytes_uploaded"] / predicted_frames, 1)
+            summary["prompt_tokens_per_frame"] = round(self.stats["prompt_tokens"] / predicted_frames, 1)
+        return summary
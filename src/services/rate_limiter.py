@@ -0,0 +1,124 @@
+import time
+import random
+import asyncio
+import logging
+from typing import Awaitable, Callable, Optional
+
+from src.config import Config
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket por proveedor que se adapta a las respuestas (AIMD):
+    cada éxito rápido sube la tasa un poco, un 429 la reduce a la mitad y
+    pausa el bucket (Retry-After si viene), y las respuestas lentas la bajan
+    suavemente. Además limita cuántas peticiones hay en vuelo.
+    """
+
+    def __init__(self, rate: float, burst: int, min_rate: float, max_rate: float, max_concurrency: int,
+                 target_latency: float):
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.target_latency = target_latency
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+        self._concurrency = asyncio.Semaphore(max_concurrency)
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        """Espera un token (respetando pausas por 429)."""
+        while True:
+            async with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                wait = max(0.0, self._paused_until - now)
+                if not wait and self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                if not wait:
+                    wait = (1 - self._tokens) / self.rate
+            await asyncio.sleep(wait)
+
+    def on_success(self, latency: float):
+        if latency > self.target_latency:
+            self.rate = max(self.min_rate, self.rate * 0.9)
+        else:
+            self.rate = min(self.max_rate, self.rate + 0.1)
+
+    def on_rate_limited(self, retry_after: Optional[float] = None):
+        self.rate = max(self.min_rate, self.rate / 2)
+        pause = retry_after if retry_after is not None else 1.0 / self.rate
+        self._paused_until = max(self._paused_until, time.monotonic() + pause)
+        self._tokens = 0.0
+        logger.warning(f"Rate limited, slowing down to {self.rate:.2f} req/s (pause {pause:.1f}s)")
+
+    async def call(self, fn: Callable[[], Awaitable], max_retries: Optional[int] = None, base_delay: Optional[float] = None):
+        """
+        Ejecuta `fn()` (una corrutina nueva por intento) con el limitador y
+        reintentos con backoff exponencial y jitter completo en errores transitorios.
+        """
+        max_retries = Config.API_MAX_RETRIES if max_retries is None else max_retries
+        base_delay = base_delay or Config.API_RETRY_BASE_DELAY
+        for attempt in range(max_retries + 1):
+            await self.acquire()
+            async with self._concurrency:
+                start = time.monotonic()
+                try:
+                    result = await fn()
+                except Exception as e:
+                    status = getattr(e, "status_code", None)
+                    retryable = status in RETRYABLE_STATUS or _is_transient(e)
+                    if status == 429:
+                        self.on_rate_limited(_retry_after(e))
+                    if not retryable or attempt == max_retries:
+                        raise
+                    delay = random.uniform(0, base_delay * (2 ** attempt))
+                    logger.info(f"Retrying after error ({status or type(e).__name__}), attempt {attempt + 1} in {delay:.2f}s")
+                else:
+                    self.on_success(time.monotonic() - start)
+                    return result
+            await asyncio.sleep(delay)
+
+
+def _is_transient(error: Exception) -> bool:
+    # Timeouts y errores de conexión del cliente (openai/httpx) o de asyncio
+    name = type(error).__name__
+    return isinstance(error, (asyncio.TimeoutError, ConnectionError)) or name in ("APITimeoutError", "APIConnectionError")
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+_limiters = {}
+
+
+def get_rate_limiter(provider: Optional[str] = None) -> AdaptiveRateLimiter:
+    """Un limitador por proveedor (gemini, openai, kilo...), compartido por todas las peticiones."""
+    provider = provider or Config.ASSISTANT_CONFIG.get("provider", "default")
+    if provider not in _limiters:
+        _limiters[provider] = AdaptiveRateLimiter(
+            rate=Config.API_RATE_LIMIT,
+            burst=Config.API_RATE_BURST,
+            min_rate=Config.API_RATE_MIN,
+            max_rate=Config.API_RATE_MAX,
+            max_concurrency=Config.API_MAX_CONCURRENCY,
+            target_latency=Config.API_TARGET_LATENCY,
+        )
+    return _limiters[provider]
@@ -0,0 +1,169 @@
+import os
+import json
+import sqlite3
+import logging
+from contextlib import contextmanager
+from datetime import datetime
+from typing import List, Optional
+
+from src.config import Config
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    suite_id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    status TEXT NOT NULL,
+    config_count INTEGER NOT NULL DEFAULT 0,
+    passed INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS run_models (
+    suite_id TEXT NOT NULL REFERENCES runs(suite_id) ON DELETE CASCADE,
+    model TEXT NOT NULL,
+    PRIMARY KEY (suite_id, model)
+);
+CREATE INDEX IF NOT EXISTS idx_runs_created ON runs(created_at);
+CREATE INDEX IF NOT EXISTS idx_run_models_model ON run_models(model);
+"""
+
+
+def parse_suite_id(suite_id: str):
+    """'20250101_120000_My_Suite' -> (ISO timestamp, 'My_Suite')."""
+    parts = suite_id.split("_")
+    try:
+        created_at = datetime.strptime("_".join(parts[:2]), "%Y%m%d_%H%M%S").isoformat()
+    except ValueError:
+        created_at = ""
+    return created_at, "_".join(parts[2:])
+
+
+class RunCatalog:
+    """
+    Catálogo liviano de las suites de grounding: solo metadatos (nombre, fecha,
+    modelos, conteos) para listar sin abrir cada summary.json.
+    Los detalles completos siguen en runs/<suite_id>/.
+    """
+
+    def __init__(self, db_path: Optional[str] = None, runs_dir: str = "runs"):
+        self.db_path = db_path or Config.RUN_CATALOG_PATH
+        self.runs_dir = runs_dir
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            empty = conn.execute("SELECT COUNT(*) FROM runs").fetchone()[0] == 0
+        if empty:
+            self.sync_from_disk()
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA foreign_keys=ON")
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def add_run(self, suite_id: str, suite_config: dict, models: List[str]):
+        """Registra una suite recién creada (status 'running')."""
+        created_at, name = parse_suite_id(suite_id)
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO runs (suite_id, name, created_at, status, config_count) VALUES (?, ?, ?, 'running', ?)",
+                (suite_id, suite_config.get("suite_name") or name, created_at, len(suite_config.get("configs", [])))
+            )
+            conn.executemany(
+                "INSERT OR IGNORE INTO run_models (suite_id, model) VALUES (?, ?)",
+                [(suite_id, model) for model in set(models)]
+            )
+
+    def finish_run(self, suite_id: str, results: List[dict], status: str = "completed"):
+        """Actualiza conteos y estado cuando execute_suite termina."""
+        passed = sum(1 for r in results if r.get("status") == "success")
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE runs SET status = ?, passed = ?, failed = ? WHERE suite_id = ?",
+                (status, passed, len(results) - passed, suite_id)
+            )
+            conn.executemany(
+                "INSERT OR IGNORE INTO run_models (suite_id, model) VALUES (?, ?)",
+                [(suite_id, r["model"]) for r in results if r.get("model")]
+            )
+
+    def sync_from_disk(self):
+        """Indexa una vez las suites que ya existían en runs/ (anteriores al catálogo)."""
+        if not os.path.isdir(self.runs_dir):
+            return
+        count = 0
+        for suite_id in os.listdir(self.runs_dir):
+            suite_path = os.path.join(self.runs_dir, suite_id)
+            summary_path = os.path.join(suite_path, "summary.json")
+            if not os.path.isdir(suite_path) or not os.path.exists(summary_path):
+                continue
+            try:
+                with open(summary_path, "r") as f:
+                    summary = json.load(f)
+                suite_config = {}
+                config_path = os.path.join(suite_path, "suite_config.json")
+                if os.path.exists(config_path):
+                    with open(config_path, "r") as f:
+                        suite_config = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Skipping unreadable run {suite_id}: {e}")
+                continue
+            suite_config.setdefault("configs", summary)
+            self.add_run(suite_id, suite_config, [])
+            self.finish_run(suite_id, summary)
+            count += 1
+        if count:
+            logger.info(f"Indexed {count} existing grounding runs")
+
+    def list_runs(self, limit: int = 50, offset: int = 0, name: Optional[str] = None, model: Optional[str] = None,
+                  date_from: Optional[str] = None, date_to: Optional[str] = None) -> dict:
+        """Suites más recientes primero. Fechas en ISO (YYYY-MM-DD o con hora)."""
+        clauses, params = [], []
+        if name:
+            clauses.append("r.name LIKE ?")
+            params.append(f"%{name}%")
+        if model:
+            clauses.append("r.suite_id IN (SELECT suite_id FROM run_models WHERE model LIKE ?)")
+            params.append(f"%{model}%")
+        if date_from:
+            clauses.append("r.created_at >= ?")
+            params.append(date_from)
+        if date_to:
+            # Una fecha sin hora incluye todo ese día
+            clauses.append("r.created_at <= ?")
+            params.append(date_to if "T" in date_to else f"{date_to}T23:59:59")
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self._connect() as conn:
+            total = conn.execute(f"SELECT COUNT(*) FROM runs r {where}", params).fetchone()[0]
+            rows = conn.execute(
+                f"SELECT r.*, (SELECT GROUP_CONCAT(model) FROM run_models m WHERE m.suite_id = r.suite_id) AS models "
+                f"FROM runs r {where} ORDER BY r.created_at DESC, r.suite_id DESC LIMIT ? OFFSET ?",
+                params + [limit, offset]
+            ).fetchall()
+        items = []
+        for row in rows:
+            item = dict(row)
+            item["models"] = sorted(item["models"].split(",")) if item["models"] else []
+            items.append(item)
+        return {"total": total, "limit": limit, "offset": offset, "items": items}
+
+
+_run_catalog = None
+
+
+def get_run_catalog() -> RunCatalog:
+    global _run_catalog
+    if _run_catalog is None:
+        _run_catalog = RunCatalog()
+    return _run_catalog
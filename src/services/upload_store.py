@@ -0,0 +1,222 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import asyncio
+import logging
+from typing import AsyncIterator, Optional
+
+from src.config import Config
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 4 * 1024 * 1024
+VIDEO_EXTENSIONS = {".mp4", ".mov", ".avi", ".mkv", ".webm"}
+
+
+class UploadError(Exception):
+    """Error de protocolo en una subida (offset inválido, sesión inexistente...)."""
+
+    def __init__(self, message: str, status_code: int = 400, received: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.received = received
+
+
+class UploadStore:
+    """
+    Almacén de uploads direccionado por contenido.
+    Los archivos se guardan como <sha256><ext> en el directorio de uploads, por lo
+    que subir dos veces el mismo video no duplica ni el archivo ni su índice.
+    Soporta subidas en chunks reanudables: el estado de cada sesión vive en
+    <partial_dir>/<upload_id>.json y los bytes recibidos en <partial_dir>/<upload_id>.part.
+    partial_dir queda fuera de upload_dir para que el montaje estático nunca sirva
+    subidas a medias; las sesiones sin actividad por más de session_ttl se descartan.
+    """
+
+    def __init__(self, upload_dir: str = "uploads", partial_dir: Optional[str] = None,
+                 session_ttl: Optional[float] = None):
+        self.upload_dir = upload_dir
+        self.partial_dir = partial_dir or Config.UPLOAD_PARTIAL_DIR
+        self.session_ttl = session_ttl or Config.UPLOAD_SESSION_TTL
+        os.makedirs(self.upload_dir, exist_ok=True)
+        os.makedirs(self.partial_dir, exist_ok=True)
+        self._hashers = {}  # upload_id -> sha256 incremental de los bytes recibidos
+        self._locks = {}
+        self._discard_legacy_partials()
+        self.expire_sessions()
+
+    # --- Helpers ---
+
+    def _meta_path(self, upload_id: str) -> str:
+        return os.path.join(self.partial_dir, f"{upload_id}.json")
+
+    def _part_path(self, upload_id: str) -> str:
+        return os.path.join(self.partial_dir, f"{upload_id}.part")
+
+    def _write_meta(self, meta: dict):
+        with open(self._meta_path(meta["upload_id"]), "w") as f:
+            json.dump(meta, f)
+
+    def _lock(self, upload_id: str) -> asyncio.Lock:
+        return self._locks.setdefault(upload_id, asyncio.Lock())
+
+    def _discard_legacy_partials(self):
+        # Versiones anteriores guardaban las sesiones dentro de uploads/, donde se servían
+        legacy_dir = os.path.join(self.upload_dir, ".partial")
+        if os.path.isdir(legacy_dir) and os.path.abspath(legacy_dir) != os.path.abspath(self.partial_dir):
+            shutil.rmtree(legacy_dir, ignore_errors=True)
+            logger.info(f"Removed legacy partial uploads in {legacy_dir}")
+
+    def expire_sessions(self) -> int:
+        """Borra sesiones (y .part huérfanos de store_stream) sin escrituras en session_ttl. Retorna cuántas."""
+        cutoff = time.time() - self.session_ttl
+        expired = set()
+        for name in os.listdir(self.partial_dir):
+            upload_id, ext = os.path.splitext(name)
+            lock = self._locks.get(upload_id)
+            if ext not in (".json", ".part") or (lock is not None and lock.locked()):
+                continue
+            # La actividad de una sesión es el último chunk escrito en su .part
+            part_path = self._part_path(upload_id)
+            path = part_path if os.path.exists(part_path) else os.path.join(self.partial_dir, name)
+            if os.path.getmtime(path) < cutoff:
+                expired.add(upload_id)
+        for upload_id in expired:
+            for path in (self._meta_path(upload_id), self._part_path(upload_id)):
+                if os.path.exists(path):
+                    os.remove(path)
+            self._hashers.pop(upload_id, None)
+            self._locks.pop(upload_id, None)
+        if expired:
+            logger.info(f"Expired {len(expired)} stale upload session(s)")
+        return len(expired)
+
+    @staticmethod
+    def _rehash(path: str):
+        hasher = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(CHUNK_SIZE), b""):
+                hasher.update(block)
+        return hasher
+
+    def stored_name(self, sha256: str, filename: str) -> str:
+        ext = os.path.splitext(filename)[1].lower()
+        return f"{sha256}{ext}"
+
+    def is_video(self, filename: str) -> bool:
+        return os.path.splitext(filename)[1].lower() in VIDEO_EXTENSIONS
+
+    def _commit(self, part_path: str, sha256: str, original_filename: str) -> dict:
+        """Mueve el archivo temporal al almacén (o lo descarta si ya existía)."""
+        name = self.stored_name(sha256, original_filename)
+        final_path = os.path.join(self.upload_dir, name)
+        deduplicated = os.path.exists(final_path)
+        if deduplicated:
+            os.remove(part_path)
+        else:
+            # partial_dir puede estar en otro sistema de archivos que upload_dir
+            shutil.move(part_path, final_path)
+        logger.info(f"Stored upload {original_filename} as {name} (deduplicated={deduplicated})")
+        return {
+            "filename": name,
+            "original_filename": original_filename,
+            "sha256": sha256,
+            "deduplicated": deduplicated,
+            "path": final_path,
+            "url": f"/uploads/{name}"
+        }
+
+    # --- Single-request uploads ---
+
+    async def store_stream(self, filename: str, chunks: AsyncIterator[bytes]) -> dict:
+        """
+        Guarda un stream completo: escritura a disco fuera del event loop y hash
+        calculado mientras llegan los bytes.
+        """
+        loop = asyncio.get_event_loop()
+        part_path = self._part_path(uuid.uuid4().hex)
+        hasher = hashlib.sha256()
+        f = await loop.run_in_executor(None, open, part_path, "wb")
+        try:
+            async for chunk in chunks:
+                hasher.update(chunk)
+                await loop.run_in_executor(None, f.write, chunk)
+        except Exception:
+            f.close()
+            os.remove(part_path)
+            raise
+        await loop.run_in_executor(None, f.close)
+        return await loop.run_in_executor(None, self._commit, part_path, hasher.hexdigest(), filename)
+
+    # --- Resumable sessions ---
+
+    def create_session(self, filename: str, size: Optional[int] = None) -> dict:
+        self.expire_sessions()
+        upload_id = uuid.uuid4().hex
+        meta = {"upload_id": upload_id, "filename": os.path.basename(filename), "size": size, "received": 0}
+        open(self._part_path(upload_id), "wb").close()
+        self._write_meta(meta)
+        self._hashers[upload_id] = hashlib.sha256()
+        return {**meta, "chunk_size": CHUNK_SIZE}
+
+    def get_session(self, upload_id: str) -> dict:
+        meta_path = self._meta_path(upload_id)
+        if not os.path.exists(meta_path):
+            raise UploadError("Upload session not found", status_code=404)
+        with open(meta_path, "r") as f:
+            meta = json.load(f)
+        # La verdad es lo que hay en disco (un chunk pudo quedar a medias)
+        meta["received"] = os.path.getsize(self._part_path(upload_id))
+        return {**meta, "chunk_size": CHUNK_SIZE}
+
+    async def write_chunk(self, upload_id: str, offset: int, chunks: AsyncIterator[bytes]) -> dict:
+        async with self._lock(upload_id):
+            loop = asyncio.get_event_loop()
+            meta = await loop.run_in_executor(None, self.get_session, upload_id)
+            if offset != meta["received"]:
+                raise UploadError("Offset mismatch", status_code=409, received=meta["received"])
+
+            hasher = self._hashers.get(upload_id)
+            if hasher is None:
+                # Reanudación tras reinicio del servidor: recalcular el hash parcial
+                hasher = await loop.run_in_executor(None, self._rehash, self._part_path(upload_id))
+                self._hashers[upload_id] = hasher
+
+            received = meta["received"]
+            f = await loop.run_in_executor(None, open, self._part_path(upload_id), "ab")
+            try:
+                async for chunk in chunks:
+                    if meta["size"] is not None and received + len(chunk) > meta["size"]:
+                        raise UploadError("Chunk exceeds declared size", received=received)
+                    await loop.run_in_executor(None, f.write, chunk)
+                    hasher.update(chunk)
+                    received += len(chunk)
+            except Exception:
+                # El hash ya no coincide con el archivo: se recalcula en el próximo chunk
+                self._hashers.pop(upload_id, None)
+                raise
+            finally:
+                await loop.run_in_executor(None, f.close)
+
+            meta["received"] = received
+            await loop.run_in_executor(None, self._write_meta, {k: v for k, v in meta.items() if k != "chunk_size"})
+            return meta
+
+    async def complete(self, upload_id: str) -> dict:
+        async with self._lock(upload_id):
+            loop = asyncio.get_event_loop()
+            meta = await loop.run_in_executor(None, self.get_session, upload_id)
+            if meta["size"] is not None and meta["received"] != meta["size"]:
+                raise UploadError("Upload incomplete", status_code=409, received=meta["received"])
+
+            hasher = self._hashers.pop(upload_id, None)
+            if hasher is None:
+                hasher = await loop.run_in_executor(None, self._rehash, self._part_path(upload_id))
+
+            result = await loop.run_in_executor(None, self._commit, self._part_path(upload_id), hasher.hexdigest(), meta["filename"])
+            os.remove(self._meta_path(upload_id))
+        self._locks.pop(upload_id, None)
+        return result
@@ -0,0 +1,123 @@
+import os
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from PIL import Image, ImageDraw
+
+from src.config import Config
+from src.utils.geometry import bbox_to_pixels
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {"png": "PNG", "webp": "WEBP", "jpeg": "JPEG", "jpg": "JPEG"}
+META_FILE = "render.json"
+
+
+def draw_actions(image, actions, width, height):
+    """Dibuja cajas, centros y arrastres sobre `image` (coordenadas 0-1000 o absolutas)."""
+    draw = ImageDraw.Draw(image)
+    for i, step in enumerate(actions):
+        bbox = step.get("bbox") or step.get("start_bbox")
+        if bbox:
+            x1, y1, x2, y2 = bbox_to_pixels(bbox, width, height)
+
+            # Draw Start
+            draw.rectangle([x1, y1, x2, y2], outline="red", width=3)
+            cx, cy = (x1 + x2) // 2, (y1 + y2) // 2
+            draw.ellipse((cx - 10, cy - 10, cx + 10, cy + 10), fill='blue', outline='white')
+
+            action_type = step.get("action", "action").upper()
+            draw.text((x1, y1 - 15), f"{i+1}: {action_type}", fill='red')
+
+            # Draw End (Drag)
+            if "end_bbox" in step:
+                ex1, ey1, ex2, ey2 = bbox_to_pixels(step["end_bbox"], width, height)
+
+                ecx, ecy = (ex1 + ex2) // 2, (ey1 + ey2) // 2
+                draw.rectangle([ex1, ey1, ex2, ey2], outline="green", width=3)
+                draw.ellipse((ecx - 10, ecy - 10, ecx + 10, ecy + 10), fill='green', outline='white')
+                draw.line([(cx, cy), (ecx, ecy)], fill="yellow", width=3)
+                draw.text((ex1, ey1 - 15), "DROP", fill='green')
+    return image
+
+
+def save_render_source(run_dir: str, image_path: str, actions: list):
+    """Guarda lo necesario para renderizar más tarde: imagen de origen y acciones."""
+    with open(os.path.join(run_dir, META_FILE), "w") as f:
+        json.dump({"image_path": os.path.abspath(image_path), "actions": actions}, f)
+
+
+def render_filename(fmt: str = "png", width: Optional[int] = None) -> str:
+    ext = "jpg" if fmt in ("jpeg", "jpg") else fmt
+    return f"result.{ext}" if not width else f"preview_{width}.{ext}"
+
+
+class ResultRenderer:
+    """
+    Renderiza las visualizaciones de grounding fuera del camino de inferencia:
+    en un pool de hilos después de cada config o bajo demanda la primera vez
+    que se piden. Cada variante (formato/ancho) se guarda en el run_dir y se
+    reutiliza; pedidos concurrentes de la misma variante comparten el trabajo.
+    """
+
+    def __init__(self, workers: Optional[int] = None):
+        self._pool = ThreadPoolExecutor(max_workers=workers or Config.VISUALIZATION_WORKERS, thread_name_prefix="render")
+        self._lock = threading.RLock()
+        self._inflight = {}
+
+    def _render(self, run_dir: str, fmt: str, width: Optional[int]) -> str:
+        output_path = os.path.join(run_dir, render_filename(fmt, width))
+        if os.path.exists(output_path):
+            return output_path
+
+        with open(os.path.join(run_dir, META_FILE), "r") as f:
+            meta = json.load(f)
+        with Image.open(meta["image_path"]) as source:
+            image = source.convert("RGB")
+        origin_width, origin_height = image.size
+        draw_actions(image, meta["actions"], origin_width, origin_height)
+
+        if width and width < origin_width:
+            image = image.resize((width, max(1, round(origin_height * width / origin_width))), Image.LANCZOS)
+
+        tmp_path = output_path + ".tmp"
+        save_args = {} if fmt == "png" else {"quality": Config.VISUALIZATION_QUALITY}
+        image.save(tmp_path, format=FORMATS[fmt], **save_args)
+        os.replace(tmp_path, output_path)
+        return output_path
+
+    def submit(self, run_dir: str, fmt: str = "png", width: Optional[int] = None):
+        """Programa el render (o devuelve el que ya está en curso). Retorna un Future."""
+        if fmt not in FORMATS:
+            raise ValueError(f"Unsupported format: {fmt}")
+        key = (run_dir, fmt, width)
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is None:
+                future = self._pool.submit(self._render, run_dir, fmt, width)
+                self._inflight[key] = future
+                future.add_done_callback(lambda _: self._forget(key))
+        return future
+
+    def _forget(self, key):
+        with self._lock:
+            self._inflight.pop(key, None)
+
+    def get(self, run_dir: str, fmt: str = "png", width: Optional[int] = None) -> str:
+        """Ruta del render, generándolo si todavía no existe (bloqueante)."""
+        path = os.path.join(run_dir, render_filename(fmt, width))
+        if os.path.exists(path):
+            return path
+        return self.submit(run_dir, fmt, width).result()
+
+
+_renderer = None
+
+
+def get_renderer() -> ResultRenderer:
+    global _renderer
+    if _renderer is None:
+        _renderer = ResultRenderer()
+    return _renderer
@@ -0,0 +1,32 @@
+import threading
+
+
+class OperationCancelled(Exception):
+    """La operación fue cancelada (cliente desconectado, job cancelado...)."""
+
+
+class CancellationToken:
+    """
+    Bandera thread-safe que se pasa a través del pipeline. El código de larga
+    duración la consulta en sus checkpoints (entre segmentos, en cada token generado).
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise OperationCancelled()
+
+
+def raise_if_cancelled(token):
+    """Atajo para parámetros opcionales: no hace nada si token es None."""
+    if token is not None:
+        token.raise_if_cancelled()
@@ -0,0 +1,77 @@
+def is_normalized(coords) -> bool:
+    """Los modelos de grounding suelen responder en escala 0-1000."""
+    return all(isinstance(c, (int, float)) and c <= 1000 for c in coords)
+
+
+def bbox_to_pixels(bbox, width, height):
+    """[x1, y1, x2, y2] en 0-1000 o absolutas -> píxeles de la imagen."""
+    if is_normalized(bbox):
+        return [
+            int(bbox[0] / 1000 * width),
+            int(bbox[1] / 1000 * height),
+            int(bbox[2] / 1000 * width),
+            int(bbox[3] / 1000 * height),
+        ]
+    return [int(c) for c in bbox[:4]] # Assume absolute if > 1000
+
+
+def point_to_pixels(point, width, height):
+    if is_normalized(point):
+        return [int(point[0] / 1000 * width), int(point[1] / 1000 * height)]
+    return [int(point[0]), int(point[1])]
+
+
+def bbox_center(bbox):
+    return [(bbox[0] + bbox[2]) / 2, (bbox[1] + bbox[3]) / 2]
+
+
+def point_in_bbox(point, bbox) -> bool:
+    return bbox[0] <= point[0] <= bbox[2] and bbox[1] <= point[1] <= bbox[3]
+
+
+def bbox_iou(a, b) -> float:
+    ix1, iy1 = max(a[0], b[0]), max(a[1], b[1])
+    ix2, iy2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0, ix2 - ix1) * max(0, iy2 - iy1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def bbox_to_normalized(bbox, width, height):
+    """Píxeles -> escala 0-1000 (con un decimal para no perder precisión en pantallas grandes)."""
+    return [
+        round(bbox[0] / width * 1000, 1),
+        round(bbox[1] / height * 1000, 1),
+        round(bbox[2] / width * 1000, 1),
+        round(bbox[3] / height * 1000, 1),
+    ]
+
+
+def union_bbox(boxes):
+    return [min(b[0] for b in boxes), min(b[1] for b in boxes), max(b[2] for b in boxes), max(b[3] for b in boxes)]
+
+
+def expand_bbox(bbox, width, height, margin: float = 0.0, min_fraction: float = 0.0):
+    """
+    Agranda `bbox` (píxeles) con un margen y un tamaño mínimo, ambos como fracción
+    del ancho/alto de la imagen, sin salirse de ella.
+    """
+    x1, y1, x2, y2 = bbox
+    x1, x2 = x1 - margin * width, x2 + margin * width
+    y1, y2 = y1 - margin * height, y2 + margin * height
+
+    def grow(lo, hi, size):
+        minimum = min(size, min_fraction * size)
+        if hi - lo < minimum:
+            center = (lo + hi) / 2
+            lo, hi = center - minimum / 2, center + minimum / 2
+        # Desplazar hacia adentro en lugar de recortar, para conservar el tamaño
+        if lo < 0:
+            lo, hi = 0, hi - lo
+        if hi > size:
+            lo, hi = max(0, lo - (hi - size)), size
+        return int(lo), int(round(hi))
+
+    x1, x2 = grow(x1, x2, width)
+    y1, y2 = grow(y1, y2, height)
+    return [x1, y1, x2, y2]
@@ -0,0 +1,98 @@
+import json
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+_decoder = json.JSONDecoder()
+_CLOSERS = {"[": "]", "{": "}"}
+_MAX_STARTS = 20
+
+
+def strip_code_fences(text: str) -> str:
+    """Quita los bloques ```json ... ``` que suelen envolver la respuesta."""
+    return re.sub(r"```(?:json)?", "", text or "").strip()
+
+
+def _salvage(text: str, start: int):
+    """
+    Recupera el prefijo más largo que forma JSON válido al cerrar los contenedores
+    abiertos. Solo se corta tras un elemento completo del array más externo (o un
+    miembro completo del objeto raíz): un evento truncado a medias se descarta
+    entero en vez de devolverse sin alguno de sus campos.
+    """
+    stack = []
+    in_string = False
+    escape = False
+    cuts = []  # (posición de corte, cierres pendientes)
+
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch in _CLOSERS:
+            stack.append(ch)
+        elif ch in "]}":
+            if not stack or _CLOSERS[stack[-1]] != ch:
+                break  # JSON inválido más allá de este punto
+            stack.pop()
+            if not stack:
+                break
+            # Profundidad de los elementos del array más externo (o de los miembros de la raíz)
+            item_depth = stack.index("[") + 1 if "[" in stack else 1
+            if len(stack) != item_depth:
+                continue
+            cuts.append((i + 1, "".join(_CLOSERS[c] for c in reversed(stack))))
+
+    for cut, closers in reversed(cuts):
+        try:
+            return json.loads(text[start:cut] + closers)
+        except ValueError:
+            continue
+    return None
+
+
+def recover_json(text: str, accept=None):
+    """
+    Parser tolerante para salidas de modelos.
+    - Ignora fences de markdown, prosa antes y después del JSON.
+    - Si la salida fue truncada, recupera los elementos completos.
+    `accept` permite descartar valores que no tienen la forma esperada.
+    Retorna (valor, completo); (None, False) si no se pudo recuperar nada.
+    """
+    text = strip_code_fences(text)
+    accept = accept or (lambda value: True)
+    starts = [m.start() for m in re.finditer(r"[\[{]", text)][:_MAX_STARTS]
+
+    for start in starts:
+        # 1. Un valor JSON completo (con posible texto alrededor)
+        try:
+            value, _ = _decoder.raw_decode(text, start)
+            if accept(value):
+                return value, True
+            continue
+        except ValueError:
+            pass
+
+        # 2. Salida truncada: rescatar lo que esté completo
+        value = _salvage(text, start)
+        if value is not None and accept(value):
+            logger.info("Recovered partial JSON from truncated model output")
+            return value, False
+
+    return None, False
+
+
+def is_action_payload(value) -> bool:
+    """Acepta un dict o un array de objetos (vacío o con al menos un objeto)."""
+    if isinstance(value, dict):
+        return True
+    return isinstance(value, list) and (not value or any(isinstance(item, dict) for item in value))
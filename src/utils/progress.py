@@ -0,0 +1,103 @@
+import asyncio
+import threading
+from collections import deque
+
+# Eventos en los que solo importa el más reciente (comparten un único lugar en la cola)
+REPLACEABLE_EVENTS = {"info", "status", "segment_start"}
+# Campos pesados de segment_complete que se omiten si el cliente va atrasado
+HEAVY_SEGMENT_FIELDS = ("raw_response", "parsed_events")
+
+
+class ProgressChannel:
+    """
+    Canal acotado entre el hilo de análisis (productor) y el websocket (consumidor).
+    Si el cliente va lento, los eventos pendientes se fusionan: cada `timeline_delta`
+    se concatena al que ya esté en cola, los eventos de estado ocupan un solo lugar
+    (queda el último) y los `segment_complete` pierden su respuesta cruda.
+    Si aun así se llena, put() bloquea al productor (backpressure) hasta que haya
+    espacio, el canal se cierre o se cancele el token.
+    """
+
+    def __init__(self, loop, maxsize: int = 32, cancel_token=None):
+        self._loop = loop
+        self.maxsize = maxsize
+        self._cancel_token = cancel_token
+        self._items = deque()
+        self._cond = threading.Condition()
+        self._ready = asyncio.Event()
+        self._closed = False
+
+    def _coalesce(self, event: dict) -> bool:
+        """Fusiona `event` con lo que ya está en cola. True si ya no hace falta encolarlo."""
+        if not self._items:
+            return False
+        kind = event.get("type")
+        if kind == "timeline_delta":
+            queued = next((item for item in self._items if item.get("type") == "timeline_delta"), None)
+            if queued is None:
+                return False
+            queued["events"] = queued["events"] + event["events"]
+            queued["segment_index"] = event["segment_index"]
+            queued["total_events"] = event["total_events"]
+            return True
+        if kind in REPLACEABLE_EVENTS:
+            # Se quita el estado anterior; el nuevo va al final de la cola
+            for item in self._items:
+                if item.get("type") in REPLACEABLE_EVENTS:
+                    self._items.remove(item)
+                    break
+            return False
+        return False
+
+    def _trim_segments(self, event: dict) -> dict:
+        """Con el cliente atrasado, los segment_complete (en cola y el nuevo) viajan sin la respuesta cruda."""
+        for i, item in enumerate(self._items):
+            if item.get("type") == "segment_complete":
+                self._items[i] = _trim_segment(item)
+        return _trim_segment(event) if event.get("type") == "segment_complete" else event
+
+    def _blocked(self) -> bool:
+        cancelled = self._cancel_token is not None and self._cancel_token.cancelled
+        return len(self._items) >= self.maxsize and not self._closed and not cancelled
+
+    def put(self, event: dict):
+        """Llamado desde el hilo productor."""
+        with self._cond:
+            if self._closed:
+                return
+            if self._items:
+                event = self._trim_segments(event)
+            if not self._coalesce(event):
+                while self._blocked():
+                    self._cond.wait(timeout=0.5)
+                if self._closed:
+                    return
+                self._items.append(event)
+        self._loop.call_soon_threadsafe(self._ready.set)
+
+    def close(self):
+        """Ya no habrá más eventos; get() devuelve None cuando se vacíe."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._loop.call_soon_threadsafe(self._ready.set)
+
+    async def get(self):
+        while True:
+            self._ready.clear()
+            with self._cond:
+                if self._items:
+                    event = self._items.popleft()
+                    self._cond.notify_all()
+                    return event
+                if self._closed:
+                    return None
+            await self._ready.wait()
+
+
+def _trim_segment(event: dict) -> dict:
+    result = event.get("result") or {}
+    if not any(field in result for field in HEAVY_SEGMENT_FIELDS):
+        return event
+    trimmed = {k: v for k, v in result.items() if k not in HEAVY_SEGMENT_FIELDS}
+    return {**event, "result": trimmed, "trimmed": True}
@@ -0,0 +1,62 @@
+import math
+
+from src.utils.geometry import bbox_iou
+
+
+def plan_tiles(width: int, height: int, tile_side: int, overlap: int = 0) -> list:
+    """
+    Regiones [x1, y1, x2, y2] que cubren la imagen con tiles de a lo sumo
+    `tile_side` (+ solapamiento) por lado. Una imagen que ya entra devuelve un solo tile.
+    """
+    cols = max(1, math.ceil(width / tile_side))
+    rows = max(1, math.ceil(height / tile_side))
+    tile_w = width if cols == 1 else min(width, math.ceil(width / cols) + overlap)
+    tile_h = height if rows == 1 else min(height, math.ceil(height / rows) + overlap)
+
+    def starts(count, tile, size):
+        if count == 1:
+            return [0]
+        # Repartir parejo para que el último tile termine justo en el borde
+        return [round(k * (size - tile) / (count - 1)) for k in range(count)]
+
+    return [
+        [x, y, x + tile_w, y + tile_h]
+        for y in starts(rows, tile_h, height)
+        for x in starts(cols, tile_w, width)
+    ]
+
+
+def _area(box) -> float:
+    return max(0, box[2] - box[0]) * max(0, box[3] - box[1])
+
+
+def _overlaps(a, b, iou_threshold: float, containment: float) -> bool:
+    if bbox_iou(a, b) >= iou_threshold:
+        return True
+    # Un tile puede ver solo parte del elemento: una caja casi contenida en otra es el mismo
+    ix1, iy1 = max(a[0], b[0]), max(a[1], b[1])
+    ix2, iy2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0, ix2 - ix1) * max(0, iy2 - iy1)
+    smaller = min(_area(a), _area(b))
+    return smaller > 0 and inter / smaller >= containment
+
+
+def dedupe_boxes(items: list, iou_threshold: float = 0.5, containment: float = 0.8, comparable=None) -> list:
+    """
+    items: [(box_en_píxeles, payload), ...] en coordenadas globales.
+    Elimina detecciones repetidas en la zona de solapamiento conservando la caja
+    más grande (la menos recortada por el borde del tile). Mantiene el orden.
+    `comparable(payload_a, payload_b)` limita qué pares pueden ser duplicados
+    (p. ej. solo acciones del mismo tipo de tiles distintos).
+    """
+    kept = []
+    for box, payload in items:
+        duplicate = next((
+            i for i, (other, other_payload) in enumerate(kept)
+            if (comparable is None or comparable(payload, other_payload)) and _overlaps(box, other, iou_threshold, containment)
+        ), None)
+        if duplicate is None:
+            kept.append((box, payload))
+        elif _area(box) > _area(kept[duplicate][0]):
+            kept[duplicate] = (box, payload)
+    return kept
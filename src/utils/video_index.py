@@ -0,0 +1,213 @@
+import os
+import json
+import bisect
+import logging
+import threading
+import cv2
+
+try:
+    import av
+except ImportError:  # PyAV es opcional: sin él no hay índice de keyframes
+    av = None
+
+logger = logging.getLogger(__name__)
+
+INDEX_VERSION = 1
+INDEX_SUFFIX = ".index.json"
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+class VideoIndex:
+    """
+    Metadatos de un video calculados una sola vez: duración, fps, número exacto
+    de frames y posiciones de los keyframes (frame, timestamp y offset en bytes).
+    """
+
+    def __init__(self, data: dict):
+        self.data = data
+        self.fps = float(data["fps"])
+        self.frame_count = int(data["frame_count"])
+        self.duration = float(data["duration"])
+        self.width = int(data.get("width", 0))
+        self.height = int(data.get("height", 0))
+        self.keyframes = [k["frame"] for k in data.get("keyframes", [])]
+
+    def frame_at(self, timestamp: float) -> int:
+        """Convierte un timestamp (segundos) al índice de frame, acotado al video."""
+        if self.frame_count <= 0:
+            return 0
+        frame_no = int(max(0.0, timestamp) * self.fps)
+        return min(frame_no, self.frame_count - 1)
+
+    def time_of(self, frame_no: int) -> float:
+        return frame_no / self.fps if self.fps else 0.0
+
+    def keyframe_before(self, frame_no: int) -> int:
+        """Keyframe más cercano en o antes de frame_no (0 si no hay índice)."""
+        if not self.keyframes:
+            return 0
+        pos = bisect.bisect_right(self.keyframes, frame_no) - 1
+        return self.keyframes[pos] if pos >= 0 else 0
+
+    def to_dict(self) -> dict:
+        return self.data
+
+
+def index_path_for(video_path: str) -> str:
+    return video_path + INDEX_SUFFIX
+
+
+def _source_stamp(video_path: str) -> dict:
+    st = os.stat(video_path)
+    return {"size": st.st_size, "mtime": st.st_mtime}
+
+
+def _probe_with_av(video_path: str) -> dict:
+    """
+    Recorre los paquetes del stream de video sin decodificar: cuenta exacta de
+    frames y keyframes con su pts y offset en bytes.
+    """
+    with av.open(video_path) as container:
+        stream = container.streams.video[0]
+        time_base = float(stream.time_base)
+        fps = float(stream.average_rate or stream.guessed_rate or 0) or 30.0
+        start_pts = stream.start_time or 0
+
+        frame_count = 0
+        last_end = 0.0
+        keyframe_packets = []
+        for packet in container.demux(stream):
+            if packet.size == 0 or packet.pts is None:
+                continue
+            frame_count += 1
+            pts_time = (packet.pts - start_pts) * time_base
+            end_time = pts_time + (packet.duration or 0) * time_base
+            last_end = max(last_end, end_time)
+            if packet.is_keyframe:
+                keyframe_packets.append((pts_time, packet.pos))
+
+        keyframes = [
+            {"frame": int(round(t * fps)), "time": round(t, 6), "pos": pos}
+            for t, pos in sorted(keyframe_packets, key=lambda k: k[0])
+        ]
+        return {
+            "fps": fps,
+            "frame_count": frame_count,
+            "duration": last_end if last_end > 0 else frame_count / fps,
+            "width": stream.codec_context.width,
+            "height": stream.codec_context.height,
+            "keyframes": keyframes,
+        }
+
+
+def _probe_with_cv2(video_path: str) -> dict:
+    """Fallback sin PyAV: cuenta frames con grab() (no confía en CAP_PROP_FRAME_COUNT)."""
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise ValueError(f"Could not open video: {video_path}")
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        frame_count = 0
+        while cap.grab():
+            frame_count += 1
+    finally:
+        cap.release()
+    return {
+        "fps": fps,
+        "frame_count": frame_count,
+        "duration": frame_count / fps,
+        "width": width,
+        "height": height,
+        "keyframes": [],
+    }
+
+
+def build_video_index(video_path: str) -> VideoIndex:
+    """Construye el índice del video y lo guarda como sidecar junto al archivo."""
+    if not os.path.exists(video_path):
+        raise FileNotFoundError(f"Video file not found: {video_path}")
+
+    data = None
+    if av is not None:
+        try:
+            data = _probe_with_av(video_path)
+        except Exception as e:
+            logger.warning(f"PyAV probe failed for {video_path}, falling back to OpenCV: {e}")
+    if data is None:
+        data = _probe_with_cv2(video_path)
+
+    if data["frame_count"] <= 0:
+        raise ValueError(f"Video seems empty or invalid: {video_path}")
+
+    data["version"] = INDEX_VERSION
+    data["source"] = _source_stamp(video_path)
+
+    try:
+        with open(index_path_for(video_path), "w") as f:
+            json.dump(data, f)
+    except OSError as e:
+        logger.warning(f"Could not write video index sidecar: {e}")
+
+    logger.info(f"Indexed {video_path}: {data['frame_count']} frames, {data['duration']:.2f}s, {len(data['keyframes'])} keyframes")
+    return VideoIndex(data)
+
+
+def load_video_index(video_path: str):
+    """Carga el sidecar si existe y sigue correspondiendo al archivo actual."""
+    path = index_path_for(video_path)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if data.get("version") != INDEX_VERSION or data.get("source") != _source_stamp(video_path):
+        return None
+    return VideoIndex(data)
+
+
+def get_video_index(video_path: str) -> VideoIndex:
+    """
+    Devuelve el índice del video: memoria -> sidecar -> construcción.
+    """
+    key = os.path.abspath(video_path)
+    stamp = _source_stamp(video_path)
+    with _cache_lock:
+        cached = _cache.get(key)
+    if cached is not None and cached.data.get("source") == stamp:
+        return cached
+
+    index = load_video_index(video_path) or build_video_index(video_path)
+    with _cache_lock:
+        _cache[key] = index
+    return index
+
+
+def seek_frame(cap, index: VideoIndex, frame_no: int, current_pos: int = None) -> int:
+    """
+    Posiciona `cap` para que el siguiente read() devuelva frame_no.
+    Salta al keyframe previo y avanza con grab(); si la posición actual ya está
+    en el mismo GOP, solo avanza sin volver a buscar.
+    Devuelve la posición alcanzada.
+    """
+    if not index.keyframes:
+        # Sin índice de keyframes solo avanzamos si el salto es corto (~1s)
+        if current_pos is None or not 0 <= frame_no - current_pos <= int(index.fps):
+            cap.set(cv2.CAP_PROP_POS_FRAMES, frame_no)
+            return frame_no
+    else:
+        keyframe = index.keyframe_before(frame_no)
+        if current_pos is None or current_pos > frame_no or current_pos < keyframe:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, keyframe)
+            current_pos = keyframe
+
+    while current_pos < frame_no:
+        if not cap.grab():
+            break
+        current_pos += 1
+    return current_pos
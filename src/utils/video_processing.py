@@ -1,8 +1,13 @@
 import cv2
 import os
+import json
 import logging
+import numpy as np
 import yt_dlp
 
+from src.config import Config
+from src.utils.video_index import get_video_index, seek_frame
+
 logger = logging.getLogger(__name__)
 
 def select_roi_from_video(video_path):
@@ -47,13 +52,14 @@ def create_focus_crop(video_path, output_path, roi, start_time=None, end_time=No
     """
     x, y, w, h = roi
     
+    index = get_video_index(video_path)
     cap = cv2.VideoCapture(video_path)
     if not cap.isOpened():
         raise ValueError("Could not open video.")
 
-    # Obtener propiedades del video original
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    # Propiedades del índice (fps y número exacto de frames)
+    fps = index.fps
+    total_frames = index.frame_count
     
     # Configurar escritor de video
     # Usamos mp4v como codec genérico
@@ -65,12 +71,12 @@ def create_focus_crop(video_path, output_path, roi, start_time=None, end_time=No
     end_frame = total_frames
     
     if start_time is not None:
-        start_frame = int(start_time * fps)
+        start_frame = index.frame_at(start_time)
     if end_time is not None:
-        end_frame = int(end_time * fps)
+        end_frame = min(int(end_time * fps), total_frames)
         
-    # Moverse al frame inicial
-    cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+    # Moverse al frame inicial (alineado al keyframe previo)
+    start_frame = seek_frame(cap, index, start_frame)
     
     current_frame = start_frame
     print(f"Processing crop... {output_path}")
@@ -95,20 +101,8 @@ def create_focus_crop(video_path, output_path, roi, start_time=None, end_time=No
     return output_path
 
 def get_video_duration(video_path):
-    """Obtiene la duración del video usando cv2."""
-    try:
-        cap = cv2.VideoCapture(video_path)
-        fps = cap.get(cv2.CAP_PROP_FPS)
-        frame_count = cap.get(cv2.CAP_PROP_FRAME_COUNT)
-        duration = frame_count / fps
-        cap.release()
-        return duration
-    except ImportError:
-        logger.warning("OpenCV not found, using default duration estimation.")
-        return 10.0
-    except Exception as e:
-        logger.warning(f"Could not determine video duration: {e}")
-        return 10.0
+    """Obtiene la duración del video desde su índice (sidecar en disco)."""
+    return get_video_index(video_path).duration
 
 def download_video(url: str, output_path: str = "temp_video.mp4") -> str:
     """Descarga un video desde una URL usando yt-dlp."""
@@ -128,49 +122,208 @@ def download_video(url: str, output_path: str = "temp_video.mp4") -> str:
     
     return os.path.abspath(output_path)
 
-def extract_frames(video_path: str, output_dir: str, num_frames: int = 100) -> list:
+FRAMES_MANIFEST = "frames.json"
+FRAME_SELECTIONS = ("uniform", "diverse")
+
+def _frame_signature(frame) -> np.ndarray:
+    """Histograma HSV (16x4x4) normalizado de una miniatura: barato y robusto a pequeños movimientos."""
+    width = Config.FRAME_SELECTION_SCAN_WIDTH
+    height = max(1, round(frame.shape[0] * width / frame.shape[1]))
+    small = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+    hsv = cv2.cvtColor(small, cv2.COLOR_BGR2HSV)
+    hist = cv2.calcHist([hsv], [0, 1, 2], None, [16, 4, 4], [0, 180, 0, 256, 0, 256]).flatten()
+    return hist / max(1.0, float(hist.sum()))
+
+def scan_frame_signatures(video_path: str, sample_step: int) -> tuple:
+    """
+    Una pasada secuencial (grab() para saltar, retrieve() cada `sample_step` frames).
+    Retorna (índices de frame, matriz de firmas N x 256).
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise ValueError("Could not open video.")
+
+    indices, signatures = [], []
+    frame_idx = 0
+    while cap.grab():
+        if frame_idx % sample_step == 0:
+            ret, frame = cap.retrieve()
+            if ret:
+                indices.append(frame_idx)
+                signatures.append(_frame_signature(frame))
+        frame_idx += 1
+    cap.release()
+
+    if not signatures:
+        return [], np.zeros((0, 256), dtype=np.float32)
+    return indices, np.stack(signatures)
+
+def select_diverse(signatures: np.ndarray, count: int) -> list:
+    """
+    Selección greedy del punto más lejano (distancia L1 entre histogramas):
+    cada frame elegido es el más distinto de todos los ya elegidos.
+    Arranca por el primero; retorna posiciones ordenadas.
     """
-    Extracts N evenly spaced frames from the video and saves them to the output directory.
+    total = len(signatures)
+    if total <= count:
+        return list(range(total))
+    chosen = [0]
+    distances = np.abs(signatures - signatures[0]).sum(axis=1)
+    while len(chosen) < count:
+        candidate = int(distances.argmax())
+        if distances[candidate] <= 0:
+            break  # El resto son idénticos a algo ya elegido
+        chosen.append(candidate)
+        distances = np.minimum(distances, np.abs(signatures - signatures[candidate]).sum(axis=1))
+    return sorted(chosen)
+
+def select_frame_indices(video_path: str, num_frames: int, selection: str = "uniform") -> list:
+    """Índices de frame a extraer, en orden: espaciados parejo o los más diversos."""
+    if selection not in FRAME_SELECTIONS:
+        raise ValueError(f"Unknown frame selection: {selection}")
+    total_frames = get_video_index(video_path).frame_count
+    if selection == "uniform":
+        step = max(1, total_frames // num_frames)
+        return [i * step for i in range(num_frames) if i * step < total_frames]
+
+    sample_step = max(1, total_frames // (num_frames * Config.FRAME_SELECTION_OVERSAMPLE))
+    indices, signatures = scan_frame_signatures(video_path, sample_step)
+    selected = [indices[i] for i in select_diverse(signatures, num_frames)]
+    logger.info(f"Selected {len(selected)} diverse frames out of {len(indices)} scanned ({total_frames} total)")
+    return selected
+
+def extract_frames(video_path: str, output_dir: str, num_frames: int = 100, on_frame=None,
+                   selection: str = "uniform") -> list:
+    """
+    Extracts up to N frames from the video and saves them to the output directory.
+    `selection` is "uniform" (evenly spaced) or "diverse" (most visually distinct frames).
+    `on_frame(filename, source)` is called as soon as each frame is written, with
+    source = {"frame": index, "timestamp": seconds}; the same mapping is saved in frames.json.
     Returns a list of filenames.
     """
     if not os.path.exists(output_dir):
         os.makedirs(output_dir, exist_ok=True)
 
+    index = get_video_index(video_path)
+    targets = select_frame_indices(video_path, num_frames, selection)
+
     cap = cv2.VideoCapture(video_path)
     if not cap.isOpened():
         raise ValueError("Could not open video.")
 
-    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    
-    # Handle cases where frame count is not available
-    if total_frames <= 0:
-        logger.warning("Could not determine total frames.")
-        # Try to read one frame to check if video is valid at least
-        ret, _ = cap.read()
-        if not ret:
-             cap.release()
-             raise ValueError("Video seems empty or invalid.")
-        # If we can't get total frames easily, we might just read sequentially (inefficient for long videos but safe)
-        # For now, let's assume we can get it or fail.
-        cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
-
-    step = max(1, total_frames // num_frames)
-    
     saved_files = []
+    sources = {}
+    position = None
     
-    for i in range(num_frames):
-        frame_idx = i * step
-        if frame_idx >= total_frames:
-            break
-            
-        cap.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
+    for i, frame_idx in enumerate(targets):
+        # Los frames se piden en orden: dentro del mismo GOP solo avanzamos con grab()
+        position = seek_frame(cap, index, frame_idx, position)
         ret, frame = cap.read()
         
         if ret:
+            position += 1
             filename = f"frame_{i:03d}.jpg"
             filepath = os.path.join(output_dir, filename)
             cv2.imwrite(filepath, frame)
             saved_files.append(filename)
+            sources[filename] = {"frame": frame_idx, "timestamp": round(index.time_of(frame_idx), 3)}
+            if on_frame:
+                on_frame(filename, sources[filename])
+        else:
+            position = None
             
     cap.release()
+
+    with open(os.path.join(output_dir, FRAMES_MANIFEST), "w") as f:
+        json.dump({"selection": selection, "frames": sources}, f)
     return saved_files
+
+def load_frames_manifest(output_dir: str) -> dict:
+    """{filename: {"frame", "timestamp"}} guardado por extract_frames ({} si no existe)."""
+    path = os.path.join(output_dir, FRAMES_MANIFEST)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f).get("frames", {})
+
+def generate_sprite_sheets(video_path: str, output_dir: str, interval: float = 1.0, tile_width: int = 160, columns: int = 10, rows_per_sheet: int = 10) -> dict:
+    """
+    Genera sprite sheets de miniaturas cada `interval` segundos en una sola pasada
+    secuencial de decodificación (grab() para saltar, retrieve() solo en los frames usados).
+    Guarda las hojas JPEG y un índice JSON (tile -> timestamp, hoja, posición) en output_dir.
+    Retorna el índice.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+
+    index = get_video_index(video_path)
+    fps = index.fps
+    total_frames = index.frame_count
+    tile_height = max(1, round(index.height * tile_width / index.width)) if index.width else tile_width
+    tiles_per_sheet = columns * rows_per_sheet
+
+    # Frames objetivo, en orden
+    step = max(1, int(round(interval * fps)))
+    targets = list(range(0, total_frames, step))
+
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise ValueError("Could not open video.")
+
+    sheets = []
+    tiles = []
+    sheet = None
+
+    def flush_sheet():
+        sheet_name = f"sheet_{len(sheets):03d}.jpg"
+        used_rows = (len(tiles) - len(sheets) * tiles_per_sheet + columns - 1) // columns
+        cv2.imwrite(os.path.join(output_dir, sheet_name), sheet[:used_rows * tile_height], [cv2.IMWRITE_JPEG_QUALITY, 80])
+        sheets.append(sheet_name)
+
+    current_frame = 0
+    for frame_idx in targets:
+        while current_frame < frame_idx:
+            if not cap.grab():
+                break
+            current_frame += 1
+        if current_frame != frame_idx or not cap.grab():
+            break
+        current_frame += 1
+        ret, frame = cap.retrieve()
+        if not ret:
+            break
+
+        slot = len(tiles) % tiles_per_sheet
+        if slot == 0:
+            if sheet is not None:
+                flush_sheet()
+            sheet = np.zeros((rows_per_sheet * tile_height, columns * tile_width, 3), dtype=np.uint8)
+
+        x = (slot % columns) * tile_width
+        y = (slot // columns) * tile_height
+        sheet[y:y + tile_height, x:x + tile_width] = cv2.resize(frame, (tile_width, tile_height), interpolation=cv2.INTER_AREA)
+        tiles.append({
+            "index": len(tiles),
+            "timestamp": round(index.time_of(frame_idx), 3),
+            "frame": frame_idx,
+            "sheet": len(sheets),
+            "x": x,
+            "y": y
+        })
+
+    cap.release()
+    if tiles:
+        flush_sheet()
+
+    sprite_index = {
+        "interval": interval,
+        "tile_width": tile_width,
+        "tile_height": tile_height,
+        "columns": columns,
+        "rows_per_sheet": rows_per_sheet,
+        "sheets": sheets,
+        "tiles": tiles
+    }
+    with open(os.path.join(output_dir, "index.json"), "w") as f:
+        json.dump(sprite_index, f)
+
+    return sprite_index
@@ -0,0 +1,76 @@
+import os
+import sys
+import json
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+Image = pytest.importorskip("PIL.Image")
+
+from src.services.dataset_materializer import DatasetMaterializer, completed_shards
+
+
+@pytest.fixture
+def local_dataset(tmp_path):
+    """Tiny on-disk dataset: 25 PNG files plus one record per image (as a plain list of dicts)."""
+    source_dir = tmp_path / "source"
+    source_dir.mkdir()
+    samples = []
+    for i in range(25):
+        path = source_dir / f"img_{i:02d}.png"
+        Image.new("RGBA", (8 + i, 6), (i * 10, 0, 0, 255)).save(path)
+        samples.append({"image": str(path), "instruction": f"click {i}"})
+    return samples
+
+
+def _failing_after(samples, count):
+    for i, sample in enumerate(samples):
+        if i == count:
+            raise ConnectionError("stream interrupted")
+        yield sample
+
+
+def _records(output_dir):
+    with open(os.path.join(output_dir, "raw_annotations.json")) as f:
+        return json.load(f)
+
+
+def test_materializes_images_and_shards(local_dataset, tmp_path):
+    output_dir = str(tmp_path / "out")
+    stats = DatasetMaterializer(output_dir, "fixture", shard_size=10, workers=2, source="fixture").run(local_dataset)
+
+    assert stats["written"] == 25
+    assert completed_shards(os.path.join(output_dir, "annotations")) == 3
+    records = _records(output_dir)
+    assert [r["instruction"] for r in records] == [f"click {i}" for i in range(25)]
+    assert records[3]["width"] == 11 and records[3]["height"] == 6
+    assert all(os.path.exists(os.path.join(output_dir, "images", r["file_name"])) for r in records)
+
+
+def test_resumes_after_source_failure(local_dataset, tmp_path):
+    output_dir = str(tmp_path / "out")
+    annotations_dir = os.path.join(output_dir, "annotations")
+
+    # The source breaks while reading the third chunk: the two chunks already read are kept
+    with pytest.raises(ConnectionError):
+        DatasetMaterializer(output_dir, "fixture", shard_size=10, workers=2, source="fixture").run(
+            _failing_after(local_dataset, 22)
+        )
+    assert completed_shards(annotations_dir) == 2
+
+    stats = DatasetMaterializer(output_dir, "fixture", shard_size=10, workers=2, source="fixture").run(iter(local_dataset))
+    assert stats["resumed_from"] == 20
+    assert stats["written"] == 5
+    records = _records(output_dir)
+    assert [r["instruction"] for r in records] == [f"click {i}" for i in range(25)]
+
+
+def test_refuses_resume_with_other_shard_size(local_dataset, tmp_path):
+    output_dir = str(tmp_path / "out")
+    with pytest.raises(ConnectionError):
+        DatasetMaterializer(output_dir, "fixture", shard_size=10, workers=2, source="fixture").run(
+            _failing_after(local_dataset, 15)
+        )
+    with pytest.raises(ValueError):
+        DatasetMaterializer(output_dir, "fixture", shard_size=5, workers=2, source="fixture").run(iter(local_dataset))
@@ -0,0 +1,40 @@
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.utils.json_recovery import recover_json
+
+
+COMPLETE_EVENT = '{"timestamp": "00:01", "action": "cast", "skill_used": {"key": "W"}}'
+
+
+def test_complete_json_with_prose():
+    value, complete = recover_json('Here you go:\n```json\n{"events": [' + COMPLETE_EVENT + ']}\n```')
+    assert complete
+    assert value == {"events": [{"timestamp": "00:01", "action": "cast", "skill_used": {"key": "W"}}]}
+
+
+def test_truncated_inside_event_drops_partial_event():
+    text = '{"events": [' + COMPLETE_EVENT + ', {"timestamp": "00:02", "skill_used": {"key": "Q"}, "act'
+    value, complete = recover_json(text)
+    assert not complete
+    assert value == {"events": [{"timestamp": "00:01", "action": "cast", "skill_used": {"key": "W"}}]}
+
+
+def test_truncated_top_level_array_keeps_complete_items():
+    text = '[' + COMPLETE_EVENT + ', ' + COMPLETE_EVENT + ', {"timestamp": "00:03", "skill_used": {"ke'
+    value, complete = recover_json(text)
+    assert not complete
+    assert len(value) == 2
+    assert all("action" in event for event in value)
+
+
+def test_truncated_after_complete_array_member_of_root():
+    text = '{"events": [' + COMPLETE_EVENT + '], "summary": "Two ca'
+    value, _ = recover_json(text)
+    assert value == {"events": [{"timestamp": "00:01", "action": "cast", "skill_used": {"key": "W"}}]}
+
+
+def test_nothing_complete_returns_none():
+    assert recover_json('{"events": [{"timestamp": "00:0') == (None, False)
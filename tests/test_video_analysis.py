@@ -21,6 +21,7 @@ def main():
     parser = argparse.ArgumentParser(description="PixelSense Video Analysis Tool")
     parser.add_argument("video_path", nargs="?", help="URL del video o ruta local del archivo")
     parser.add_argument("--detail", "-d", default="medium", choices=["low", "medium", "high", "max"], help="Nivel de detalle del análisis")
+    parser.add_argument("--output-dir", "-o", default=None, help="Modo streaming: escribe segmentos, eventos y reporte en este directorio sin acumularlos en memoria")
     args = parser.parse_args()
 
     # Selección de video
@@ -80,27 +81,34 @@ def main():
     print(f"✂️  Starting analysis with detail level: {detail_level}")
     
     # Run Analysis
-    final_json, segment_results = analyzer.analyze_video(video_path, detail=detail_level, roi=roi)
-    
-    if final_json:
-        print("\n✅ Final Analysis Result:\n")
-        print(final_json)
+    if args.output_dir:
+        report_path, segments_path = analyzer.analyze_video(video_path, detail=detail_level, roi=roi, output_dir=args.output_dir)
+        print(f"\n✅ Report saved to {report_path}")
+        print(f"Raw segment logs saved to {segments_path}")
+    else:
+        final_report, segment_results = analyzer.analyze_video(video_path, detail=detail_level, roi=roi)
         
-        with open("video_analysis_result.json", "w") as f:
-            f.write(final_json)
-            print("\nResult saved to video_analysis_result.json")
+        if final_report:
+            # Serializar una sola vez para imprimir y guardar
+            final_json = json.dumps(final_report, indent=2)
+            print("\n✅ Final Analysis Result:\n")
+            print(final_json)
+            
+            with open("video_analysis_result.json", "w") as f:
+                f.write(final_json)
+                print("\nResult saved to video_analysis_result.json")
 
-        # Guardar logs crudos
-        logs_data = {
-            "detail_level": detail_level,
-            "video_duration": duration,
-            "segments": segment_results
-        }
-        with open("analysis_logs.json", "w") as f:
-            json.dump(logs_data, f, indent=2)
-            print("Raw logs saved to analysis_logs.json")
-    else:
-        print("Analysis failed.")
+            # Guardar logs crudos
+            logs_data = {
+                "detail_level": detail_level,
+                "video_duration": duration,
+                "segments": segment_results
+            }
+            with open("analysis_logs.json", "w") as f:
+                json.dump(logs_data, f, indent=2)
+                print("Raw logs saved to analysis_logs.json")
+        else:
+            print("Analysis failed.")
 
     # Limpieza
     if video_source.startswith("http") and os.path.exists(video_path):
@@ -41,7 +41,7 @@ export default function ComparisonView({ suiteId, suiteData }) {
               {result.image_url && (
                 <div className="rounded-lg overflow-hidden border border-gray-200 dark:border-gray-700 bg-black/5 relative group">
                   <img 
-                    src={`${API_BASE_URL}${result.image_url}`} 
+                    src={`${API_BASE_URL}${result.preview_url || result.image_url}`} 
                     alt="Result" 
                     className="w-full object-contain cursor-pointer"
                     onClick={() => setSelectedImage(`${API_BASE_URL}${result.image_url}`)}
@@ -16,6 +16,8 @@ export default function ConfigBuilder({ onRunSuite }) {
       image_path: "",
       allowed_actions: ['click', 'drag'],
       refinement: false,
+      coarse_to_fine: false,
+      tiled: false,
       prompt_template: ""
     }
   ]);
@@ -174,6 +176,24 @@ export default function ConfigBuilder({ onRunSuite }) {
                       />
                       <span className="text-sm font-medium">Gemini Refinement</span>
                    </label>
+                   <label className="flex items-center space-x-2 cursor-pointer ml-4">
+                      <input 
+                        type="checkbox" 
+                        checked={config.coarse_to_fine}
+                        onChange={(e) => updateConfig(config.id, 'coarse_to_fine', e.target.checked)}
+                        className="form-checkbox h-4 w-4 text-blue-600"
+                      />
+                      <span className="text-sm font-medium">Coarse-to-Fine</span>
+                   </label>
+                   <label className="flex items-center space-x-2 cursor-pointer ml-4">
+                      <input 
+                        type="checkbox" 
+                        checked={config.tiled}
+                        onChange={(e) => updateConfig(config.id, 'tiled', e.target.checked)}
+                        className="form-checkbox h-4 w-4 text-blue-600"
+                      />
+                      <span className="text-sm font-medium">Tiled</span>
+                   </label>
                 </div>
               </div>
 
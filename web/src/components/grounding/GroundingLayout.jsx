@@ -23,14 +23,28 @@ export default function GroundingLayout() {
       const data = await response.json();
       setCurrentSuiteId(data.suite_id);
 
-      // Poll for results or fetch immediately since our backend is sync for now
-      // In a real async backend, we would poll here.
-      // Fetch details
-      const detailsRes = await fetch(`${API_BASE_URL}/grounding/runs/${data.suite_id}`);
-      const detailsData = await detailsRes.json();
-      
-      setSuiteResults(detailsData.configs);
-      setView('results');
+      // The suite runs as a background job: show each config as soon as it finishes
+      const partial = [];
+      const ws = new WebSocket(`${API_BASE_URL.replace(/^http/, 'ws')}/grounding/runs/${data.suite_id}/stream`);
+      ws.onmessage = async (event) => {
+        const message = JSON.parse(event.data);
+        if (message.type === 'result') {
+          partial.push(message.result);
+          partial.sort((a, b) => a.config_index - b.config_index);
+          setSuiteResults([...partial]);
+          setView('results');
+        } else if (message.type === 'done') {
+          ws.close();
+          // Fetch details (final summary, in config order)
+          const detailsRes = await fetch(`${API_BASE_URL}/grounding/runs/${data.suite_id}`);
+          const detailsData = await detailsRes.json();
+          setSuiteResults(detailsData.configs);
+          setView('results');
+        }
+      };
+      ws.onerror = (error) => {
+        console.error("Result stream failed", error);
+      };
     } catch (error) {
       console.error("Execution failed", error);
       alert("Execution failed. Check console.");
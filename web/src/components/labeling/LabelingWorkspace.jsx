@@ -12,6 +12,8 @@ export default function LabelingWorkspace() {
   const [labels, setLabels] = useState({}); // { frame_filename: [ {x,y,w,h,label} ] }
   const [loading, setLoading] = useState(false);
   const [selectedFrame, setSelectedFrame] = useState(null); // URL of frame being edited
+  const [extracting, setExtracting] = useState(false); // Frames still arriving from the server
+  const [diverseFrames, setDiverseFrames] = useState(false); // Opt-in: scans the whole video before the first frame
 
   const handleUploadComplete = async (filename) => {
     setLoading(true);
@@ -19,13 +21,14 @@ export default function LabelingWorkspace() {
       const res = await fetch(`${API_BASE}/labeling/init`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ filename, num_frames: 100 })
+        body: JSON.stringify({ filename, num_frames: 100, selection: diverseFrames ? 'diverse' : 'uniform' })
       });
       if (!res.ok) throw new Error('Init failed');
       const data = await res.json();
       setJobId(data.job_id);
       setFrames(data.frames);
       setStep('labeling');
+      if (data.status === 'extracting') streamFrames(data.job_id);
     } catch (err) {
       console.error(err);
       alert("Failed to initialize labeling job");
@@ -34,6 +37,21 @@ export default function LabelingWorkspace() {
     }
   };
 
+  // Frames are appended as the server extracts them
+  const streamFrames = (id) => {
+    setExtracting(true);
+    const ws = new WebSocket(`${API_BASE.replace(/^http/, 'ws')}/labeling/ws/${id}/frames`);
+    ws.onmessage = (event) => {
+      const msg = JSON.parse(event.data);
+      if (msg.type === 'frames') {
+        setFrames(prev => [...prev, ...msg.frames]);
+      } else if (msg.type === 'error') {
+        alert(`Frame extraction failed: ${msg.message}`);
+      }
+    };
+    ws.onclose = () => setExtracting(false);
+  };
+
   const openLabelModal = (frameUrl) => {
     setSelectedFrame(frameUrl);
   };
@@ -42,8 +60,39 @@ export default function LabelingWorkspace() {
     const filename = selectedFrame.split('/').pop();
     setLabels(prev => ({ ...prev, [filename]: annotations }));
     setSelectedFrame(null);
+    // Append-only autosave of just this frame
+    fetch(`${API_BASE}/labeling/autosave`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ job_id: jobId, labels: [{ frame: filename, boxes: annotations }] })
+    }).catch(err => console.error('Autosave failed', err));
   };
 
+  // Each frame is shown as soon as its prediction arrives
+  const streamPredictions = (payload) => new Promise((resolve, reject) => {
+    const ws = new WebSocket(`${API_BASE.replace(/^http/, 'ws')}/labeling/ws/predict`);
+    let settled = false;
+    ws.onopen = () => ws.send(JSON.stringify(payload));
+    ws.onmessage = (event) => {
+      const msg = JSON.parse(event.data);
+      if (msg.type === 'prediction') {
+        setLabels(prev => ({ ...prev, [msg.prediction.frame]: msg.prediction.boxes }));
+      } else if (msg.type === 'done') {
+        settled = true;
+        resolve(msg.stats);
+        ws.close();
+      } else if (msg.type === 'error') {
+        settled = true;
+        reject(new Error(msg.message));
+        ws.close();
+      }
+    };
+    ws.onerror = () => reject(new Error('Prediction stream failed'));
+    ws.onclose = () => {
+      if (!settled) reject(new Error('Prediction stream closed before finishing'));
+    };
+  });
+
   const runAutoLabel = async (testSingle = false) => {
     const labeledCount = Object.keys(labels).length;
     if (labeledCount < 1) {
@@ -88,6 +137,13 @@ export default function LabelingWorkspace() {
         .filter(([frame, _]) => !targets.includes(frame))
         .map(([frame, boxes]) => ({ frame, boxes }));
 
+      if (!testSingle) {
+          // Bulk runs track boxes locally between neighbouring frames; only keyframes go to the model
+          const stats = await streamPredictions({ job_id: jobId, examples, targets, propagate: true });
+          alert(`Auto-labeled ${stats.propagated + stats.model} frames (${stats.propagated} propagated locally, ${stats.model} by the model)!`);
+          return;
+      }
+
       const res = await fetch(`${API_BASE}/labeling/predict`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
@@ -101,14 +157,10 @@ export default function LabelingWorkspace() {
         newLabels[p.frame] = p.boxes;
       });
       setLabels(newLabels);
-      if (testSingle) {
-          const testedFrame = data.predictions[0]?.frame;
-          const testedFrameUrl = frames.find(url => url.endsWith(testedFrame));
-          if (testedFrameUrl) {
-             openLabelModal(testedFrameUrl);
-          }
-      } else {
-          alert(`Auto-labeled ${data.predictions.length} frames!`);
+      const testedFrame = data.predictions[0]?.frame;
+      const testedFrameUrl = frames.find(url => url.endsWith(testedFrame));
+      if (testedFrameUrl) {
+         openLabelModal(testedFrameUrl);
       }
     } catch (err) {
       console.error(err);
@@ -125,10 +177,11 @@ export default function LabelingWorkspace() {
       const res = await fetch(`${API_BASE}/labeling/save`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ job_id: jobId, labels: labelList })
+        body: JSON.stringify({ job_id: jobId, labels: labelList, formats: ['coco', 'yolo', 'shards'] })
       });
       if (!res.ok) throw new Error('Save failed');
-      alert("Dataset saved successfully!");
+      const data = await res.json();
+      alert(`Dataset saved! COCO/YOLO/shard export running in the background (job ${data.export_job_id}).`);
     } catch (err) {
       console.error(err);
       alert("Failed to save");
@@ -150,6 +203,12 @@ export default function LabelingWorkspace() {
         <div>
           <h1 className="text-2xl font-bold text-gray-900 dark:text-white">AI Labeling Assistant</h1>
           <p className="text-gray-500">Extract frames, label a few, and let AI do the rest.</p>
+          {extracting && (
+            <p className="flex items-center gap-2 text-sm text-blue-500 mt-1">
+              <Loader className="animate-spin" size={14} />
+              Extracting frames... ({frames.length} so far)
+            </p>
+          )}
         </div>
         {step === 'labeling' && (
             <div className="flex gap-2">
@@ -164,7 +223,7 @@ export default function LabelingWorkspace() {
                 </button>
                 <button 
                     onClick={() => runAutoLabel(false)}
-                    disabled={loading}
+                    disabled={loading || extracting}
                     className="flex items-center gap-2 px-4 py-2 bg-purple-600 hover:bg-purple-700 text-white rounded-lg disabled:opacity-50"
                 >
                     {loading ? <Loader className="animate-spin" size={18} /> : <Play size={18} />}
@@ -190,7 +249,18 @@ export default function LabelingWorkspace() {
                     <p className="text-lg text-gray-600">Extracting frames from video...</p>
                 </div>
             ) : (
-                <VideoUploader onUploadComplete={handleUploadComplete} />
+                <>
+                    <VideoUploader onUploadComplete={handleUploadComplete} />
+                    <label className="flex items-center gap-2 mt-4 text-sm text-gray-600 dark:text-gray-300">
+                        <input
+                            type="checkbox"
+                            checked={diverseFrames}
+                            onChange={(e) => setDiverseFrames(e.target.checked)}
+                        />
+                        Pick the most varied frames instead of evenly spaced ones
+                        (frames appear after a full scan; fewer labels propagate between neighbours)
+                    </label>
+                </>
             )}
         </div>
       )}